@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+"""Benchmark of ``upsert_multiple_data`` on synthetic tables.
+
+Creates a table per dataset kind (``bench_narrow``, ``bench_wide``,
+``bench_json``, ``bench_array`` and, with PostGIS, ``bench_geometry`` and
+``bench_polygon``), seeds half of the keys plus some keys absent from the
+input, and upserts a generated dataset for every combination of kind, row
+count, import method, page size and transfer; the geometry kinds also run
+per geometry format (WKT text or binary WKB). Every case reports rows/s, CPU time, peak
+memory (RSS) and the number of statements sent, and runs in a fresh Python
+process so its peak memory is its own. The tables are dropped afterwards;
+run it against a scratch database.
+
+Usage::
+
+    python benchmarks/upsert_benchmark.py --rows 1000 100000 --output upsert.json
+    python benchmarks/upsert_benchmark.py --compare upsert-0.5.0.json --output upsert.json
+
+``--compare`` lists the cases whose throughput dropped more than
+``--tolerance`` against an earlier result file and exits with status 1
+when there are any, so it can guard the import path between releases.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from functools import cache
+
+from django.apps.registry import Apps
+
+KINDS = ("narrow", "wide", "json", "array", "geometry", "polygon")
+METHODS = ("overwrite", "only_new", "only_update", "replace")
+TRANSFERS = ("values", "copy", "copy_text")
+GEOMETRY_FORMATS = ("wkt", "wkb")
+GEOMETRY_KINDS = ("geometry", "polygon")
+
+# vertices of the outer ring of a ``polygon`` row
+POLYGON_VERTICES = 200
+
+BASE_DATE = datetime.date(2000, 1, 1)
+
+# registry of the synthetic models
+BENCH_APPS = Apps()
+
+
+def setup_django():
+    """Initialise Django with the test settings, unless ``DJANGO_SETTINGS_MODULE`` points elsewhere."""
+    import django
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.testapp.settings_test")
+    django.setup()
+
+
+@cache
+def get_model(kind: str):
+    """Return the unmanaged synthetic model of dataset *kind*.
+
+    The models live in a registry of their own, so they don't show up in
+    ``apps.get_models()`` of the project (exports, metadata, ...).
+    """
+    from rgs_django_utils.database import dj_extended_models as models
+
+    fields = {
+        "code": models.BigIntegerField(unique=True),
+        "name": models.TextField(null=True),
+        "value": models.IntegerField(null=True),
+    }
+    if kind == "wide":
+        fields.update({f"num_{i}": models.FloatField(null=True) for i in range(10)})
+        fields.update({f"int_{i}": models.IntegerField(null=True) for i in range(10)})
+        fields.update({f"txt_{i}": models.TextField(null=True) for i in range(8)})
+        fields.update({"flag": models.BooleanField(null=True), "day": models.DateField(null=True)})
+    elif kind == "json":
+        fields["data"] = models.JSONField(null=True)
+    elif kind == "array":
+        fields["tags"] = models.ArrayField(models.IntegerField(), null=True)
+    elif kind == "geometry":
+        fields["geom"] = models.PointField(srid=28992, null=True)
+    elif kind == "polygon":
+        fields["geom"] = models.MultiPolygonField(srid=28992, null=True)
+    elif kind != "narrow":
+        raise ValueError(f"unknown dataset kind {kind}")
+
+    meta = type(
+        "Meta", (), {"app_label": "testapp", "db_table": f"bench_{kind}", "managed": False, "apps": BENCH_APPS}
+    )
+    return type(f"Bench{kind.capitalize()}", (models.Model,), {"__module__": __name__, "Meta": meta, **fields})
+
+
+def get_field_names(kind: str) -> list:
+    """Return the columns of dataset *kind* in row order, the identification column ``code`` first."""
+    return [field.name for field in get_model(kind)._meta.concrete_fields if not field.primary_key]
+
+
+def iter_rows(kind: str, count: int, geometry_format: str = "wkt"):
+    """Yield *count* deterministic rows of dataset *kind*, ordered like :func:`get_field_names`.
+
+    The polygons are shapely geometries, passed as is for ``"wkb"`` and as
+    their WKT for ``"wkt"``, so both formats include their encoding.
+    """
+    import shapely
+    from psycopg.types.json import Json
+
+    for i in range(count):
+        row = [i, f"name {i}", i * 7 % 1000]
+        if kind == "wide":
+            row += [i / (k + 1) for k in range(10)]
+            row += [i + k for k in range(10)]
+            row += [f"text {k} of row {i}" for k in range(8)]
+            row += [i % 2 == 0, BASE_DATE + datetime.timedelta(days=i % 10000)]
+        elif kind == "json":
+            row.append(Json({"i": i, "label": f"row {i}", "tags": ["a", "b", "c"], "nested": {"x": i / 3}}))
+        elif kind == "array":
+            row.append([i, i + 1, i + 2, i + 3])
+        elif kind == "geometry":
+            row.append(f"POINT({100000 + i % 1000} {400000 + i // 1000})")
+        elif kind == "polygon":
+            centre = shapely.Point(100000 + i % 1000 * 10, 400000 + i // 1000 * 10)
+            polygon = shapely.MultiPolygon([centre.buffer(4, quad_segs=POLYGON_VERTICES // 4)])
+            row.append(polygon if geometry_format == "wkb" else polygon.wkt)
+        yield row
+
+
+def has_postgis() -> bool:
+    """Return ``True`` when the PostGIS extension is installed in the database."""
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")
+        return cursor.fetchone() is not None
+
+
+def create_tables(kinds):
+    """Create the tables of *kinds*, replacing leftovers of an interrupted run."""
+    from django.db import connection
+
+    drop_tables(kinds)
+    with connection.schema_editor() as editor:
+        for kind in kinds:
+            editor.create_model(get_model(kind))
+
+
+def drop_tables(kinds):
+    """Drop the tables of *kinds*."""
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        for kind in kinds:
+            cursor.execute(f"DROP TABLE IF EXISTS bench_{kind}")
+
+
+def seed_table(kind: str, rows: int):
+    """Fill ``bench_{kind}`` with every even key of the input and ``rows // 4`` keys absent from it.
+
+    Only the key is seeded, so the upsert updates every other column.
+    """
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE bench_{kind} RESTART IDENTITY")
+        cursor.execute(
+            f"INSERT INTO bench_{kind} (code) "
+            "SELECT g FROM generate_series(0, %s - 1, 2) g UNION ALL SELECT g FROM generate_series(%s, %s - 1) g",
+            [rows, rows, rows + rows // 4],
+        )
+        cursor.execute(f"ANALYZE bench_{kind}")
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident memory of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class StatementCounter:
+    """Django execute wrapper counting the statements sent (a COPY stream is not counted)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_case(case: dict) -> dict:
+    """Seed the table and run one upsert *case*; return the case with its measurements."""
+    from django.db import connection
+
+    from rgs_django_utils.database.upsert_multiple_data import upsert_multiple_data
+
+    kind, rows = case["kind"], case["rows"]
+    geometry_format = case.get("geometry_format", "wkt")
+    seed_table(kind, rows)
+    field_names = get_field_names(kind)
+
+    counter = StatementCounter()
+    start_rss = peak_rss_mb()
+    with connection.execute_wrapper(counter):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        stats = upsert_multiple_data(
+            get_model(kind),
+            iter_rows(kind, rows, geometry_format),
+            field_names,
+            field_names,
+            ["code"],
+            method=case["method"],
+            page_size=case["page_size"],
+            transfer=case["transfer"],
+            geometry_format=geometry_format,
+        )
+        seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - start_cpu
+
+    return {
+        **case,
+        "seconds": round(seconds, 4),
+        "cpu_seconds": round(cpu_seconds, 4),
+        "rows_per_s": round(rows / seconds, 1),
+        "start_rss_mb": round(start_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "statements": counter.count,
+        "stats": stats.as_dict(),
+    }
+
+
+def run_case_in_subprocess(case: dict) -> dict:
+    """Run :func:`run_case` in a fresh interpreter, so the peak memory belongs to this case only."""
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        return {**case, "error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def get_meta() -> dict:
+    """Return the versions and environment the results were measured with."""
+    import django
+    import psycopg
+    from django.db import connection
+
+    import rgs_django_utils
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    with connection.cursor() as cursor:
+        server_version = cursor.connection.info.server_version
+
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "rgs_django_utils": rgs_django_utils.__version__,
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "django": django.__version__,
+        "psycopg": psycopg.__version__,
+        "postgres": server_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def case_key(result: dict) -> tuple:
+    # result files without a geometry format are WKT runs
+    return (
+        result["kind"],
+        result["rows"],
+        result["method"],
+        result["page_size"],
+        result["transfer"],
+        result.get("geometry_format", "wkt"),
+    )
+
+
+def compare(previous: dict, results: list, tolerance: float) -> list:
+    """Return ``(key, previous rows/s, current rows/s)`` of the cases slower than ``1 - tolerance`` times before."""
+    before = {case_key(result): result for result in previous["results"] if "rows_per_s" in result}
+    regressions = []
+    for result in results:
+        old = before.get(case_key(result))
+        if old is not None and "rows_per_s" in result and result["rows_per_s"] < old["rows_per_s"] * (1 - tolerance):
+            regressions.append((case_key(result), old["rows_per_s"], result["rows_per_s"]))
+    return regressions
+
+
+def format_result(result: dict) -> str:
+    case = "{:<9} {:>8} {:<12} {:>6} {:<10} {:<3}".format(*case_key(result))
+    if "error" in result:
+        return f"{case} ERROR {result['error']}"
+    return (
+        f"{case} {result['rows_per_s']:>11,.0f} rows/s {result['cpu_seconds']:>8.2f}s cpu "
+        f"{result['peak_rss_mb']:>8.1f} MB {result['statements']:>6} statements"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--rows", nargs="+", type=int, default=[1000])
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--page-sizes", nargs="+", type=int, default=[1000])
+    parser.add_argument("--transfers", nargs="+", choices=TRANSFERS, default=["values", "copy"])
+    parser.add_argument(
+        "--geometry-formats",
+        nargs="+",
+        choices=GEOMETRY_FORMATS,
+        default=list(GEOMETRY_FORMATS),
+        help="geometry formats of the geometry datasets (the other datasets ignore it)",
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="result file of an earlier run to compare rows/s with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed rows/s drop for --compare (0.2 = 20%%)")
+    parser.add_argument(
+        "--in-process", action="store_true", help="run the cases in this process (peak memory is cumulative)"
+    )
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+
+    kinds = list(args.kinds)
+    if any(kind in GEOMETRY_KINDS for kind in kinds) and not has_postgis():
+        print("PostGIS is not installed, skipping the geometry datasets", file=sys.stderr)
+        kinds = [kind for kind in kinds if kind not in GEOMETRY_KINDS]
+
+    create_tables(kinds)
+    results = []
+    try:
+        for kind, rows, method, page_size, transfer in itertools.product(
+            kinds, args.rows, args.methods, args.page_sizes, args.transfers
+        ):
+            for geometry_format in args.geometry_formats if kind in GEOMETRY_KINDS else ["wkt"]:
+                case = {
+                    "kind": kind,
+                    "rows": rows,
+                    "method": method,
+                    "page_size": page_size,
+                    "transfer": transfer,
+                    "geometry_format": geometry_format,
+                }
+                result = run_case(case) if args.in_process else run_case_in_subprocess(case)
+                print(format_result(result), flush=True)
+                results.append(result)
+    finally:
+        drop_tables(kinds)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": get_meta(), "results": results}, f, indent=2)
+
+    failed = any("error" in result for result in results)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for key, old, new in regressions:
+            print(f"REGRESSION {' '.join(map(str, key))}: {old:,.0f} -> {new:,.0f} rows/s", file=sys.stderr)
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
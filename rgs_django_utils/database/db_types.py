@@ -27,6 +27,9 @@ class ImportMethod:
 class RecordMergeMethod:
     """Per-record strategies for merging new values into an existing row.
 
+    Used as ``merge_method`` of the upsert helpers, where the merge
+    strategies become ``COALESCE`` expressions in the set-based update.
+
     Attributes
     ----------
     REPLACE : str
@@ -42,3 +45,128 @@ class RecordMergeMethod:
     REPLACE = "replace"
     MERGE_NEW_LEADING = "merge_new_leading"
     MERGE_EXISTING_LEADING = "merge_existing_leading"
+
+
+class TransferMethod:
+    """How the upsert helpers move in-memory rows into the staging table.
+
+    Attributes
+    ----------
+    VALUES : str
+        Render every row client-side with ``cursor.mogrify`` and send the
+        page as one ``INSERT ... VALUES`` statement (default).
+    COPY : str
+        Stream rows with psycopg's ``cursor.copy()``. The binary COPY
+        format is used when every staging column type has a binary
+        adapter; otherwise the text format is used. Binary transfer
+        expects native Python values (``uuid.UUID``, ``datetime``,
+        ``int``, ...) for typed columns.
+    COPY_TEXT : str
+        Stream rows with ``cursor.copy()`` in text format. Slower than
+        binary, but like ``VALUES`` it lets Postgres coerce loosely typed
+        input such as numbers or uuids passed as strings.
+    COPY_CSV : str
+        Stream pages of a pandas ``DataFrame`` with ``DataFrame.to_csv``
+        into ``COPY ... (FORMAT csv)``. Used by :func:`upsert_dataframe`;
+        pages are DataFrames instead of lists of rows.
+    """
+
+    VALUES = "values"
+    COPY = "copy"
+    COPY_TEXT = "copy_text"
+    COPY_CSV = "copy_csv"
+
+
+class GeometryFormat:
+    """Encoding of geometry values sent to the staging table.
+
+    Attributes
+    ----------
+    WKT : str
+        Well-known text, converted with ``ST_GeomFromText`` (default).
+    WKB : str
+        Well-known binary (``bytes``), staged as ``bytea`` and converted
+        with ``ST_GeomFromWKB`` using the SRID of the target column.
+    """
+
+    WKT = "wkt"
+    WKB = "wkb"
+
+
+class StagingMode:
+    """Lifecycle of the staging table used by :func:`upsert_multiple_data`.
+
+    Attributes
+    ----------
+    PER_PAGE : str
+        Create, fill, merge and drop a staging table for every page, each
+        page in its own transaction (default).
+    REUSE : str
+        Create the staging table and its index once per call and truncate
+        it between pages. Pages are still merged and committed one by
+        one, so the target table is only locked per page.
+    SINGLE_MERGE : str
+        Load every page into one staging table and merge it in a single
+        transaction. Highest throughput and all-or-nothing, but the target
+        table is locked for the whole merge and the staging table holds
+        the complete input.
+    """
+
+    PER_PAGE = "per_page"
+    REUSE = "reuse"
+    SINGLE_MERGE = "single_merge"
+
+
+class DuplicateMode:
+    """Handling of input rows with the same identification values, in :func:`upsert_multiple_data`.
+
+    Attributes
+    ----------
+    NONE : str
+        Merge the rows as they are (default). ``MERGE`` (Postgres 17+)
+        raises an error on duplicate keys within one page.
+    KEEP_FIRST : str
+        Keep the first row of every key in the staging table and drop the
+        others before the merge.
+    KEEP_LAST : str
+        Keep the last row of every key and drop the others.
+    """
+
+    NONE = "none"
+    KEEP_FIRST = "keep_first"
+    KEEP_LAST = "keep_last"
+
+
+class UnresolvedLookup:
+    """Handling of natural keys without a related row, for ``lookup`` columns of :func:`upsert_from_existing_data`.
+
+    Attributes
+    ----------
+    RAISE : str
+        Raise ``UnresolvedLookupError`` with all unresolved keys before
+        anything is written (default).
+    SET_NULL : str
+        Write ``NULL`` for unresolved keys and log them.
+    """
+
+    RAISE = "raise"
+    SET_NULL = "set_null"
+
+
+class RowErrorMode:
+    """Handling of rows that fail to upsert, in :func:`upsert_multiple_data`.
+
+    Attributes
+    ----------
+    RAISE : str
+        Roll back the failing page and raise; pages merged before it stay
+        committed (default).
+    ISOLATE : str
+        Bisect a page that fails with a data or integrity error, merging
+        the halves under savepoints until the failing rows are isolated.
+        The failing rows are reported in ``UpsertStats.rejects`` and the
+        import continues with the next page.
+    """
+
+    RAISE = "raise"
+    ISOLATE = "isolate"
@@ -950,7 +950,7 @@ class GeneratedField(base_models.GeneratedField, FieldConfig):
 
 
 class UUIDField(base_models.UUIDField, FieldConfig):
-    pd_type = pd.StringDtype  # klopt dit of is het een Object?
+    pd_type = pd.StringDtype()
     sql_alchemy_type = sql_types.UUID()
 
     def __init__(self, *args, **kwargs):
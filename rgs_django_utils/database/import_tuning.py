@@ -0,0 +1,109 @@
+import contextlib
+import re
+import typing
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from psycopg import sql
+
+# a Postgres setting, optionally with a prefix for application settings (tapp.skip_recalc_flagging)
+_SETTING_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$")
+
+TuningProfile = typing.Union[str, typing.Mapping[str, typing.Any], typing.Tuple[typing.Tuple[str, str], ...], None]
+
+
+def get_tuning_profile(profile: TuningProfile) -> typing.Tuple[typing.Tuple[str, str], ...]:
+    """Return the ``(setting, value)`` pairs of the import tuning *profile*.
+
+    Parameters
+    ----------
+    profile : str, dict, tuple or None
+        Name of a profile in ``settings.IMPORT_TUNING_PROFILES``, a
+        ``{setting: value}`` dict, or the pairs returned by an earlier
+        call. ``None`` is the empty profile.
+
+    Returns
+    -------
+    tuple of tuple
+        Hashable ``(setting, value)`` pairs, values as strings (booleans
+        as ``on`` / ``off``).
+
+    Raises
+    ------
+    ValueError
+        If the profile is not defined, or a setting name is not a valid
+        Postgres setting name.
+
+    Examples
+    --------
+    >>> get_tuning_profile({"synchronous_commit": False, "work_mem": "256MB"})
+    (('synchronous_commit', 'off'), ('work_mem', '256MB'))
+    """
+    if profile is None:
+        return ()
+    if isinstance(profile, str):
+        profiles = getattr(settings, "IMPORT_TUNING_PROFILES", {})
+        if profile not in profiles:
+            raise ValueError(f"import tuning profile {profile!r} is not defined in settings.IMPORT_TUNING_PROFILES")
+        profile = profiles[profile]
+
+    pairs = []
+    for name, value in dict(profile).items():
+        if not _SETTING_NAME.match(name):
+            raise ValueError(f"invalid setting name {name!r} in import tuning profile")
+        if isinstance(value, bool):
+            value = "on" if value else "off"
+        pairs.append((name, str(value)))
+    return tuple(pairs)
+
+
+def get_tuning_sql(profile: TuningProfile) -> sql.Composable:
+    """Return the ``SET LOCAL`` statements of *profile* (see :func:`get_tuning_profile`).
+
+    The statements only last until the end of the current transaction.
+    """
+    return sql.SQL("\n").join(
+        sql.SQL("SET LOCAL {name} TO {value};").format(name=sql.SQL(name), value=sql.Literal(value))
+        for name, value in get_tuning_profile(profile)
+    )
+
+
+@contextlib.contextmanager
+def import_tuning(profile: TuningProfile, using: str = DEFAULT_DB_ALIAS):
+    """Run the block in a transaction with the settings of the import tuning *profile*.
+
+    Profiles are declared once in the Django settings, for instance::
+
+        IMPORT_TUNING_PROFILES = {
+            "bulk": {
+                "synchronous_commit": "off",
+                "work_mem": "256MB",
+                "maintenance_work_mem": "1GB",
+                "tapp.skip_recalc_flagging": "true",
+            },
+        }
+
+    The settings are applied with ``SET LOCAL``, so they end with the
+    transaction. The block runs in ``transaction.atomic(using)``; inside
+    an outer atomic block the settings last until the outer transaction
+    ends. The upsert helpers manage their own transactions and take the
+    profile as their ``tuning`` parameter instead.
+
+    Parameters
+    ----------
+    profile : str, dict, tuple or None
+        See :func:`get_tuning_profile`.
+    using : str, optional
+        Database alias. Default is ``"default"``.
+
+    Examples
+    --------
+    >>> with import_tuning("bulk"):                          # doctest: +SKIP
+    ...     Measurement.objects.bulk_create(measurements)
+    """
+    profile = get_tuning_profile(profile)
+    with transaction.atomic(using=using):
+        if profile:
+            with connections[using].cursor() as cursor:
+                cursor.execute(get_tuning_sql(profile))
+        yield
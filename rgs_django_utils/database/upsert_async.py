@@ -0,0 +1,572 @@
+import contextlib
+import logging
+import time
+import typing
+from typing import Type
+
+import psycopg
+from django.db import connections
+from django.db.models import Model
+from psycopg import pq, sql
+
+from rgs_django_utils.database.db_types import (
+    DuplicateMode,
+    GeometryFormat,
+    ImportMethod,
+    RecordMergeMethod,
+    RowErrorMode,
+    StagingMode,
+    TransferMethod,
+)
+from rgs_django_utils.database.import_tuning import TuningProfile, get_tuning_profile
+from rgs_django_utils.database.upsert_multiple_data import (
+    TimingCallback,
+    UpsertStats,
+    _encode_wkb_page,
+    _ExistingDataUpsert,
+    _get_copy_statement,
+    _get_delete_absent_sql,
+    _get_geometry_columns,
+    _get_task_timer,
+    _iter_pages,
+    _iter_rows,
+    _log_stats_counters,
+    _PhaseTimer,
+    _prepared_statements,
+    _skip_empty_import,
+    _supports_merge_returning,
+    get_upsert_plan,
+)
+
+log = logging.getLogger(__name__)
+
+
+async def get_async_connection(using: str = "default") -> psycopg.AsyncConnection:
+    """Open a psycopg ``AsyncConnection`` with the settings of Django database *using*.
+
+    The connection is in autocommit mode, as the async upsert functions
+    manage their transactions themselves. The caller closes it, e.g. with
+    ``async with await get_async_connection() as aconnection:``.
+    """
+    params = connections[using].get_connection_params()
+    # Django's cursor classes are synchronous
+    params.pop("cursor_factory", None)
+    return await psycopg.AsyncConnection.connect(**params, autocommit=True)
+
+
+@contextlib.asynccontextmanager
+async def _use_connection(aconnection: typing.Union[psycopg.AsyncConnection, None]):
+    """Yield *aconnection*, or a new connection to ``default`` that is closed afterwards."""
+    if aconnection is None:
+        async with await get_async_connection() as aconnection:
+            yield aconnection
+    else:
+        if not aconnection.autocommit:
+            raise ValueError("aconnection must be in autocommit mode, the upsert manages its own transactions")
+        yield aconnection
+
+
+async def aupsert_multiple_data(
+    model: Type[Model],
+    data: typing.Union[typing.Iterable, typing.AsyncIterable],
+    data_fields: typing.List[str],
+    update_field_names: typing.List[str],
+    identification_field_names: typing.List[str] = None,
+    method: str = ImportMethod.OVERWRITE,
+    page_size: int = 1000,
+    transfer: str = TransferMethod.VALUES,
+    staging: str = StagingMode.PER_PAGE,
+    replace_scope: typing.Dict[str, typing.Any] = None,
+    delete_chunk_size: int = 10000,
+    skip_unchanged: bool = False,
+    prepare: bool = False,
+    geometry_format: str = GeometryFormat.WKT,
+    workers: int = 1,
+    page_bytes: int = None,
+    page_seconds: float = None,
+    on_error: str = RowErrorMode.RAISE,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
+    aconnection: psycopg.AsyncConnection = None,
+) -> UpsertStats:
+    """Async counterpart of :func:`~rgs_django_utils.database.upsert_multiple_data.upsert_multiple_data`.
+
+    Runs the same staging and merge statements (and uses the same cached
+    :class:`~rgs_django_utils.database.upsert_multiple_data.UpsertPlan`) on
+    a psycopg ``AsyncConnection``, so an async view doesn't block a thread
+    for the duration of the import. COPY transfers use psycopg's async
+    ``copy()``.
+
+    Not (yet) supported, unlike the sync function: parallel *workers*,
+    adaptive page sizing (*page_bytes*, *page_seconds*) and
+    ``RowErrorMode.ISOLATE``. The parameters are accepted with their
+    defaults only, so a call can be moved between the two.
+
+    Parameters
+    ----------
+    model : type[django.db.models.Model]
+        Target Django model.
+    data : iterable or async iterable of tuple, list or dict
+        Rows to upsert. An async iterable (e.g. rows parsed from an
+        uploaded stream) is consumed one page at a time.
+    data_fields, update_field_names, identification_field_names, method, page_size, transfer, staging, replace_scope, delete_chunk_size, skip_unchanged, prepare, geometry_format, deduplicate, merge_method, tuning, on_timing
+        See :func:`~rgs_django_utils.database.upsert_multiple_data.upsert_multiple_data`.
+    workers, page_bytes, page_seconds, on_error
+        Only the defaults (``1``, ``None``, ``None``,
+        ``RowErrorMode.RAISE``) are supported.
+    aconnection : psycopg.AsyncConnection, optional
+        Connection in autocommit mode. Default is a new connection with the
+        settings of the ``default`` database (see :func:`get_async_connection`),
+        closed when the upsert is done.
+
+    Returns
+    -------
+    UpsertStats
+        Inserted / updated / unchanged / rejected / deleted row counts.
+
+    Raises
+    ------
+    ValueError
+        If *aconnection* is not in autocommit mode, or an unsupported
+        option (*workers*, *page_bytes*, *page_seconds*, *on_error*) is
+        set.
+
+    Examples
+    --------
+    >>> @router.post("/waterways")                                   # doctest: +SKIP
+    ... async def upload(request, rows: list[WaterwayIn]):
+    ...     stats = await aupsert_multiple_data(
+    ...         Waterway, [row.dict() for row in rows], ["code", "name"], ["name"], ["code"]
+    ...     )
+    ...     return stats.as_dict()
+    """
+    if workers != 1:
+        raise ValueError("aupsert_multiple_data doesn't support workers, use upsert_multiple_data")
+    if page_bytes is not None or page_seconds is not None:
+        raise ValueError("aupsert_multiple_data doesn't support page_bytes and page_seconds, use upsert_multiple_data")
+    if on_error != RowErrorMode.RAISE:
+        raise ValueError(f"aupsert_multiple_data doesn't support on_error={on_error}, use upsert_multiple_data")
+
+    pk_field = model._meta.pk.name
+    if identification_field_names is None:
+        identification_field_names = [pk_field]
+
+    # remove identification_field_names from update_field_names
+    update_field_names = [field for field in update_field_names if field not in identification_field_names]
+
+    combined_field_names = identification_field_names + update_field_names
+    geometry_columns = (
+        _get_geometry_columns(model, combined_field_names) if geometry_format == GeometryFormat.WKB else {}
+    )
+
+    def normalise(rows):
+        return _iter_rows(rows, data_fields, combined_field_names, identification_field_names, model)
+
+    pages = _aiter_pages(data, page_size, normalise, geometry_columns)
+    first_page = await anext(pages, None)
+    if first_page is None:
+        if _skip_empty_import("aupsert_multiple_data", model, method, replace_scope):
+            return UpsertStats()
+    else:
+        pages = _achain(first_page, pages)
+
+    name = f"upsert {model._meta.db_table}"
+    async with _use_connection(aconnection) as aconnection:
+        with _get_task_timer(name):
+            stats = await _aupsert_pages(
+                aconnection,
+                model,
+                pages,
+                identification_field_names,
+                update_field_names,
+                method,
+                transfer,
+                staging,
+                replace_scope,
+                delete_chunk_size,
+                skip_unchanged,
+                prepare,
+                geometry_format,
+                deduplicate,
+                merge_method,
+                tuning,
+                on_timing,
+            )
+    _log_stats_counters(name, stats)
+    return stats
+
+
+async def _aiter_pages(
+    data: typing.Union[typing.Iterable, typing.AsyncIterable],
+    page_size: int,
+    normalise: typing.Callable[[typing.Iterable], typing.Iterator[typing.List]],
+    geometry_columns: typing.Dict[int, typing.Union[int, None]],
+) -> typing.AsyncIterator[typing.List[typing.List]]:
+    """Yield normalised pages of at most *page_size* rows from a sync or async iterable."""
+    if hasattr(data, "__aiter__"):
+        raw = []
+        async for row in data:
+            raw.append(row)
+            if len(raw) >= page_size:
+                yield _encode_wkb_page(list(normalise(raw)), geometry_columns)
+                raw = []
+        if raw:
+            yield _encode_wkb_page(list(normalise(raw)), geometry_columns)
+    else:
+        for page in _iter_pages(normalise(data), page_size):
+            yield _encode_wkb_page(page, geometry_columns)
+
+
+async def _atimed_pages(timer: _PhaseTimer, pages: typing.AsyncIterator) -> typing.AsyncIterator:
+    """Async counterpart of ``_PhaseTimer.iter_pages``."""
+    while True:
+        start = time.perf_counter()
+        page = await anext(pages, None)
+        if page is None:
+            return
+        timer.record("read", start, len(page))
+        yield page
+
+
+async def _achain(first, rest: typing.AsyncIterator) -> typing.AsyncIterator:
+    """Yield *first*, then the items of *rest*."""
+    yield first
+    async for item in rest:
+        yield item
+
+
+async def _aupsert_pages(
+    aconnection: psycopg.AsyncConnection,
+    model: Type[Model],
+    pages: typing.AsyncIterator[typing.List[typing.List]],
+    identification_field_names: typing.List[str],
+    update_field_names: typing.List[str],
+    method: str,
+    transfer: str,
+    staging: str,
+    replace_scope: typing.Union[typing.Dict[str, typing.Any], None],
+    delete_chunk_size: int,
+    skip_unchanged: bool,
+    prepare: bool,
+    geometry_format: str,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
+) -> UpsertStats:
+    """Async counterpart of ``_upsert_pages``; the statements and their order are the same."""
+    # a client-side cursor, the VALUES transfer mogrifies the rows
+    async with psycopg.AsyncClientCursor(aconnection) as cursor:
+        plan = get_upsert_plan(
+            model,
+            tuple(identification_field_names),
+            tuple(update_field_names),
+            method,
+            transfer,
+            skip_unchanged,
+            _supports_merge_returning(cursor),
+            geometry_format,
+            deduplicate,
+            merge_method,
+            get_tuning_profile(tuning),
+        )
+        replace = method == ImportMethod.REPLACE
+        copy_types = plan.get_copy_types(cursor)
+        if prepare:
+            prepared = _prepared_statements.setdefault(aconnection, set())
+            if plan.name not in prepared:
+                await cursor.execute(plan.prepare_statement)
+                prepared.add(plan.name)
+
+        def fragment(name):
+            return plan.get_sql(cursor, name, prepare)
+
+        stats = UpsertStats()
+        timer = _PhaseTimer(stats, on_timing)
+        pages = _atimed_pages(timer, pages)
+
+        async def stage(page, before=None, after=None):
+            await _astage_page(
+                cursor, page, transfer, plan.template, fragment("cols"), copy_types, before, after, timer
+            )
+            stats.page_sizes.append(len(page))
+
+        async def count(staged):
+            if plan.deduplicate:
+                duplicates = await _afetch_duplicate_count(cursor)
+                stats.duplicates += duplicates
+                staged -= duplicates
+            inserted, updated, matched_rows = await _afetch_merge_counts(cursor)
+            stats.add_page(staged, inserted, updated, matched_rows, untouched_are_rejected=not plan.do_insert)
+
+        async def delete_absent(key_table, key_condition, commit_chunks=True):
+            start = time.perf_counter()
+            deleted = await _adelete_absent_rows(
+                cursor,
+                plan.table,
+                model._meta.pk.column,
+                sql.Identifier(key_table),
+                key_condition,
+                replace_scope,
+                delete_chunk_size,
+                commit_chunks,
+                plan.begin,
+            )
+            stats.deleted += deleted
+            timer.record("delete", start, deleted)
+
+        if replace and staging != StagingMode.SINGLE_MERGE:
+            await cursor.execute(plan.create_import_keys)
+
+        try:
+            if staging == StagingMode.PER_PAGE:
+                async for page in pages:
+                    await stage(page, before=fragment("per_page_before"), after=fragment("per_page_after"))
+                    await count(len(page))
+
+            elif staging == StagingMode.REUSE:
+                await cursor.execute(fragment("reuse_create"))
+                try:
+                    async for page in pages:
+                        await stage(page, before=fragment("reuse_before"), after=fragment("reuse_after"))
+                        await count(len(page))
+                finally:
+                    await _arollback_open_transaction(cursor)
+                    await cursor.execute("DROP TABLE newvals;")
+
+            elif staging == StagingMode.SINGLE_MERGE:
+                await cursor.execute(fragment("single_merge_before"))
+                staged = 0
+                async for page in pages:
+                    await stage(page)
+                    staged += len(page)
+                start = time.perf_counter()
+                await cursor.execute(fragment("single_merge_merge"))
+                timer.record("merge", start, staged)
+                await count(staged)
+                if replace:
+                    await delete_absent("newvals", plan.where_cols, commit_chunks=False)
+                await cursor.execute("DROP TABLE newvals; COMMIT;")
+
+            else:
+                raise ValueError(f"unknown staging mode {staging}")
+
+            if replace and staging != StagingMode.SINGLE_MERGE:
+                await cursor.execute(plan.index_import_keys)
+                await delete_absent("import_keys", plan.import_keys_condition)
+        except Exception:
+            await _arollback_open_transaction(cursor)
+            raise
+        finally:
+            if replace and staging != StagingMode.SINGLE_MERGE:
+                await cursor.execute("DROP TABLE IF EXISTS import_keys;")
+
+    return stats
+
+
+async def aupsert_from_existing_data(
+    model: Type[Model],
+    source_table_name: str,
+    cols: typing.List[typing.Dict[str, typing.Any]],
+    update_field_names: typing.List[str],
+    identification_field_names: typing.List[str] = None,
+    method: str = ImportMethod.OVERWRITE,
+    source_schema: str = "public",
+    replace_scope: typing.Dict[str, typing.Any] = None,
+    delete_chunk_size: int = 10000,
+    skip_unchanged: bool = False,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    aconnection: psycopg.AsyncConnection = None,
+) -> typing.Tuple[int, int]:
+    """Async counterpart of :func:`~rgs_django_utils.database.upsert_multiple_data.upsert_from_existing_data`.
+
+    Parameters
+    ----------
+    model, source_table_name, cols, update_field_names, identification_field_names, method, source_schema, replace_scope, delete_chunk_size, skip_unchanged, merge_method, tuning
+        See :func:`~rgs_django_utils.database.upsert_multiple_data.upsert_from_existing_data`.
+    aconnection : psycopg.AsyncConnection, optional
+        Connection in autocommit mode. Default is a new connection to the
+        ``default`` database, closed when the upsert is done.
+
+    Returns
+    -------
+    tuple of int
+        ``(updated, inserted)``.
+    """
+    statements = _ExistingDataUpsert(
+        model,
+        source_table_name,
+        cols,
+        update_field_names,
+        identification_field_names,
+        method,
+        source_schema,
+        skip_unchanged,
+        merge_method,
+        tuning,
+    )
+
+    async with _use_connection(aconnection) as aconnection, psycopg.AsyncClientCursor(aconnection) as cursor:
+        updated = 0
+        inserted = 0
+
+        for target, unresolved, check in statements.lookup_checks:
+            await cursor.execute(check)
+            statements.check_lookup(target, unresolved, await cursor.fetchall())
+
+        replace = method == ImportMethod.REPLACE
+        if replace:
+            await cursor.execute(statements.source_is_empty)
+            if (await cursor.fetchone())[0]:
+                replace = not _skip_empty_import(
+                    "aupsert_from_existing_data", model, method, statements.get_replace_scope(replace_scope)
+                )
+
+        try:
+            await cursor.execute(statements.begin)
+            await cursor.execute(statements.index_cols_source_table)
+            await cursor.execute(statements.lock)
+            if statements.update_part:
+                await cursor.execute(statements.update_part, {**statements.set_values, **statements.where_values})
+                updated, matched = await cursor.fetchone()
+                if skip_unchanged:
+                    log.info(
+                        "aupsert_from_existing_data skipped %s unchanged rows of %s",
+                        matched - updated,
+                        model._meta.db_table,
+                    )
+            if statements.insert_part:
+                await cursor.execute(statements.insert_part, {**statements.insert_values, **statements.where_values})
+                inserted = (await cursor.fetchone())[0]
+            await cursor.execute("COMMIT;")
+        except Exception:
+            await _arollback_open_transaction(cursor)
+            raise
+
+        if replace:
+            deleted = await _adelete_absent_rows(
+                cursor,
+                statements.target_table,
+                statements.pk_field,
+                statements.source_from,
+                statements.where_cols,
+                statements.get_replace_scope(replace_scope),
+                delete_chunk_size,
+                begin=statements.begin,
+            )
+            log.info("aupsert_from_existing_data deleted %s rows from %s", deleted, model._meta.db_table)
+
+    return updated, inserted
+
+
+async def _astage_page(
+    cursor: psycopg.AsyncClientCursor,
+    page: typing.List[typing.List],
+    transfer: str,
+    template: str,
+    cols: sql.Composable,
+    copy_types: typing.Union[typing.List[int], None],
+    before: sql.Composable = None,
+    after: sql.Composable = None,
+    timer: typing.Union[_PhaseTimer, None] = None,
+):
+    """Async counterpart of ``_stage_page`` for the ``VALUES`` and COPY transfers."""
+    timer = timer or _PhaseTimer(UpsertStats())
+    rows = len(page)
+
+    if transfer == TransferMethod.VALUES:
+        start = time.perf_counter()
+        sql_data = sql.SQL(",".join([cursor.mogrify(template, item) for item in page]))
+        timer.record("encode", start, rows)
+        start = time.perf_counter()
+        await cursor.execute(
+            sql.SQL("{before}\nINSERT INTO newvals({cols}) VALUES {sql_data};\n{after}").format(
+                before=before or sql.SQL(""),
+                cols=cols,
+                sql_data=sql_data,
+                after=after or sql.SQL(""),
+            )
+        )
+        timer.record("transfer" if after is None else "merge", start, rows)
+        return
+
+    if before is not None:
+        start = time.perf_counter()
+        await cursor.execute(before)
+        timer.record("setup", start, rows)
+    start = time.perf_counter()
+    async with cursor.copy(_get_copy_statement(cols, copy_types)) as copy:
+        if copy_types is not None:
+            copy.set_types(copy_types)
+        for row in page:
+            await copy.write_row(row)
+    timer.record("transfer", start, rows)
+    if after is not None:
+        start = time.perf_counter()
+        await cursor.execute(after)
+        timer.record("merge", start, rows)
+
+
+async def _afetch_merge_counts(cursor) -> typing.Tuple[int, int, typing.Union[int, None]]:
+    """Async counterpart of ``_fetch_merge_counts``."""
+    while cursor.description is None:
+        if not cursor.nextset():
+            raise ValueError("no merge counts returned")
+    inserted, updated, matched = await cursor.fetchone()
+    return inserted, updated, matched
+
+
+async def _afetch_duplicate_count(cursor) -> int:
+    """Async counterpart of ``_fetch_duplicate_count``."""
+    while cursor.description is None:
+        if not cursor.nextset():
+            raise ValueError("no duplicate count returned")
+    (duplicates,) = await cursor.fetchone()
+    cursor.nextset()
+    return duplicates
+
+
+async def _arollback_open_transaction(cursor):
+    """Roll back the transaction a failed statement left open, so the connection stays usable."""
+    if cursor.connection.info.transaction_status != pq.TransactionStatus.IDLE:
+        await cursor.execute("ROLLBACK;")
+
+
+async def _adelete_absent_rows(
+    cursor,
+    table: sql.Composable,
+    pk_column: str,
+    key_table: sql.Composable,
+    key_condition: sql.Composable,
+    scope: typing.Union[typing.Dict[str, typing.Any], None],
+    chunk_size: int,
+    commit_chunks: bool = True,
+    begin: sql.Composable = sql.SQL("BEGIN;"),
+) -> int:
+    """Async counterpart of ``_delete_absent_rows``."""
+    collect_keys, index_keys, delete_chunk = _get_delete_absent_sql(
+        table, pk_column, key_table, key_condition, scope, chunk_size
+    )
+    await cursor.execute(collect_keys)
+    count = cursor.rowcount
+
+    deleted = 0
+    try:
+        if count > chunk_size:
+            await cursor.execute(index_keys)
+        for start in range(0, count, chunk_size):
+            if commit_chunks:
+                await cursor.execute(begin)
+            await cursor.execute(delete_chunk, {"start": start})
+            deleted += cursor.rowcount
+            if commit_chunks:
+                await cursor.execute("COMMIT;")
+    finally:
+        if commit_chunks:
+            await _arollback_open_transaction(cursor)
+        if cursor.connection.info.transaction_status != pq.TransactionStatus.INERROR:
+            await cursor.execute("DROP TABLE delete_keys;")
+    return deleted
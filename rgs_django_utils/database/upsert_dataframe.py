@@ -0,0 +1,255 @@
+import itertools
+import json
+import logging
+import typing
+from typing import Type
+
+import geopandas as gpd
+import pandas as pd
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import JSONField, Model
+
+from rgs_django_utils.database.db_types import (
+    DuplicateMode,
+    GeometryFormat,
+    ImportMethod,
+    RecordMergeMethod,
+    RowErrorMode,
+    StagingMode,
+    TransferMethod,
+)
+from rgs_django_utils.database.import_tuning import TuningProfile
+from rgs_django_utils.database.upsert_multiple_data import (
+    TimingCallback,
+    UpsertStats,
+    _get_task_timer,
+    _log_stats_counters,
+    _skip_empty_import,
+    _upsert_pages,
+)
+
+log = logging.getLogger(__name__)
+
+
+def upsert_dataframe(
+    model: Type[Model],
+    df: typing.Union[pd.DataFrame, typing.Iterable[pd.DataFrame]],
+    update_field_names: typing.List[str],
+    identification_field_names: typing.List[str] = None,
+    method: str = ImportMethod.OVERWRITE,
+    page_size: int = 10000,
+    staging: str = StagingMode.PER_PAGE,
+    replace_scope: typing.Dict[str, typing.Any] = None,
+    delete_chunk_size: int = 10000,
+    skip_unchanged: bool = False,
+    prepare: bool = False,
+    on_error: str = RowErrorMode.RAISE,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
+) -> UpsertStats:
+    r"""Upsert a pandas or GeoPandas DataFrame into *model*'s table.
+
+    Columns are coerced per page with the vectorised ``pd_type_func`` of
+    the extended model fields, geometry columns are encoded to WKB in bulk
+    and every page is streamed to the staging table with
+    ``COPY ... (FORMAT csv)``, so no Python object is built per row. The
+    merge itself is the one of
+    :func:`~rgs_django_utils.database.upsert_multiple_data.upsert_multiple_data`.
+
+    Parameters
+    ----------
+    model : type[django.db.models.Model]
+        Target Django model.
+    df : pandas.DataFrame or iterable of pandas.DataFrame
+        Rows to upsert, with a column per field name. An iterable of
+        DataFrames (e.g. ``pd.read_csv(..., chunksize=...)``) is consumed
+        one DataFrame at a time.
+    update_field_names : list of str
+        Columns updated on conflict. Identification columns are stripped
+        automatically.
+    identification_field_names : list of str, optional
+        Key columns. Defaults to the model's primary key.
+    method : str, optional
+        Import strategy (see :class:`~rgs_django_utils.database.db_types.ImportMethod`).
+        Default is ``ImportMethod.OVERWRITE``.
+    page_size : int, optional
+        Number of rows per page. Default is ``10000``.
+    staging : str, optional
+        Lifecycle of the staging table (see
+        :class:`~rgs_django_utils.database.db_types.StagingMode`).
+        Default is ``StagingMode.PER_PAGE``.
+    replace_scope : dict, optional
+        Only with ``ImportMethod.REPLACE``: ``{column: value}`` pairs that
+        limit which rows may be deleted. Without rows only a scoped
+        replace deletes (see :func:`upsert_multiple_data`).
+    delete_chunk_size : int, optional
+        Only with ``ImportMethod.REPLACE``: rows deleted per statement.
+        Default is ``10000``.
+    skip_unchanged : bool, optional
+        Only update rows where an updated column changed. Default is
+        ``False``.
+    prepare : bool, optional
+        Run the merge as a server-side prepared statement. Default is
+        ``False``.
+    on_error : str, optional
+        Handling of rows that fail with a data or integrity error (see
+        :class:`~rgs_django_utils.database.db_types.RowErrorMode`).
+        Default is ``RowErrorMode.RAISE``.
+    deduplicate : str, optional
+        Keep the first or last row of duplicate keys (see
+        :class:`~rgs_django_utils.database.db_types.DuplicateMode`).
+        Default is ``DuplicateMode.NONE``.
+    merge_method : str, optional
+        How new values are merged into an existing row (see
+        :class:`~rgs_django_utils.database.db_types.RecordMergeMethod`).
+        Missing values in the DataFrame are ``NULL``, so with
+        ``MERGE_NEW_LEADING`` they keep the existing value. Default is
+        ``RecordMergeMethod.REPLACE``.
+    tuning : str or dict, optional
+        Import tuning profile applied with ``SET LOCAL`` in the upsert
+        transactions (see
+        :mod:`~rgs_django_utils.database.import_tuning`). Default is no
+        tuning.
+    on_timing : callable, optional
+        Called as ``on_timing(phase, seconds, rows)`` for every measured
+        phase; the phases are summed in ``UpsertStats.timings`` as well.
+        ``read`` includes the coercion of the columns. Default is ``None``.
+
+    Returns
+    -------
+    UpsertStats
+        Inserted / updated / unchanged / rejected / deleted row counts.
+
+    Raises
+    ------
+    ValueError
+        If a DataFrame lacks one of the identification or update columns.
+
+    Notes
+    -----
+    * Geometry columns may hold shapely geometries (a ``GeoSeries`` is
+      reprojected to the SRID of the field when its CRS differs), WKB
+      ``bytes`` or WKT strings.
+    * JSON columns hold Python objects (dicts, lists, ...); they are
+      serialised with ``json.dumps``.
+    * Missing values (``None``, ``NaN``, ``pd.NA``) become ``NULL``. The
+      literal string ``\N`` is read as ``NULL`` as well.
+
+    Examples
+    --------
+    >>> gdf = gpd.read_file("waterways.gpkg")              # doctest: +SKIP
+    >>> upsert_dataframe(                                    # doctest: +SKIP
+    ...     Waterway, gdf, ["geometry", "name"], identification_field_names=["code"]
+    ... )
+    """
+    pk_field = model._meta.pk.name
+    if identification_field_names is None:
+        identification_field_names = [pk_field]
+
+    # remove identification_field_names from update_field_names
+    update_field_names = [field for field in update_field_names if field not in identification_field_names]
+
+    combined_field_names = identification_field_names + update_field_names
+    if on_error == RowErrorMode.ISOLATE and staging == StagingMode.SINGLE_MERGE:
+        raise ValueError("RowErrorMode.ISOLATE needs a transaction per page and can't run with SINGLE_MERGE")
+
+    frames = [df] if isinstance(df, pd.DataFrame) else df
+    pages = _iter_frame_pages(model, frames, combined_field_names, page_size)
+    first_page = next(pages, None)
+    if first_page is None:
+        if _skip_empty_import("upsert_dataframe", model, method, replace_scope):
+            return UpsertStats()
+    else:
+        pages = itertools.chain([first_page], pages)
+
+    name = f"upsert {model._meta.db_table}"
+    with _get_task_timer(name):
+        stats = _upsert_pages(
+            model,
+            pages,
+            identification_field_names,
+            update_field_names,
+            method,
+            TransferMethod.COPY_CSV,
+            staging,
+            replace_scope,
+            delete_chunk_size,
+            skip_unchanged,
+            prepare,
+            GeometryFormat.WKB,
+            on_error=on_error,
+            deduplicate=deduplicate,
+            merge_method=merge_method,
+            tuning=tuning,
+            on_timing=on_timing,
+        )
+    _log_stats_counters(name, stats)
+    return stats
+
+
+def _iter_frame_pages(
+    model: Type[Model],
+    frames: typing.Iterable[pd.DataFrame],
+    combined_field_names: typing.List[str],
+    page_size: int,
+) -> typing.Iterator[pd.DataFrame]:
+    """Yield coerced pages of at most *page_size* rows from *frames*."""
+    for frame in frames:
+        missing = [col for col in combined_field_names if col not in frame.columns]
+        if missing:
+            raise ValueError(f"DataFrame misses columns {', '.join(missing)}")
+        for start in range(0, len(frame), page_size):
+            yield _prepare_frame(model, frame.iloc[start : start + page_size], combined_field_names)
+
+
+def _prepare_frame(model: Type[Model], frame: pd.DataFrame, columns: typing.List[str]) -> pd.DataFrame:
+    """Return *columns* of *frame*, coerced to the values Postgres expects in a CSV COPY."""
+    out = {}
+    for col in columns:
+        field = model._meta.get_field(col)
+        serie = frame[col]
+        if getattr(field, "geom_type", None) is not None:
+            out[col] = _encode_geometry(serie, field.srid)
+        elif isinstance(field, JSONField):
+            out[col] = serie.map(json.dumps, na_action="ignore")
+        elif isinstance(field, ArrayField):
+            out[col] = serie.map(_pg_array_literal, na_action="ignore")
+        elif hasattr(field, "pd_type_func"):
+            out[col] = field.pd_type_func(serie)
+        else:
+            out[col] = serie
+    return pd.DataFrame(out, index=frame.index)
+
+
+def _encode_geometry(serie: pd.Series, srid: typing.Union[int, None]) -> pd.Series:
+    """Encode a series of geometries, WKB or WKT to hex WKB in the ``bytea`` text format.
+
+    A ``GeoSeries`` whose CRS differs from *srid* is reprojected first.
+    """
+    if isinstance(serie, gpd.GeoSeries):
+        gs = serie
+    else:
+        values = serie.dropna()
+        first = values.iloc[0] if len(values) else None
+        if isinstance(first, (bytes, bytearray, memoryview)):
+            gs = gpd.GeoSeries.from_wkb(serie)
+        elif isinstance(first, str):
+            gs = gpd.GeoSeries.from_wkt(serie)
+        else:
+            gs = gpd.GeoSeries(serie)
+    if srid is not None and gs.crs is not None and gs.crs.to_epsg() != srid:
+        gs = gs.to_crs(epsg=srid)
+    return "\\x" + gs.to_wkb(hex=True).astype("string")
+
+
+def _pg_array_literal(values: typing.Iterable) -> str:
+    """Return the Postgres text representation of a one-dimensional array."""
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        else:
+            items.append('"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
@@ -1,13 +1,37 @@
 import collections
+import concurrent.futures
+import contextlib
+import itertools
 import logging
+import queue
+import re
+import time
 import typing
+import weakref
+import zlib
+from functools import cache
 from typing import Type
 
-from django.db import connection
+import numpy as np
+import psycopg
+import shapely
+from django.db import DataError, IntegrityError, connection
 from django.db.models import Model
-from psycopg import sql
-
-from rgs_django_utils.database.db_types import ImportMethod
+from psycopg import pq, sql
+from psycopg.copy import LibpqWriter
+
+from rgs_django_utils.database.db_types import (
+    DuplicateMode,
+    GeometryFormat,
+    ImportMethod,
+    RecordMergeMethod,
+    RowErrorMode,
+    StagingMode,
+    TransferMethod,
+    UnresolvedLookup,
+)
+from rgs_django_utils.database.import_tuning import TuningProfile, get_tuning_profile, get_tuning_sql
+from rgs_django_utils.logging.logging.log_context import SubTimer, get_task_info, log_counter
 
 # todo: needed in psycopg3?
 # from psycopg2.extensions import register_adapter
@@ -24,11 +48,129 @@ def _get_data_row(data, cols):
     return out
 
 
-def _get_mogrify_template(cols, model: Type[Model]):
+def _iter_rows(
+    data: typing.Iterable[typing.Tuple | typing.List | typing.Dict],
+    data_fields: typing.List[str],
+    combined_field_names: typing.List[str],
+    identification_field_names: typing.List[str],
+    model: Type[Model],
+) -> typing.Iterator[typing.List]:
+    """Lazily normalise *data* into lists ordered like *combined_field_names*.
+
+    The row shape (dict or tuple/list) is taken from the first row, which
+    is peeked without materialising the input, so generators, CSV readers
+    and DB cursors are consumed one row at a time.
+    """
+    rows = iter(data)
+    first = next(rows, None)
+    if first is None:
+        return
+    rows = itertools.chain([first], rows)
+
+    if isinstance(first, dict):
+        for item in rows:
+            yield [item.get(col) for col in combined_field_names]
+    elif isinstance(first, (tuple, list)):
+        for field in identification_field_names:
+            if field not in data_fields:
+                raise ValueError(f"id field {field} is required in data_fields for model {model.__name__}")
+        for field in combined_field_names:
+            if field not in data_fields:
+                raise ValueError(f"field {field} is required in data_fields for model {model.__name__}")
+
+        # map data order from data_fields to combined_field_names
+        data_field_map = [data_fields.index(col) for col in combined_field_names]
+        for item in rows:
+            yield [item[index] for index in data_field_map]
+    else:
+        raise TypeError(f"rows should be dicts, tuples or lists, not {type(first).__name__}")
+
+
+def _iter_pages(rows: typing.Iterator[typing.List], page_size: int) -> typing.Iterator[typing.List[typing.List]]:
+    """Split *rows* into lists of at most *page_size* rows, pulling one page at a time."""
+    while True:
+        page = list(itertools.islice(rows, page_size))
+        if not page:
+            return
+        yield page
+
+
+def _encode_wkb(values: typing.Sequence, srid: typing.Union[int, None] = None) -> np.ndarray:
+    """Encode shapely geometries and WKB / EWKB (bytes or hex) to plain WKB in one vectorised pass.
+
+    Parameters
+    ----------
+    values : sequence
+        Shapely geometries, WKB or EWKB as ``bytes`` or hex ``str``, or
+        ``None``.
+    srid : int, optional
+        SRID of the target column.
+
+    Returns
+    -------
+    numpy.ndarray
+        WKB ``bytes`` without SRID (``None`` stays ``None``).
+
+    Raises
+    ------
+    ValueError
+        If an EWKB value carries another SRID than *srid*; reprojecting is
+        left to the caller.
+    """
+    values = np.asarray(values, dtype=object)
+    geometries = values.copy()
+    encoded = ~shapely.is_geometry(values) & ~np.equal(values, None)
+    if encoded.any():
+        geometries[encoded] = shapely.from_wkb(values[encoded])
+    if srid is not None:
+        srids = shapely.get_srid(geometries)
+        other = (srids > 0) & (srids != srid)
+        if other.any():
+            raise ValueError(f"geometry with SRID {srids[other][0]} for a column with SRID {srid}, reproject it first")
+    return shapely.to_wkb(geometries, include_srid=False)
+
+
+def _iter_wkb_pages(
+    pages: typing.Iterator[typing.List[typing.List]], geometry_columns: typing.Dict[int, typing.Union[int, None]]
+) -> typing.Iterator[typing.List[typing.List]]:
+    """Encode the geometry columns of every page with :func:`_encode_wkb`.
+
+    *geometry_columns* maps the position of a geometry column in the rows
+    to the SRID of its field.
+    """
+    for page in pages:
+        yield _encode_wkb_page(page, geometry_columns)
+
+
+def _encode_wkb_page(
+    page: typing.List[typing.List], geometry_columns: typing.Dict[int, typing.Union[int, None]]
+) -> typing.List[typing.List]:
+    """Encode the geometry columns of one *page* in place and return it."""
+    for index, srid in geometry_columns.items():
+        for row, value in zip(page, _encode_wkb([row[index] for row in page], srid)):
+            row[index] = value
+    return page
+
+
+def _get_geometry_columns(
+    model: Type[Model], field_names: typing.List[str]
+) -> typing.Dict[int, typing.Union[int, None]]:
+    """Map the position of every geometry field in *field_names* to its SRID."""
+    return {
+        index: model._meta.get_field(col).srid
+        for index, col in enumerate(field_names)
+        if getattr(model._meta.get_field(col), "geom_type", None) is not None
+    }
+
+
+def _get_mogrify_template(cols, model: Type[Model], geometry_format: str = GeometryFormat.WKT):
     out = []
     for col in cols:
         dtype = _get_postgres_field_type(col, model)
-        if dtype.startswith("geometry"):
+        if dtype.startswith("geometry") and geometry_format == GeometryFormat.WKB:
+            # converted from the bytea staging column, see _get_staging_value
+            out.append("%s")
+        elif dtype.startswith("geometry"):
             if "4326" in dtype:
                 out.append("ST_TRANSFORM(ST_GeomFromText(%s), 4326)")
             else:
@@ -59,6 +201,287 @@ def _get_postgres_field_type(field_name, model: Type[Model]):
     return db_type
 
 
+def _get_staging_type(db_type: str, transfer: str, geometry_format: str = GeometryFormat.WKT) -> str:
+    """Return the column type of the staging table for a target column of *db_type*.
+
+    The ``VALUES`` transfer converts WKT geometries inside the ``INSERT``
+    statement (see :func:`_get_mogrify_template`), so the staging column
+    has the target type. The COPY transfers stage the raw WKT as ``text``
+    and WKB geometries are staged as ``bytea``; both are converted in the
+    merge statements (see :func:`_get_staging_value`).
+    """
+    if db_type.startswith("geometry"):
+        if geometry_format == GeometryFormat.WKB:
+            return "bytea"
+        if transfer != TransferMethod.VALUES:
+            return "text"
+    return db_type
+
+
+def _get_geometry_srid(db_type: str) -> typing.Union[int, None]:
+    """Return the SRID of a ``geometry(<type>,<srid>)`` column type, if any."""
+    match = re.search(r",\s*(\d+)\s*\)", db_type)
+    return int(match.group(1)) if match else None
+
+
+def _get_staging_value(
+    col: str,
+    db_type: str,
+    transfer: str,
+    table: str = "newvals",
+    geometry_format: str = GeometryFormat.WKT,
+) -> sql.Composable:
+    """Return the SQL expression that reads column *col* from the staging table (or a copy of it named *table*)."""
+    value = sql.SQL("{table}.{col}").format(table=sql.Identifier(table), col=sql.Identifier(col))
+    if db_type.startswith("geometry") and geometry_format == GeometryFormat.WKB:
+        srid = _get_geometry_srid(db_type)
+        if srid is not None:
+            value = sql.SQL("ST_GeomFromWKB({value}, {srid})").format(value=value, srid=sql.Literal(srid))
+        else:
+            value = sql.SQL("ST_GeomFromWKB({value})").format(value=value)
+    elif transfer != TransferMethod.VALUES and db_type.startswith("geometry"):
+        value = sql.SQL("ST_GeomFromText({value})").format(value=value)
+        if "4326" in db_type:
+            value = sql.SQL("ST_TRANSFORM({value}, 4326)").format(value=value)
+    return value
+
+
+def _get_copy_types(cursor, staging_types: typing.List[str]) -> typing.Union[typing.List[int], None]:
+    """Resolve *staging_types* to the OIDs psycopg needs for a binary COPY.
+
+    Returns ``None`` when one of the types is unknown to psycopg (custom
+    enums, extension types, ...); the caller then falls back to the text
+    format.
+    """
+    registry = cursor.connection.adapters.types
+    try:
+        # strip type modifiers like varchar(30) or numeric(10, 2)
+        return [registry.get_oid(re.sub(r"\(.*?\)", "", db_type).strip()) for db_type in staging_types]
+    except KeyError:
+        return None
+
+
+def _get_copy_statement(cols: sql.Composable, copy_types: typing.Union[typing.List[int], None]) -> sql.Composable:
+    """Return the ``COPY newvals`` statement, binary when *copy_types* are known."""
+    copy_format = sql.SQL("(FORMAT BINARY)" if copy_types is not None else "")
+    return sql.SQL("COPY newvals ({cols}) FROM STDIN {copy_format}").format(cols=cols, copy_format=copy_format)
+
+
+def _copy_rows(cursor, cols: sql.Composable, rows: typing.Iterable, copy_types: typing.Union[typing.List[int], None]):
+    """Stream *rows* into the ``newvals`` staging table with ``COPY ... FROM STDIN``.
+
+    Parameters
+    ----------
+    cursor : django.db.backends.utils.CursorWrapper
+        Cursor on a psycopg 3 connection.
+    cols : psycopg.sql.Composable
+        Comma-separated staging column list, in row order.
+    rows : iterable of list
+        Rows with values in the order of *cols*.
+    copy_types : list of int or None
+        Column OIDs for a binary COPY, or ``None`` for the text format.
+
+    Returns
+    -------
+    int
+        Number of bytes sent.
+    """
+    # the raw psycopg cursor behind Django's CursorWrapper
+    writer = _CountingWriter(getattr(cursor, "cursor", cursor))
+    with cursor.copy(_get_copy_statement(cols, copy_types), writer=writer) as copy:
+        if copy_types is not None:
+            copy.set_types(copy_types)
+        for row in rows:
+            try:
+                copy.write_row(row)
+            except (TypeError, ValueError, OverflowError) as error:
+                # a value the binary dumper can't encode; raised like the cast error of a text COPY
+                raise psycopg.DataError(f"invalid value for COPY: {error}") from error
+    return writer.sent
+
+
+class _CountingWriter(LibpqWriter):
+    """COPY writer that counts the bytes it sends."""
+
+    def __init__(self, cursor):
+        super().__init__(cursor)
+        self.sent = 0
+
+    def write(self, data):
+        self.sent += len(data)
+        super().write(data)
+
+
+def _copy_frame(cursor, cols: sql.Composable, frame):
+    r"""Stream the pandas DataFrame *frame* into ``newvals`` as CSV.
+
+    The DataFrame is written by pandas' C CSV writer, without building a
+    Python object per row. Missing values are written as ``\N``. Returns
+    the length of the CSV text.
+    """
+    data = frame.to_csv(header=False, index=False, na_rep="\\N", lineterminator="\n")
+    with cursor.copy(sql.SQL("COPY newvals ({cols}) FROM STDIN (FORMAT csv, NULL '\\N')").format(cols=cols)) as copy:
+        copy.write(data)
+    return len(data)
+
+
+def _get_changed_condition(values: typing.Dict[str, typing.Tuple[sql.Composable, str]]) -> sql.Composable:
+    """Return a condition that is true when a ``target_table`` column differs from its new value.
+
+    *values* maps a target column to its new value expression and its
+    database type. ``json`` has no equality operator and is compared as
+    ``jsonb``.
+    """
+    changed = []
+    for col, (value, db_type) in values.items():
+        target = sql.SQL("target_table.{col}").format(col=sql.Identifier(col))
+        if db_type.lower() == "json":
+            target = sql.SQL("{target}::jsonb").format(target=target)
+            value = sql.SQL("({value})::jsonb").format(value=value)
+        changed.append(sql.SQL("{target} IS DISTINCT FROM {value}").format(target=target, value=value))
+    return sql.SQL("({changed})").format(changed=sql.SQL(" OR ").join(changed))
+
+
+def _get_merged_value(col: str, value: sql.Composable, merge_method: str) -> sql.Composable:
+    """Return the ``SET`` expression of the ``target_table`` column *col* for the new *value*.
+
+    See :class:`~rgs_django_utils.database.db_types.RecordMergeMethod`:
+    with the merge strategies ``NULL`` never clears a value, because the
+    ``COALESCE`` falls back to the other side.
+    """
+    if merge_method == RecordMergeMethod.REPLACE:
+        return value
+    target = sql.SQL("target_table.{col}").format(col=sql.Identifier(col))
+    if merge_method == RecordMergeMethod.MERGE_NEW_LEADING:
+        return sql.SQL("COALESCE({value}, {target})").format(value=value, target=target)
+    if merge_method == RecordMergeMethod.MERGE_EXISTING_LEADING:
+        return sql.SQL("COALESCE({target}, {value})").format(target=target, value=value)
+    raise ValueError(f"unknown record merge method {merge_method}")
+
+
+def _get_scope_condition(scope: typing.Union[typing.Dict[str, typing.Any], None]) -> sql.Composable:
+    """Return the ``WHERE`` condition on ``target_table`` for a ``{column: value}`` *scope*."""
+    if not scope:
+        return sql.SQL("TRUE")
+    return sql.SQL(" AND ").join(
+        (
+            sql.SQL("target_table.{col} IS NULL").format(col=sql.Identifier(col))
+            if value is None
+            else sql.SQL("target_table.{col}={value}").format(col=sql.Identifier(col), value=sql.Literal(value))
+        )
+        for col, value in scope.items()
+    )
+
+
+def _get_delete_absent_sql(
+    table: sql.Composable,
+    pk_column: str,
+    key_table: sql.Composable,
+    key_condition: sql.Composable,
+    scope: typing.Union[typing.Dict[str, typing.Any], None],
+    chunk_size: int,
+) -> typing.Tuple[sql.Composable, sql.Composable, sql.Composable]:
+    """Return the statements of :func:`_delete_absent_rows`: collect the keys, index them, delete one chunk.
+
+    The keys are numbered, so a chunk is a range of numbers on the index
+    (parameter ``start``) and no chunk scans the keys of earlier chunks.
+    """
+    collect_keys = sql.SQL("""
+        CREATE TEMPORARY TABLE delete_keys AS
+        SELECT row_number() OVER () AS nr, target_table.{pk} AS pk
+        FROM {table} target_table
+        WHERE {scope} AND NOT EXISTS (SELECT FROM {key_table} WHERE {key_condition});
+    """).format(
+        pk=sql.Identifier(pk_column),
+        table=table,
+        scope=_get_scope_condition(scope),
+        key_table=key_table,
+        key_condition=key_condition,
+    )
+    index_keys = sql.SQL("CREATE INDEX ON delete_keys (nr); ANALYZE delete_keys;")
+    # = ANY(ARRAY(...)) looks the keys up on the primary key; a join on a large table is planned as a seq scan
+    delete_chunk = sql.SQL("""
+        DELETE FROM {table} target_table
+        WHERE target_table.{pk} = ANY(ARRAY(
+            SELECT pk FROM delete_keys WHERE nr > %(start)s AND nr <= %(start)s + {chunk_size}
+        ));
+    """).format(chunk_size=sql.Literal(chunk_size), table=table, pk=sql.Identifier(pk_column))
+    return collect_keys, index_keys, delete_chunk
+
+
+def _delete_absent_rows(
+    cursor,
+    table: sql.Composable,
+    pk_column: str,
+    key_table: sql.Composable,
+    key_condition: sql.Composable,
+    scope: typing.Union[typing.Dict[str, typing.Any], None],
+    chunk_size: int,
+    commit_chunks: bool = True,
+    begin: sql.Composable = sql.SQL("BEGIN;"),
+) -> int:
+    """Delete the rows of *table* (within *scope*) without a matching row in *key_table*.
+
+    The primary keys of the rows to delete are collected with one
+    anti-join into the numbered temporary table ``delete_keys``, after
+    which the rows are deleted in chunks of *chunk_size* consecutive
+    numbers. With *commit_chunks* every
+    chunk is its own transaction, so locks and WAL stay bounded; without
+    it the chunks run in the transaction of the caller.
+
+    Parameters
+    ----------
+    cursor : django.db.backends.utils.CursorWrapper
+        Cursor on a psycopg 3 connection.
+    table : psycopg.sql.Composable
+        Target table, referred to as ``target_table`` in *key_condition*.
+    pk_column : str
+        Primary-key column of *table*.
+    key_table : psycopg.sql.Composable
+        Table with the keys of all imported rows.
+    key_condition : psycopg.sql.Composable
+        Condition that matches a ``target_table`` row with a *key_table* row.
+    scope : dict, optional
+        ``{column: value}`` pairs that limit the rows that may be deleted.
+    chunk_size : int
+        Maximum number of rows deleted per statement.
+    commit_chunks : bool, optional
+        Commit after every chunk. Default is ``True``.
+    begin : psycopg.sql.Composable, optional
+        Statement that opens the transaction of a chunk, ``BEGIN;``
+        followed by the ``SET LOCAL`` statements of an import tuning
+        profile. Default is ``BEGIN;``.
+
+    Returns
+    -------
+    int
+        Number of deleted rows.
+    """
+    collect_keys, index_keys, delete_chunk = _get_delete_absent_sql(
+        table, pk_column, key_table, key_condition, scope, chunk_size
+    )
+    cursor.execute(collect_keys)
+    count = cursor.rowcount
+
+    deleted = 0
+    try:
+        if count > chunk_size:
+            cursor.execute(index_keys)
+        for start in range(0, count, chunk_size):
+            if commit_chunks:
+                cursor.execute(begin)
+            cursor.execute(delete_chunk, {"start": start})
+            deleted += cursor.rowcount
+            if commit_chunks:
+                cursor.execute("COMMIT;")
+    finally:
+        if commit_chunks:
+            _rollback_open_transaction(cursor)
+        if cursor.connection.info.transaction_status != pq.TransactionStatus.INERROR:
+            cursor.execute("DROP TABLE delete_keys;")
+    return deleted
+
+
 def upsert_from_existing_data(
     model: Type[Model],
     source_table_name: str,
@@ -67,6 +490,11 @@ def upsert_from_existing_data(
     identification_field_names: typing.List[str] = None,
     method: str = ImportMethod.OVERWRITE,
     source_schema: str = "public",
+    replace_scope: typing.Dict[str, typing.Any] = None,
+    delete_chunk_size: int = 10000,
+    skip_unchanged: bool = False,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
 ):
     """Upsert rows from an existing staging table into *model*'s table.
 
@@ -82,7 +510,15 @@ def upsert_from_existing_data(
         Name of the staging table to read from (without schema).
     cols : list of dict
         Column definitions. Each entry is a mapping with at least
-        ``name`` (source column) and ``target`` (target column on *model*).
+        ``target`` (target column on *model*) and optionally ``source``
+        (source column, default the target) or a fixed ``value``. A
+        foreign-key target with a ``lookup`` key is resolved by natural
+        key: ``{"target": "project_id", "source": "project_code",
+        "lookup": "ids"}`` writes the key of the project whose ``ids`` equals
+        ``project_code``, with one join on the related table. Keys without
+        exactly one related row raise :class:`UnresolvedLookupError`
+        before anything is written, or are written as ``NULL`` with
+        ``"unresolved": UnresolvedLookup.SET_NULL``.
     update_field_names : list of str
         Column names that should participate in the ``UPDATE`` branch of
         the upsert. Identification fields are stripped from this list
@@ -96,19 +532,132 @@ def upsert_from_existing_data(
     source_schema : str, optional
         PostgreSQL schema the staging table lives in. Default is
         ``"public"``.
+    replace_scope : dict, optional
+        Only with ``ImportMethod.REPLACE``: ``{column: value}`` pairs that
+        limit which rows of the target table may be deleted, for instance
+        ``{"project_id": 12}``. Identification columns with a fixed
+        ``value`` in *cols* are added to the scope automatically. With an
+        empty source table and no scope nothing is deleted and a warning
+        is logged, so an empty import can't empty the table.
+    delete_chunk_size : int, optional
+        Only with ``ImportMethod.REPLACE``: rows deleted per transaction.
+        Default is ``10000``.
+    skip_unchanged : bool, optional
+        Only update rows where at least one updated column ``IS DISTINCT
+        FROM`` the new value, so identical rows create no dead tuples, WAL
+        or trigger calls. Default is ``False``.
+    merge_method : str, optional
+        How new values are merged into an existing row (see
+        :class:`~rgs_django_utils.database.db_types.RecordMergeMethod`).
+        Default is ``RecordMergeMethod.REPLACE``.
+    tuning : str or dict, optional
+        Import tuning profile applied with ``SET LOCAL`` in the upsert
+        transaction (see
+        :func:`~rgs_django_utils.database.import_tuning.import_tuning`).
+        Default is no tuning.
+
+    Returns
+    -------
+    tuple of int
+        ``(updated, inserted)``. Deleted rows and rows skipped by
+        *skip_unchanged* are logged.
     """
-    cols_dict = collections.OrderedDict((col.get("target"), col) for col in cols)
+    statements = _ExistingDataUpsert(
+        model,
+        source_table_name,
+        cols,
+        update_field_names,
+        identification_field_names,
+        method,
+        source_schema,
+        skip_unchanged,
+        merge_method,
+        tuning,
+    )
 
-    pk_field = model._meta.pk.column
-    if identification_field_names is None:
-        identification_field_names = [pk_field]
+    with connection.cursor() as cursor:
+        updated = 0
+        inserted = 0
 
-    # remove identification_field_names from update_field_names
-    update_field_names = [field for field in update_field_names if field not in identification_field_names]
+        for target, unresolved, check in statements.lookup_checks:
+            cursor.execute(check)
+            statements.check_lookup(target, unresolved, cursor.fetchall())
+
+        replace = method == ImportMethod.REPLACE
+        if replace:
+            cursor.execute(statements.source_is_empty)
+            if cursor.fetchone()[0]:
+                replace = not _skip_empty_import(
+                    "upsert_from_existing_data", model, method, statements.get_replace_scope(replace_scope)
+                )
 
-    identification_field_names + update_field_names
+        cursor.execute(statements.begin)
+        cursor.execute(statements.index_cols_source_table)
+        cursor.execute(statements.lock)
+
+        if statements.update_part:
+            # print(statements.update_part.as_string(cursor.connection))
+            values = {**statements.set_values, **statements.where_values}
+            # print(values)
+            # print(statements.update_part.as_string(cursor.connection))
+            cursor.execute(statements.update_part, values)
+            updated, matched = cursor.fetchone()
+            if skip_unchanged:
+                log.info(
+                    "upsert_from_existing_data skipped %s unchanged rows of %s",
+                    matched - updated,
+                    model._meta.db_table,
+                )
+        if statements.insert_part:
+            # print(statements.insert_part.as_string(cursor.connection))
+            cursor.execute(statements.insert_part, {**statements.insert_values, **statements.where_values})
+            inserted = cursor.fetchone()[0]
+        cursor.execute("COMMIT;")
+
+        if replace:
+            deleted = _delete_absent_rows(
+                cursor,
+                statements.target_table,
+                statements.pk_field,
+                statements.source_from,
+                statements.where_cols,
+                statements.get_replace_scope(replace_scope),
+                delete_chunk_size,
+                begin=statements.begin,
+            )
+            log.info("upsert_from_existing_data deleted %s rows from %s", deleted, model._meta.db_table)
+
+    return updated, inserted
+
+
+class _ExistingDataUpsert:
+    """Composed statements of :func:`upsert_from_existing_data`, shared with its async counterpart.
+
+    See :func:`upsert_from_existing_data` for the parameters.
+    """
+
+    def __init__(
+        self,
+        model: Type[Model],
+        source_table_name: str,
+        cols: typing.List[typing.Dict[str, typing.Any]],
+        update_field_names: typing.List[str],
+        identification_field_names: typing.Union[typing.List[str], None],
+        method: str,
+        source_schema: str,
+        skip_unchanged: bool,
+        merge_method: str = RecordMergeMethod.REPLACE,
+        tuning: TuningProfile = None,
+    ):
+        cols_dict = collections.OrderedDict((col.get("target"), col) for col in cols)
+
+        pk_field = model._meta.pk.column
+        if identification_field_names is None:
+            identification_field_names = [pk_field]
+
+        # remove identification_field_names from update_field_names
+        update_field_names = [field for field in update_field_names if field not in identification_field_names]
 
-    with connection.cursor() as cursor:
         target_table = sql.Identifier(model._meta.db_table)
         source_table = sql.SQL("{source_schema}.{source_table_name}").format(
             source_schema=sql.Identifier(source_schema),
@@ -140,30 +689,81 @@ def upsert_from_existing_data(
             )
         index_cols_source_table = sql.SQL("\n").join(index_cols_source_table)
 
+        # lookup columns read the key of the related row with the natural key of the source column
+        lookup_joins = []
+        lookup_values = {}
+        lookup_checks = []
+        for index, col in enumerate(cols):
+            if "lookup" not in col or col.get("value", NotAvailable) != NotAvailable:
+                continue
+            field = model._meta.get_field(col.get("target"))
+            if field.related_model is None:
+                raise ValueError(f"lookup column {col.get('target')} is not a foreign key")
+            alias = sql.Identifier(f"lookup_{index}")
+            related_table = sql.Identifier(field.related_model._meta.db_table)
+            lookup_col = sql.Identifier(field.related_model._meta.get_field(col["lookup"]).column)
+            related_key = sql.Identifier(field.target_field.column)
+            natural_key = sql.SQL("{source_table}.{source_col}").format(
+                source_table=source_table, source_col=sql.Identifier(col.get("source", col.get("target")))
+            )
+            lookup_joins.append(
+                sql.SQL("LEFT JOIN {related_table} {alias} ON {alias}.{lookup_col} = {natural_key}").format(
+                    related_table=related_table, alias=alias, lookup_col=lookup_col, natural_key=natural_key
+                )
+            )
+            lookup_values[col.get("target")] = sql.SQL("{alias}.{related_key}").format(
+                alias=alias, related_key=related_key
+            )
+            # keys with no or several related rows
+            check = sql.SQL("""
+                SELECT natural_keys.natural_key, count({alias}.{related_key}) AS matches
+                FROM (SELECT DISTINCT {natural_key} AS natural_key FROM {source_table}) natural_keys
+                LEFT JOIN {related_table} {alias} ON {alias}.{lookup_col} = natural_keys.natural_key
+                WHERE natural_keys.natural_key IS NOT NULL
+                GROUP BY natural_keys.natural_key
+                HAVING count({alias}.{related_key}) <> 1
+                ORDER BY natural_keys.natural_key;
+            """).format(
+                alias=alias,
+                related_key=related_key,
+                natural_key=natural_key,
+                source_table=source_table,
+                related_table=related_table,
+                lookup_col=lookup_col,
+            )
+            lookup_checks.append((col.get("target"), col.get("unresolved", UnresolvedLookup.RAISE), check))
+        source_from = sql.SQL(" ").join([source_table, *lookup_joins])
+
+        def source_value(col):
+            if col.get("target") in lookup_values:
+                return lookup_values[col.get("target")]
+            return sql.SQL("{source_table}.{source_col}").format(
+                source_table=source_table,
+                source_col=sql.Identifier(col.get("source", col.get("target"))),
+            )
+
         # for update part, the set columns and values are determined
         set_cols = []
         set_values = {}
+        new_values = {}
         for field_name in update_field_names:
             col = cols_dict.get(field_name)
             if col is None:
                 raise ValueError(f"field {field_name} not found in cols")
 
             if col.get("value", NotAvailable) != NotAvailable:
-                set_cols.append(
-                    sql.SQL("{target_col}={target_col_value}").format(
-                        target_col=sql.Identifier(col.get("target")),
-                        target_col_value=sql.Literal(col.get("value")),
-                    )
-                )
                 set_values[col.get("target")] = col.get("value")
+                new_value = sql.Literal(col.get("value"))
             else:
-                set_cols.append(
-                    sql.SQL("{target_col}={source_table}.{source_col}").format(
-                        source_table=source_table,
-                        target_col=sql.Identifier(col.get("target")),
-                        source_col=sql.Identifier(col.get("source", col.get("target"))),
-                    )
+                new_value = source_value(col)
+            new_value = _get_merged_value(col.get("target"), new_value, merge_method)
+            set_cols.append(
+                sql.SQL("{target_col}={new_value}").format(
+                    target_col=sql.Identifier(col.get("target")), new_value=new_value
                 )
+            )
+            if skip_unchanged:
+                new_values[col.get("target")] = (new_value, _get_postgres_field_type(col.get("target"), model))
         set_cols = sql.SQL(",").join(set_cols)
 
         insert_target_cols = []
@@ -182,12 +782,7 @@ def upsert_from_existing_data(
                 )
                 insert_values[col.get("target")] = col.get("value")
             else:
-                insert_source_cols.append(
-                    sql.SQL("{source_table}.{source_col}").format(
-                        source_table=source_table,
-                        source_col=sql.Identifier(col.get("source", col.get("target"))),
-                    )
-                )
+                insert_source_cols.append(source_value(col))
         insert_target_cols = sql.SQL(",").join(insert_target_cols)
         insert_source_cols = sql.SQL(",").join(insert_source_cols)
 
@@ -209,11 +804,10 @@ def upsert_from_existing_data(
                 where_values[col.get("target")] = col.get("value")
             else:
                 where_cols.append(
-                    sql.SQL("target_table.{target_col}={source_table}.{source_col}").format(
+                    sql.SQL("target_table.{target_col}={source_value}").format(
                         # target_table=target_table,
                         target_col=sql.Identifier(col.get("target")),
-                        source_table=source_table,
-                        source_col=sql.Identifier(col.get("source", col.get("target"))),
+                        source_value=source_value(col),
                     )
                 )
         where_cols = sql.SQL(" AND ").join(where_cols)
@@ -224,15 +818,23 @@ def upsert_from_existing_data(
             update_part = sql.SQL("""
                 WITH upd as (UPDATE {target_table} target_table
                 SET {set_cols}
-                FROM {source_table}
-                WHERE {where_cols}
+                FROM {source_from}
+                WHERE {where_cols}{changed}
                 RETURNING *)
-                SELECT count(*) as updated FROM upd;
+                SELECT count(*) as updated, {matched} as matched FROM upd;
             """).format(
                 target_table=target_table,
                 set_cols=set_cols,
-                source_table=source_table,
+                source_from=source_from,
                 where_cols=where_cols,
+                changed=sql.SQL(" AND {changed}").format(changed=_get_changed_condition(new_values))
+                if skip_unchanged
+                else sql.SQL(""),
+                matched=sql.SQL(
+                    "(SELECT count(*) FROM {source_from} JOIN {target_table} target_table ON ({where_cols}))"
+                ).format(source_from=source_from, target_table=target_table, where_cols=where_cols)
+                if skip_unchanged
+                else sql.SQL("NULL"),
             )
 
         if method == ImportMethod.ONLY_UPDATE:
@@ -241,7 +843,7 @@ def upsert_from_existing_data(
             insert_part = sql.SQL("""
                 WITH ins as (INSERT INTO {target_table} ({insert_target_cols})
                 SELECT {insert_source_cols}
-                FROM {source_table}
+                FROM {source_from}
                 LEFT OUTER JOIN {target_table} target_table ON ({where_cols})
                 WHERE target_table.{pk_field_target_table} IS NULL
                 RETURNING *)
@@ -250,66 +852,453 @@ def upsert_from_existing_data(
                 target_table=target_table,
                 insert_target_cols=insert_target_cols,
                 insert_source_cols=insert_source_cols,
-                source_table=source_table,
+                source_from=source_from,
                 where_cols=where_cols,
                 pk_field_target_table=sql.Identifier(pk_field),
             )
 
-        if method == ImportMethod.REPLACE:
-            log.warning("REPLACE method is not implemented yet")
-
-        updated = 0
-        inserted = 0
-
-        cursor.execute("BEGIN;")
-        # --SET LOCAL tapp.skip_recalc_flagging = true;
-        cursor.execute(index_cols_source_table)
+        self.pk_field = pk_field
+        self.cols_dict = cols_dict
+        self.identification_field_names = identification_field_names
+        self.target_table = target_table
+        self.source_table = source_table
+        # the source table joined with the related tables of the lookup columns
+        self.source_from = source_from
+        self.source_is_empty = sql.SQL("SELECT NOT EXISTS (SELECT FROM {source_table});").format(
+            source_table=source_table
+        )
+        self.lookup_checks = lookup_checks
+        self.begin = sql.SQL("BEGIN;\n{tuning}").format(tuning=get_tuning_sql(tuning))
+        self.index_cols_source_table = index_cols_source_table
         # table will be unlocked after commit
-        cursor.execute(
-            sql.SQL("LOCK TABLE {target_table} IN EXCLUSIVE MODE;").format(
-                target_table=target_table,
+        self.lock = sql.SQL("LOCK TABLE {target_table} IN EXCLUSIVE MODE;").format(target_table=target_table)
+        self.update_part = update_part
+        self.insert_part = insert_part
+        self.set_values = set_values
+        self.insert_values = insert_values
+        self.where_cols = where_cols
+        self.where_values = where_values
+
+    def get_replace_scope(
+        self, replace_scope: typing.Union[typing.Dict[str, typing.Any], None]
+    ) -> typing.Dict[str, typing.Any]:
+        """Return the delete scope of ``ImportMethod.REPLACE``, including the fixed identification values."""
+        # rows with a fixed identification value belong to that value only
+        scope = {
+            col.get("target"): col.get("value")
+            for col in (self.cols_dict[field_name] for field_name in self.identification_field_names)
+            if col.get("value", NotAvailable) != NotAvailable
+        }
+        scope.update(replace_scope or {})
+        return scope
+
+    @staticmethod
+    def check_lookup(target: str, unresolved_mode: str, problems: typing.List[typing.Tuple[typing.Any, int]]):
+        """Raise or log the natural keys of the lookup column *target* without exactly one related row.
+
+        *problems* are the ``(natural key, matches)`` rows of the lookup
+        check. Ambiguous keys always raise, since the join would multiply
+        the source rows.
+        """
+        unresolved = [natural_key for natural_key, matches in problems if matches == 0]
+        ambiguous = [natural_key for natural_key, matches in problems if matches > 1]
+        if ambiguous or (unresolved and unresolved_mode != UnresolvedLookup.SET_NULL):
+            raise UnresolvedLookupError(target, unresolved, ambiguous)
+        if unresolved:
+            log.warning(
+                "lookup of %s found no related row for %s keys, written as NULL: %s",
+                target,
+                len(unresolved),
+                unresolved[:10],
             )
+
+
+class UnresolvedLookupError(ValueError):
+    """Natural keys of a ``lookup`` column without exactly one related row.
+
+    Attributes
+    ----------
+    target : str
+        The lookup column.
+    unresolved : list
+        Natural keys without a related row.
+    ambiguous : list
+        Natural keys with more than one related row.
+    """
+
+    def __init__(self, target: str, unresolved: typing.List, ambiguous: typing.List = ()):
+        self.target = target
+        self.unresolved = list(unresolved)
+        self.ambiguous = list(ambiguous)
+        sample = ", ".join(repr(natural_key) for natural_key in (self.unresolved + self.ambiguous)[:10])
+        super().__init__(
+            f"lookup of {target}: {len(self.unresolved)} keys not found and "
+            f"{len(self.ambiguous)} keys ambiguous ({sample})"
         )
 
-        if update_part:
-            # print(update_part.as_string(cursor.connection))
-            values = {**set_values, **where_values}
-            # print(values)
-            # print(update_part.as_string(cursor.connection))
-            cursor.execute(update_part, values)
-            updated = cursor.fetchone()[0]
-        if insert_part:
-            # print(insert_part.as_string(cursor.connection))
-            cursor.execute(insert_part, {**insert_values, **where_values})
-            inserted = cursor.fetchone()[0]
-        # --SET LOCAL tapp.skip_recalc_flagging = false;
-        cursor.execute("COMMIT;")
 
-    return updated, inserted
+class UpsertStats:
+    """Row counts of one :func:`upsert_multiple_data` call, summed over all pages.
+
+    Attributes
+    ----------
+    inserted : int
+        Rows inserted into the target table.
+    updated : int
+        Existing rows that were updated.
+    unchanged : int
+        Rows that matched an existing row which was left as is, for
+        instance with ``ImportMethod.ONLY_NEW`` or because nothing changed
+        with ``skip_unchanged``.
+    rejected : int
+        Rows that were neither inserted nor matched, for instance rows
+        without an existing counterpart under ``ImportMethod.ONLY_UPDATE``.
+    deleted : int
+        Rows of the target table deleted by ``ImportMethod.REPLACE``
+        because they were absent from the input.
+    pages : int
+        Number of merged pages (``1`` for ``StagingMode.SINGLE_MERGE``).
+    page_sizes : list of int
+        Number of rows of every staged page, in order; shows the sizes
+        chosen by adaptive page sizing.
+    rejects : list of RejectedRow
+        Rows that failed to upsert with ``RowErrorMode.ISOLATE``, with
+        their error.
+    duplicates : int
+        Input rows dropped by *deduplicate* because another row had the
+        same identification values.
+    timings : dict
+        ``{phase: {"seconds": float, "rows": int, "calls": int}}``: time
+        spent and rows handled per phase of the upsert (see
+        :func:`upsert_multiple_data`), summed over all pages.
+
+    Examples
+    --------
+    >>> stats = UpsertStats()
+    >>> stats.add_page(staged=10, inserted=4, updated=5)
+    >>> stats
+    UpsertStats(inserted=4, updated=5, unchanged=1, rejected=0, failed=0, duplicates=0, deleted=0, pages=1)
+    >>> stats.total
+    10
+    """
+
+    def __init__(
+        self,
+        inserted: int = 0,
+        updated: int = 0,
+        unchanged: int = 0,
+        rejected: int = 0,
+        deleted: int = 0,
+        pages: int = 0,
+        page_sizes: typing.List[int] = None,
+        rejects: typing.List["RejectedRow"] = None,
+        duplicates: int = 0,
+        timings: typing.Dict[str, typing.Dict[str, typing.Any]] = None,
+    ):
+        self.inserted = inserted
+        self.updated = updated
+        self.unchanged = unchanged
+        self.rejected = rejected
+        self.deleted = deleted
+        self.pages = pages
+        self.page_sizes = list(page_sizes or [])
+        self.rejects = list(rejects or [])
+        self.duplicates = duplicates
+        self.timings = {phase: dict(timing) for phase, timing in (timings or {}).items()}
+
+    @property
+    def failed(self) -> int:
+        """Number of rows that failed to upsert, see :attr:`rejects`."""
+        return len(self.rejects)
+
+    @property
+    def total(self) -> int:
+        """Number of input rows accounted for (``deleted`` rows are not part of the input)."""
+        return self.inserted + self.updated + self.unchanged + self.rejected + self.failed + self.duplicates
+
+    def add_page(
+        self,
+        staged: int,
+        inserted: int,
+        updated: int,
+        matched: typing.Union[int, None] = None,
+        untouched_are_rejected: bool = False,
+    ):
+        """Add the counts of one merged page of *staged* rows.
+
+        Rows that were neither inserted nor updated count as ``unchanged``,
+        or as ``rejected`` when *untouched_are_rejected* is set (the
+        method has no insert branch, so such rows had no match). When the
+        number of *matched* rows is known, matched rows that were not
+        updated are ``unchanged`` and the other untouched rows ``rejected``.
+        """
+        self.inserted += inserted
+        self.updated += updated
+        if matched is not None:
+            self.unchanged += matched - updated
+            self.rejected += staged - inserted - matched
+        elif untouched_are_rejected:
+            self.rejected += staged - inserted - updated
+        else:
+            self.unchanged += staged - inserted - updated
+        self.pages += 1
+
+    def add_timing(self, phase: str, seconds: float, rows: int):
+        """Add *seconds* spent on *rows* rows to the timing of *phase*."""
+        timing = self.timings.setdefault(phase, {"seconds": 0.0, "rows": 0, "calls": 0})
+        timing["seconds"] += seconds
+        timing["rows"] += rows
+        timing["calls"] += 1
+
+    def __add__(self, other: "UpsertStats") -> "UpsertStats":
+        """Return the summed counts of two upserts, e.g. of the partitions of a parallel upsert."""
+        if not isinstance(other, UpsertStats):
+            return NotImplemented
+        counts = {
+            key: value + getattr(other, key)
+            for key, value in self.as_dict().items()
+            if key not in ("failed", "timings")
+        }
+        stats = UpsertStats(**counts, rejects=self.rejects + other.rejects, timings=self.timings)
+        for phase, timing in other.timings.items():
+            summed = stats.timings.setdefault(phase, {"seconds": 0.0, "rows": 0, "calls": 0})
+            for key, value in timing.items():
+                summed[key] += value
+        return stats
+
+    def as_dict(self) -> dict:
+        """Return the counts as a plain dict, e.g. for logging or an API response."""
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "deleted": self.deleted,
+            "pages": self.pages,
+            "page_sizes": self.page_sizes,
+            "timings": self.timings,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"UpsertStats(inserted={self.inserted}, updated={self.updated}, unchanged={self.unchanged}, "
+            f"rejected={self.rejected}, failed={self.failed}, duplicates={self.duplicates}, "
+            f"deleted={self.deleted}, pages={self.pages})"
+        )
+
+
+class RejectedRow:
+    """A row that failed to upsert with ``RowErrorMode.ISOLATE``.
+
+    Attributes
+    ----------
+    row : dict
+        The values of the row by field name, as staged (geometries already
+        encoded with ``GeometryFormat.WKB``).
+    error : str
+        The database error message.
+    sqlstate : str or None
+        The SQLSTATE code of the error, e.g. ``"23505"`` for a unique
+        violation.
+    """
+
+    def __init__(self, row: typing.Dict[str, typing.Any], error: str, sqlstate: typing.Union[str, None] = None):
+        self.row = row
+        self.error = error
+        self.sqlstate = sqlstate
+
+    def as_dict(self) -> dict:
+        """Return the reject as a plain dict, e.g. to write it to a rejects table."""
+        return {"row": self.row, "error": self.error, "sqlstate": self.sqlstate}
+
+    def __repr__(self) -> str:
+        return f"RejectedRow({self.row!r}, {self.error!r}, sqlstate={self.sqlstate!r})"
+
+
+# errors caused by the data of a row (as raised by a Django cursor and by psycopg), isolated by RowErrorMode.ISOLATE
+_ROW_ERRORS = (DataError, IntegrityError, psycopg.DataError, psycopg.IntegrityError)
+
+
+def _get_reject(page, field_names: typing.List[str], error: Exception) -> RejectedRow:
+    """Return the :class:`RejectedRow` of the single row of *page* (rows or a DataFrame)."""
+    values = page.iloc[0].tolist() if hasattr(page, "iloc") else page[0]
+    # Django re-raises the psycopg error as its own exception class
+    sqlstate = getattr(error, "sqlstate", None) or getattr(error.__cause__, "sqlstate", None)
+    return RejectedRow(dict(zip(field_names, values)), str(error).strip(), sqlstate)
+
+
+class AdaptivePageSize:
+    """Page size of :func:`upsert_multiple_data` that follows a byte budget and/or a latency per page.
+
+    After every page the size is re-estimated from the measured bytes and
+    seconds per row, so the next page is expected to hit the tightest
+    target. The size shrinks at once when a page was too large, and grows
+    at most by *max_growth* per page, because the fixed cost of a round
+    trip makes small pages look slower per row than they are.
+
+    Parameters
+    ----------
+    size : int
+        Size of the first page.
+    target_bytes : int, optional
+        Bytes of row data per page.
+    target_seconds : float, optional
+        Seconds per page (staging plus merge).
+    min_size, max_size : int, optional
+        Bounds of the page size. Default is ``1`` and ``1_000_000``.
+    max_growth : float, optional
+        Maximum growth factor per page. Default is ``2``.
+
+    Examples
+    --------
+    >>> sizer = AdaptivePageSize(1000, target_bytes=1_000_000)
+    >>> sizer.record(rows=1000, sent_bytes=5_000_000, seconds=0.5)
+    >>> sizer.size
+    200
+    """
+
+    def __init__(
+        self,
+        size: int,
+        target_bytes: typing.Union[int, None] = None,
+        target_seconds: typing.Union[float, None] = None,
+        min_size: int = 1,
+        max_size: int = 1_000_000,
+        max_growth: float = 2.0,
+    ):
+        if target_bytes is None and target_seconds is None:
+            raise ValueError("adaptive page sizing needs target_bytes and/or target_seconds")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_growth = max_growth
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.size = self._clamp(size)
+
+    def _clamp(self, size: float) -> int:
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    def record(self, rows: int, sent_bytes: int, seconds: float):
+        """Set the next page size from a page of *rows* rows that took *sent_bytes* and *seconds*."""
+        if rows <= 0:
+            return
+        estimates = []
+        if self.target_bytes is not None and sent_bytes > 0:
+            estimates.append(self.target_bytes * rows / sent_bytes)
+        if self.target_seconds is not None and seconds > 0:
+            estimates.append(self.target_seconds * rows / seconds)
+        if estimates:
+            self.size = self._clamp(min(min(estimates), self.size * self.max_growth))
+
+    def __repr__(self) -> str:
+        return (
+            f"AdaptivePageSize(size={self.size}, target_bytes={self.target_bytes}, "
+            f"target_seconds={self.target_seconds})"
+        )
+
+
+def _iter_adaptive_pages(
+    rows: typing.Iterator[typing.List], sizer: AdaptivePageSize
+) -> typing.Iterator[typing.List[typing.List]]:
+    """Split *rows* into pages of the current ``sizer.size`` rows."""
+    while True:
+        page = list(itertools.islice(rows, sizer.size))
+        if not page:
+            return
+        yield page
+
+
+TimingCallback = typing.Callable[[str, float, int], None]
+
+
+class _PhaseTimer:
+    """Records the duration and rows of the upsert phases in *stats* and passes them to *callback*."""
+
+    def __init__(self, stats: UpsertStats, callback: typing.Union[TimingCallback, None] = None):
+        self.stats = stats
+        self.callback = callback
+
+    def record(self, phase: str, start: float, rows: int):
+        """Record *phase*, started at ``time.perf_counter()`` value *start*, for *rows* rows."""
+        seconds = time.perf_counter() - start
+        self.stats.add_timing(phase, seconds, rows)
+        if self.callback is not None:
+            self.callback(phase, seconds, rows)
+
+    def iter_pages(self, pages: typing.Iterable) -> typing.Iterator:
+        """Yield the pages of *pages*, recording the time spent producing them as phase ``read``."""
+        pages = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            self.record("read", start, len(page))
+            yield page
+
+
+def _get_task_timer(name: str) -> typing.Union[SubTimer, contextlib.nullcontext]:
+    """Return a :class:`SubTimer` for *name* when the active task logs timing, else a no-op context."""
+    task_info = get_task_info()
+    if task_info and task_info.get("log_timing"):
+        return SubTimer(name)
+    return contextlib.nullcontext()
+
+
+def _log_stats_counters(name: str, stats: UpsertStats):
+    """Add the row counts and phase timings (in ms) of *stats* to the summary of the active task."""
+    task_info = get_task_info()
+    if not task_info or not task_info.get("log_timing"):
+        return
+    for key in ("inserted", "updated", "unchanged", "rejected", "failed", "duplicates", "deleted"):
+        if getattr(stats, key):
+            log_counter(f"{name} {key}", getattr(stats, key))
+    for phase, timing in stats.timings.items():
+        log_counter(f"{name} {phase} ms", round(timing["seconds"] * 1000))
 
 
 def upsert_multiple_data(
     model: Type[Model],
-    data: typing.List[typing.Tuple | typing.List | typing.Dict],
+    data: typing.Iterable[typing.Tuple | typing.List | typing.Dict],
     data_fields: typing.List[str],
     update_field_names: typing.List[str],
     identification_field_names: typing.List[str] = None,
     method: str = ImportMethod.OVERWRITE,
     page_size: int = 1000,
+    transfer: str = TransferMethod.VALUES,
+    staging: str = StagingMode.PER_PAGE,
+    replace_scope: typing.Dict[str, typing.Any] = None,
+    delete_chunk_size: int = 10000,
+    skip_unchanged: bool = False,
+    prepare: bool = False,
+    geometry_format: str = GeometryFormat.WKT,
+    workers: int = 1,
+    page_bytes: int = None,
+    page_seconds: float = None,
+    on_error: str = RowErrorMode.RAISE,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
 ):
-    """Upsert in-memory rows into *model*'s table in paged batches.
+    """Upsert rows into *model*'s table in paged batches.
 
-    Normalises *data* (list of dicts, tuples or lists) into a list-of-lists
+    Normalises *data* (an iterable of dicts, tuples or lists) into lists
     matching *data_fields*, then performs a set-based upsert against the
-    model's table. Rows are uploaded in batches of *page_size* to avoid
-    oversized SQL statements.
+    model's table. *data* is consumed lazily, one page of *page_size* rows
+    at a time, so memory use does not grow with the size of the input.
 
     Parameters
     ----------
     model : type[django.db.models.Model]
         Target Django model.
-    data : list of tuple, list or dict
-        In-memory rows to upsert. Dict rows are keyed by *data_fields*.
+    data : iterable of tuple, list or dict
+        Rows to upsert — a list, generator, ``csv.reader``, DB cursor or
+        any other iterable. Dict rows are keyed by *data_fields*. A
+        server-side cursor must live on another connection than
+        ``default``, because every page is committed.
     data_fields : list of str
         Column order for tuple/list rows and the keys looked up on dict
         rows.
@@ -323,19 +1312,165 @@ def upsert_multiple_data(
         Default is ``ImportMethod.OVERWRITE``.
     page_size : int, optional
         Number of rows per SQL statement. Default is ``1000``.
+    transfer : str, optional
+        How rows are sent to the staging table (see
+        :class:`~rgs_django_utils.database.db_types.TransferMethod`).
+        ``TransferMethod.COPY`` streams the rows with psycopg's
+        ``cursor.copy()`` instead of rendering one large ``VALUES``
+        statement per page, which removes most of the client-side CPU
+        time for large imports. Default is ``TransferMethod.VALUES``.
+    staging : str, optional
+        Lifecycle of the ``newvals`` staging table (see
+        :class:`~rgs_django_utils.database.db_types.StagingMode`).
+        ``StagingMode.PER_PAGE`` builds and drops it for every page,
+        ``StagingMode.REUSE`` builds it once and truncates it between
+        pages, both committing per page (short table locks).
+        ``StagingMode.SINGLE_MERGE`` stages all rows and merges them in
+        one transaction (highest throughput, all-or-nothing). Default is
+        ``StagingMode.PER_PAGE``.
+    replace_scope : dict, optional
+        Only with ``ImportMethod.REPLACE``: ``{column: value}`` pairs that
+        limit which rows of the target table may be deleted, for instance
+        ``{"project_id": 12}`` to replace the rows of one project only.
+        Default is the whole table. Without records the rows in the scope
+        are deleted; without records and without a scope nothing is
+        deleted and a warning is logged, so an empty import can't empty
+        the table.
+    delete_chunk_size : int, optional
+        Only with ``ImportMethod.REPLACE``: maximum number of rows deleted
+        per statement. Each chunk is committed separately, except with
+        ``StagingMode.SINGLE_MERGE``. Default is ``10000``.
+    skip_unchanged : bool, optional
+        Only update rows where at least one updated column ``IS DISTINCT
+        FROM`` the staged value. Identical rows are left alone (no dead
+        tuples, WAL or ``db_last_modified`` / recalc triggers) and are
+        counted as ``unchanged``. Default is ``False``.
+    prepare : bool, optional
+        Run the merge as a server-side prepared statement, prepared once
+        per connection. Saves parsing the merge statement for every page;
+        not usable behind a pooler in transaction mode. Default is
+        ``False``.
+    geometry_format : str, optional
+        Encoding of geometry values (see
+        :class:`~rgs_django_utils.database.db_types.GeometryFormat`).
+        ``GeometryFormat.WKT`` expects WKT strings, converted with
+        ``ST_GeomFromText``. ``GeometryFormat.WKB`` accepts shapely
+        geometries and WKB / EWKB (``bytes`` or hex); they are encoded per
+        page with shapely's vectorised functions and sent as ``bytea``,
+        which avoids formatting and parsing WKT and keeps full coordinate
+        precision. Default is ``GeometryFormat.WKT``.
+    workers : int, optional
+        Number of connections merging in parallel. With more than one
+        worker the rows are partitioned by a hash of their identification
+        values and every partition is upserted by its own thread and
+        database connection, holding an advisory lock of its partition
+        instead of the ``EXCLUSIVE`` table lock. Not available for
+        ``ImportMethod.REPLACE``. Default is ``1``.
+    page_bytes : int, optional
+        Adaptive page sizing: aim for pages of this many bytes of row data
+        (``VALUES`` text or COPY data). *page_size* is then the size of the
+        first page, and every next page is sized from the bytes per row
+        measured so far (see :class:`AdaptivePageSize`). Not available with
+        *workers*.
+    page_seconds : float, optional
+        Adaptive page sizing: aim for pages that take this many seconds to
+        stage and merge. Combined with *page_bytes* the smaller estimate
+        wins. The chosen sizes are reported in ``UpsertStats.page_sizes``.
+    on_error : str, optional
+        Handling of rows that fail with a data or integrity error (see
+        :class:`~rgs_django_utils.database.db_types.RowErrorMode`).
+        ``RowErrorMode.ISOLATE`` bisects a failing page under savepoints,
+        merges the good rows of the page and reports the failing ones in
+        ``UpsertStats.rejects``. Not available with
+        ``StagingMode.SINGLE_MERGE``. Default is ``RowErrorMode.RAISE``.
+    deduplicate : str, optional
+        Drop rows with the same identification values as another row
+        before the merge (see
+        :class:`~rgs_django_utils.database.db_types.DuplicateMode`),
+        keeping the first or the last of them. Duplicates are removed
+        set-based in the staging table, so within a page, or over the
+        whole input with ``StagingMode.SINGLE_MERGE``. The dropped rows
+        are counted in ``UpsertStats.duplicates``. Default is
+        ``DuplicateMode.NONE``.
+    merge_method : str, optional
+        How new values are merged into an existing row (see
+        :class:`~rgs_django_utils.database.db_types.RecordMergeMethod`).
+        ``RecordMergeMethod.MERGE_NEW_LEADING`` keeps an existing value
+        where the new value is ``None``, ``MERGE_EXISTING_LEADING`` only
+        fills columns that are ``NULL`` in the existing row. Both are
+        ``COALESCE`` expressions in the set-based merge. Default is
+        ``RecordMergeMethod.REPLACE``.
+    tuning : str or dict, optional
+        Import tuning profile: the name of a profile in
+        ``settings.IMPORT_TUNING_PROFILES`` or a ``{setting: value}``
+        dict, applied with ``SET LOCAL`` after every ``BEGIN`` of the
+        upsert (see :mod:`~rgs_django_utils.database.import_tuning`).
+        Default is no tuning.
+    on_timing : callable, optional
+        Called as ``on_timing(phase, seconds, rows)`` for every measured
+        phase of every page, e.g. to feed a metrics system. With several
+        *workers* it is called from the worker threads. Default is
+        ``None``.
+
+    Returns
+    -------
+    UpsertStats
+        Inserted / updated / unchanged / rejected / deleted row counts,
+        summed over all pages.
 
     Notes
     -----
-    * The function currently returns ``None``; per-row insert/update/skip
-      counts are marked as TODO in the source.
-    * ``ImportMethod.REPLACE`` is not yet implemented.
+    * On Postgres 17+ every page is merged with one ``MERGE ... RETURNING
+      merge_action()`` statement; older servers run the ``UPDATE`` and the
+      ``INSERT`` as two data-modifying CTEs of one statement. ``MERGE``
+      raises an error when two input rows of a page share the same
+      identification values; use *deduplicate* for such input.
+    * Pages are merged in input order, so with per-page staging a key
+      that returns in a later page is simply updated again: over the
+      whole input ``DuplicateMode.KEEP_LAST`` holds, and
+      ``DuplicateMode.KEEP_FIRST`` only within a page.
+    * ``ImportMethod.REPLACE`` upserts like ``OVERWRITE`` and collects the
+      keys of all pages; after the last page the rows (within
+      *replace_scope*) whose key was not in the input are deleted.
+    * Column types and composed SQL are cached per model and column set
+      (see :func:`get_upsert_plan`), so small repeated upserts don't
+      resolve the same fields again.
+    * ``RowErrorMode.ISOLATE`` costs nothing while pages succeed. A
+      page with *k* failing rows is merged again in about
+      ``2 * k * log2(page_size)`` parts, each in a savepoint of one
+      transaction, so the page is still committed as a whole.
+    * The time per phase is summed in ``UpsertStats.timings``: ``read``
+      (normalising the input into pages; with *workers* the wait for the
+      reading thread), ``encode`` (mogrifying ``VALUES``), ``setup``
+      (``BEGIN`` and the staging table, when sent on its own),
+      ``transfer`` (sending the rows), ``merge`` (staging index,
+      ``ANALYZE`` and the merge statement, and with ``VALUES`` the rows
+      of the same round trip) and ``delete`` (``ImportMethod.REPLACE``).
+      Inside a :class:`~rgs_django_utils.logging.logging.log_context.TaskContext`
+      with ``log_timing`` the upsert runs in a ``SubTimer`` and adds its
+      row counts and phase times (in ms) to the task summary with
+      ``log_counter``.
+    * With several *workers* every partition commits on its own
+      connection: ``StagingMode.SINGLE_MERGE`` is all-or-nothing per
+      partition, and pages of the other partitions stay committed when one
+      partition fails. Concurrent parallel upserts into the same table
+      must use the same number of workers for the partition locks to
+      cover the same keys.
     """
-    # todo: return counts over inserts, updates and skipped
-    # todo: Add support for ImportMethod.REPLACE, optionally with set field to false or true
-    # todo: add tests for this function
-
-    if not len(data):
-        log.info("upsert_multiple_data has no records for table %s", model._meta.db_table)
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, got {workers}")
+    if workers > 1 and method == ImportMethod.REPLACE:
+        raise ValueError("ImportMethod.REPLACE needs all keys on one connection and can't run with workers > 1")
+    if page_bytes is not None or page_seconds is not None:
+        if workers > 1:
+            raise ValueError("adaptive page sizing (page_bytes, page_seconds) can't run with workers > 1")
+        page_sizer = AdaptivePageSize(page_size, page_bytes, page_seconds)
+    else:
+        page_sizer = None
+    if on_error == RowErrorMode.ISOLATE and staging == StagingMode.SINGLE_MERGE:
+        raise ValueError("RowErrorMode.ISOLATE needs a transaction per page and can't run with SINGLE_MERGE")
+    # hashable, and an unknown profile fails before any row is read
+    tuning = get_tuning_profile(tuning)
 
     pk_field = model._meta.pk.name
     if identification_field_names is None:
@@ -346,37 +1481,522 @@ def upsert_multiple_data(
 
     combined_field_names = identification_field_names + update_field_names
 
-    # make table (list of list) for the data with correctly ordered columns
-    total_data = []
-    if isinstance(data[0], dict):
-        for item in data:
-            total_data.append([item.get(col) for col in combined_field_names])
-    elif isinstance(data[0], (tuple, list)):
-        # map data order from data_fields to combined_field_names
-        data_field_map = {field: combined_field_names.index(field) for field in data_fields}
+    # lazy pages (list of list) with correctly ordered columns
+    rows = _iter_rows(data, data_fields, combined_field_names, identification_field_names, model)
+    pages = _iter_pages(rows, page_size) if page_sizer is None else _iter_adaptive_pages(rows, page_sizer)
+    if geometry_format == GeometryFormat.WKB:
+        geometry_columns = _get_geometry_columns(model, combined_field_names)
+        if geometry_columns:
+            pages = _iter_wkb_pages(pages, geometry_columns)
+    first_page = next(pages, None)
+    if first_page is None:
+        if _skip_empty_import("upsert_multiple_data", model, method, replace_scope):
+            return UpsertStats()
+    else:
+        pages = itertools.chain([first_page], pages)
+
+    name = f"upsert {model._meta.db_table}"
+    with _get_task_timer(name):
+        if workers > 1:
+            stats = _upsert_parallel(
+                model,
+                pages,
+                identification_field_names,
+                update_field_names,
+                method,
+                transfer,
+                staging,
+                skip_unchanged,
+                prepare,
+                geometry_format,
+                page_size,
+                workers,
+                on_error,
+                deduplicate,
+                merge_method,
+                tuning,
+                on_timing,
+            )
+        else:
+            stats = _upsert_pages(
+                model,
+                pages,
+                identification_field_names,
+                update_field_names,
+                method,
+                transfer,
+                staging,
+                replace_scope,
+                delete_chunk_size,
+                skip_unchanged,
+                prepare,
+                geometry_format,
+                page_sizer=page_sizer,
+                on_error=on_error,
+                deduplicate=deduplicate,
+                merge_method=merge_method,
+                tuning=tuning,
+                on_timing=on_timing,
+            )
+    _log_stats_counters(name, stats)
+    return stats
 
-        for field in identification_field_names:
-            if field not in data_fields:
-                raise ValueError(f"id field {field} is required in data_fields for model {model.__name__}")
 
-        for item in data:
-            total_data.append([item[data_field_map.get(col)] for col in combined_field_names])
-    # is this required?: with connection.cursor().connection.cursor() as cursor:
+def _skip_empty_import(
+    function_name: str,
+    model: Type[Model],
+    method: str,
+    replace_scope: typing.Union[typing.Dict[str, typing.Any], None],
+) -> bool:
+    """Return whether an upsert without records is done; only a scoped ``ImportMethod.REPLACE`` still deletes."""
+    log.info("%s has no records for table %s", function_name, model._meta.db_table)
+    if method != ImportMethod.REPLACE:
+        return True
+    if not replace_scope:
+        # an empty import is more likely a failed read than an emptied source
+        log.warning(
+            "%s with ImportMethod.REPLACE and no records leaves table %s untouched, pass a replace_scope to "
+            "delete its rows",
+            function_name,
+            model._meta.db_table,
+        )
+        return True
+    return False
+
 
+def _upsert_pages(
+    model: Type[Model],
+    pages: typing.Iterable,
+    identification_field_names: typing.List[str],
+    update_field_names: typing.List[str],
+    method: str,
+    transfer: str,
+    staging: str,
+    replace_scope: typing.Union[typing.Dict[str, typing.Any], None],
+    delete_chunk_size: int,
+    skip_unchanged: bool,
+    prepare: bool,
+    geometry_format: str = GeometryFormat.WKT,
+    partition: typing.Union[int, None] = None,
+    page_sizer: typing.Union[AdaptivePageSize, None] = None,
+    on_error: str = RowErrorMode.RAISE,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
+) -> "UpsertStats":
+    """Stage and merge *pages* into *model*'s table; the work horse of the upsert entry points.
+
+    *pages* holds lists of rows ordered as identification fields followed
+    by update fields, or DataFrames with those columns for
+    ``TransferMethod.COPY_CSV``. *partition* is set by
+    :func:`_upsert_parallel` to lock one partition instead of the table.
+    *page_sizer* receives the size and duration of every staged page.
+    See :func:`upsert_multiple_data` for the other parameters.
+    """
+    # is this required?: with connection.cursor().connection.cursor() as cursor:
     with connection.cursor() as cursor:
-        template = _get_mogrify_template(combined_field_names, model)
+        plan = get_upsert_plan(
+            model,
+            tuple(identification_field_names),
+            tuple(update_field_names),
+            method,
+            transfer,
+            skip_unchanged,
+            _supports_merge_returning(cursor),
+            geometry_format,
+            deduplicate,
+            merge_method,
+            get_tuning_profile(tuning),
+        )
+        replace = method == ImportMethod.REPLACE
+        copy_types = plan.get_copy_types(cursor)
+        if prepare:
+            plan.prepare(cursor)
+
+        def fragment(name):
+            return plan.get_sql(cursor, name, prepare, partition)
+
+        stats = UpsertStats()
+        timer = _PhaseTimer(stats, on_timing)
+        pages = timer.iter_pages(pages)
+
+        def stage(page, before=None, after=None):
+            start = time.perf_counter()
+            sent = _stage_page(
+                cursor, page, transfer, plan.template, fragment("cols"), copy_types, before, after, timer
+            )
+            stats.page_sizes.append(len(page))
+            if page_sizer is not None:
+                page_sizer.record(len(page), sent, time.perf_counter() - start)
+
+        def count(staged):
+            if plan.deduplicate:
+                duplicates = _fetch_duplicate_count(cursor)
+                stats.duplicates += duplicates
+                staged -= duplicates
+            inserted, updated, matched_rows = _fetch_merge_counts(cursor)
+            stats.add_page(staged, inserted, updated, matched_rows, untouched_are_rejected=not plan.do_insert)
+
+        def delete_absent(key_table, key_condition, commit_chunks=True):
+            start = time.perf_counter()
+            deleted = _delete_absent_rows(
+                cursor,
+                plan.table,
+                model._meta.pk.column,
+                sql.Identifier(key_table),
+                key_condition,
+                replace_scope,
+                delete_chunk_size,
+                commit_chunks,
+                plan.begin,
+            )
+            stats.deleted += deleted
+            timer.record("delete", start, deleted)
+
+        def keep_rejected_keys(reject):
+            # the target row of a rejected row is not absent from the input, so REPLACE must not delete it
+            cursor.execute("SAVEPOINT upsert_keys;")
+            try:
+                cursor.execute(plan.keep_row_keys, [reject.row[col] for col in plan.key_field_names])
+            except _ROW_ERRORS:
+                # an invalid key matches no target row
+                cursor.execute("ROLLBACK TO SAVEPOINT upsert_keys;")
+            cursor.execute("RELEASE SAVEPOINT upsert_keys;")
+
+        def isolate(page):
+            # merge the halves of a failing page under a savepoint, down to the single failing rows
+            try:
+                _stage_page(
+                    cursor,
+                    page,
+                    transfer,
+                    plan.template,
+                    fragment("cols"),
+                    copy_types,
+                    fragment("isolate_before"),
+                    fragment("isolate_after"),
+                    timer,
+                )
+            except _ROW_ERRORS as error:
+                cursor.execute("ROLLBACK TO SAVEPOINT upsert_rows; RELEASE SAVEPOINT upsert_rows;")
+                if len(page) == 1:
+                    reject = _get_reject(page, plan.field_names, error)
+                    stats.rejects.append(reject)
+                    log.warning("upsert into %s rejected a row: %s", model._meta.db_table, str(error).strip())
+                    if replace:
+                        keep_rejected_keys(reject)
+                else:
+                    middle = len(page) // 2
+                    isolate(page[:middle])
+                    isolate(page[middle:])
+            else:
+                count(len(page))
+
+        def merge(page, before, after, isolate_before, isolate_after):
+            try:
+                stage(page, before=fragment(before), after=fragment(after))
+                count(len(page))
+            except _ROW_ERRORS:
+                if on_error != RowErrorMode.ISOLATE:
+                    raise
+                _rollback_open_transaction(cursor)
+                # the isolated parts add up to one merged page
+                pages_before = stats.pages
+                cursor.execute(fragment(isolate_before))
+                isolate(page)
+                cursor.execute(fragment(isolate_after))
+                stats.pages = pages_before + 1
+                stats.page_sizes.append(len(page))
+
+        if replace and staging != StagingMode.SINGLE_MERGE:
+            cursor.execute(plan.create_import_keys)
+
+        try:
+            if staging == StagingMode.PER_PAGE:
+                for page in pages:
+                    merge(page, "per_page_before", "per_page_after", "per_page_before_isolate", "per_page_end")
+
+            elif staging == StagingMode.REUSE:
+                # temporary tables outlive a commit, so the table and its index are built only once
+                cursor.execute(fragment("reuse_create"))
+                try:
+                    for page in pages:
+                        merge(page, "reuse_before", "reuse_after", "reuse_before_isolate", "reuse_end")
+                finally:
+                    _rollback_open_transaction(cursor)
+                    cursor.execute("DROP TABLE newvals;")
+
+            elif staging == StagingMode.SINGLE_MERGE:
+                cursor.execute(fragment("single_merge_before"))
+                staged = 0
+                for page in pages:
+                    stage(page)
+                    staged += len(page)
+                start = time.perf_counter()
+                cursor.execute(fragment("single_merge_merge"))
+                timer.record("merge", start, staged)
+                count(staged)
+                if replace:
+                    # newvals holds every key; the deletes stay inside the single transaction
+                    delete_absent("newvals", plan.where_cols, commit_chunks=False)
+                cursor.execute("""
+                    DROP TABLE newvals;
+                    COMMIT;
+                """)
+
+            else:
+                raise ValueError(f"unknown staging mode {staging}")
+
+            if replace and staging != StagingMode.SINGLE_MERGE:
+                cursor.execute(plan.index_import_keys)
+                delete_absent("import_keys", plan.import_keys_condition)
+        except Exception:
+            _rollback_open_transaction(cursor)
+            raise
+        finally:
+            if replace and staging != StagingMode.SINGLE_MERGE:
+                cursor.execute("DROP TABLE IF EXISTS import_keys;")
+
+    return stats
+
+
+# end of the pages of a partition
+_DONE = object()
+
+
+def _upsert_parallel(
+    model: Type[Model],
+    pages: typing.Iterable[typing.List[typing.List]],
+    identification_field_names: typing.List[str],
+    update_field_names: typing.List[str],
+    method: str,
+    transfer: str,
+    staging: str,
+    skip_unchanged: bool,
+    prepare: bool,
+    geometry_format: str,
+    page_size: int,
+    workers: int,
+    on_error: str = RowErrorMode.RAISE,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
+) -> UpsertStats:
+    """Partition the rows of *pages* over *workers* connections and upsert the partitions concurrently.
+
+    The calling thread reads the input and routes every row by a stable
+    hash of its identification values, so all rows of one key end up in
+    the same partition (and duplicate keys keep their order). Every
+    partition is upserted with :func:`_upsert_pages` by a thread of its
+    own, on the thread's own Django connection, which is closed
+    afterwards. Pages are handed over through small queues, so the input
+    is still consumed lazily.
+
+    Returns the summed :class:`UpsertStats` of the partitions; the first
+    failing partition's exception is raised after all workers stopped.
+    """
+    key_count = len(identification_field_names)
+    queues = [queue.Queue(maxsize=2) for _ in range(workers)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upsert") as executor:
+        futures = [
+            executor.submit(
+                _upsert_partition,
+                partition,
+                pages_queue,
+                model,
+                identification_field_names,
+                update_field_names,
+                method,
+                transfer,
+                staging,
+                skip_unchanged,
+                prepare,
+                geometry_format,
+                on_error,
+                deduplicate,
+                merge_method,
+                tuning,
+                on_timing,
+            )
+            for partition, pages_queue in enumerate(queues)
+        ]
+
+        def distribute():
+            buffers = [[] for _ in range(workers)]
+            for page in pages:
+                for row in page:
+                    partition = _get_partition(row[:key_count], workers)
+                    buffer = buffers[partition]
+                    buffer.append(row)
+                    if len(buffer) >= page_size:
+                        if not _put_page(queues[partition], buffer, futures[partition]):
+                            return
+                        buffers[partition] = []
+            for partition, buffer in enumerate(buffers):
+                if buffer and not _put_page(queues[partition], buffer, futures[partition]):
+                    return
+
+        try:
+            distribute()
+        finally:
+            for pages_queue, future in zip(queues, futures):
+                _put_page(pages_queue, _DONE, future)
+
+        stats = UpsertStats()
+        for future in futures:
+            stats += future.result()
+    return stats
+
+
+def _upsert_partition(
+    partition: int,
+    pages_queue: queue.Queue,
+    model: Type[Model],
+    identification_field_names: typing.List[str],
+    update_field_names: typing.List[str],
+    method: str,
+    transfer: str,
+    staging: str,
+    skip_unchanged: bool,
+    prepare: bool,
+    geometry_format: str,
+    on_error: str = RowErrorMode.RAISE,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+    on_timing: TimingCallback = None,
+) -> UpsertStats:
+    """Upsert the pages of one partition until :data:`_DONE`; runs in a worker thread."""
+    try:
+        return _upsert_pages(
+            model,
+            iter(pages_queue.get, _DONE),
+            identification_field_names,
+            update_field_names,
+            method,
+            transfer,
+            staging,
+            None,
+            0,
+            skip_unchanged,
+            prepare,
+            geometry_format,
+            partition,
+            on_error=on_error,
+            deduplicate=deduplicate,
+            merge_method=merge_method,
+            tuning=tuning,
+            on_timing=on_timing,
+        )
+    finally:
+        # Django opened a connection for this thread
+        connection.close()
+
+
+def _get_partition(key: typing.Sequence, partitions: int) -> int:
+    """Return the partition of the identification values *key*.
+
+    ``crc32`` instead of ``hash()``, which is salted per process for
+    strings, so the partition of a key is the same in every process.
+    """
+    return zlib.crc32(repr(tuple(key)).encode()) % partitions
+
+
+def _put_page(pages_queue: queue.Queue, page, future: concurrent.futures.Future) -> bool:
+    """Hand *page* to the worker of *future*; return ``False`` when that worker already stopped."""
+    while not future.done():
+        try:
+            pages_queue.put(page, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class UpsertPlan:
+    """Column types and composed SQL of :func:`upsert_multiple_data` for one model and column set.
 
-        table = sql.Identifier(model._meta.db_table)
+    Building a plan resolves the database type of every column and
+    composes the staging DDL and merge statements. Plans are memoised by
+    :func:`get_upsert_plan`, so repeated (small) upserts into the same
+    table only pay for this once per process.
+
+    Parameters
+    ----------
+    model : type[django.db.models.Model]
+        Target Django model.
+    identification_field_names : tuple of str
+        Key columns.
+    update_field_names : tuple of str
+        Updated columns, without the key columns.
+    method : str
+        Import strategy (see :class:`~rgs_django_utils.database.db_types.ImportMethod`).
+    transfer : str
+        Staging transfer (see :class:`~rgs_django_utils.database.db_types.TransferMethod`).
+    skip_unchanged : bool
+        Only update rows with a changed value.
+    merge_returning : bool
+        Merge with ``MERGE ... RETURNING merge_action()`` (Postgres 17+).
+    geometry_format : str, optional
+        Encoding of staged geometries (see
+        :class:`~rgs_django_utils.database.db_types.GeometryFormat`).
+    deduplicate : str, optional
+        Rows kept of duplicate keys in the staging table (see
+        :class:`~rgs_django_utils.database.db_types.DuplicateMode`).
+    merge_method : str, optional
+        How new values are merged into an existing row (see
+        :class:`~rgs_django_utils.database.db_types.RecordMergeMethod`).
+    tuning : tuple of tuple, optional
+        ``(setting, value)`` pairs set with ``SET LOCAL`` after every
+        ``BEGIN`` (see :func:`~rgs_django_utils.database.import_tuning.get_tuning_profile`).
+    """
+
+    _names = itertools.count(1)
+
+    def __init__(
+        self,
+        model: Type[Model],
+        identification_field_names: typing.Tuple[str, ...],
+        update_field_names: typing.Tuple[str, ...],
+        method: str,
+        transfer: str,
+        skip_unchanged: bool,
+        merge_returning: bool,
+        geometry_format: str = GeometryFormat.WKT,
+        deduplicate: str = DuplicateMode.NONE,
+        merge_method: str = RecordMergeMethod.REPLACE,
+        tuning: TuningProfile = None,
+    ):
+        self.model = model
+        self.transfer = transfer
+        self.name = f"rgs_upsert_{next(self._names)}"
+        self.begin = sql.SQL("BEGIN;\n{tuning}").format(tuning=get_tuning_sql(tuning))
+        self.field_names = combined_field_names = list(identification_field_names) + list(update_field_names)
+
+        self.template = _get_mogrify_template(combined_field_names, model, geometry_format)
+        self.table = table = sql.Identifier(model._meta.db_table)
+        self.db_types = db_types = {col: _get_postgres_field_type(col, model) for col in combined_field_names}
+        self.staging_types = staging_types = [
+            _get_staging_type(db_types[col], transfer, geometry_format) for col in combined_field_names
+        ]
+        staging_values = {
+            col: _get_staging_value(col, db_types[col], transfer, geometry_format=geometry_format)
+            for col in combined_field_names
+        }
         cols_with_definition = sql.Composed(
             [
-                sql.SQL("{col} {ftype}").format(
-                    col=sql.Identifier(col), ftype=sql.SQL(_get_postgres_field_type(col, model))
-                )
-                for col in combined_field_names
+                sql.SQL("{col} {ftype}").format(col=sql.Identifier(col), ftype=sql.SQL(staging_type))
+                for col, staging_type in zip(combined_field_names, staging_types)
             ]
         ).join(", ")
-        cols = sql.SQL(",").join((sql.Identifier(col) for col in combined_field_names))
-        index_cols = sql.SQL("\n").join(
+        self.cols = sql.SQL(",").join((sql.Identifier(col) for col in combined_field_names))
+        self.create_staging = sql.SQL("CREATE TEMPORARY TABLE newvals({cols_with_definition});").format(
+            cols_with_definition=cols_with_definition
+        )
+        self.index_cols = sql.SQL("\n").join(
             (
                 sql.SQL("""
                     CREATE INDEX {index_name}
@@ -387,94 +2007,438 @@ def upsert_multiple_data(
             )
         )
         # todo: combined columns?!?
+        set_values = {col: _get_merged_value(col, staging_values[col], merge_method) for col in update_field_names}
         set_cols = sql.SQL(",").join(
-            (sql.SQL("{col}=newvals.{col}").format(col=sql.Identifier(col)) for col in update_field_names)
+            (
+                sql.SQL("{col}={value}").format(col=sql.Identifier(col), value=set_values[col])
+                for col in update_field_names
+            )
         )
         insert_cols = sql.SQL(",").join((sql.Identifier(col) for col in combined_field_names))
-        where_cols = sql.SQL(" AND ").join(
+        self.where_cols = where_cols = sql.SQL(" AND ").join(
             (
-                sql.SQL("target_table.{col}=newvals.{col}").format(col=sql.Identifier(col))
+                sql.SQL("target_table.{col}={value}").format(col=sql.Identifier(col), value=staging_values[col])
                 for col in identification_field_names
             )
         )
 
-        if method == ImportMethod.ONLY_NEW or not len(update_field_names):
-            update_part = sql.SQL("")
+        do_update = method != ImportMethod.ONLY_NEW and len(update_field_names) > 0
+        self.do_insert = do_insert = method != ImportMethod.ONLY_UPDATE
+        newvals_cols = sql.SQL(",").join((staging_values[col] for col in combined_field_names))
+        if skip_unchanged and do_update:
+            changed = _get_changed_condition({col: (set_values[col], db_types[col]) for col in update_field_names})
+        else:
+            changed = None
+        if changed is not None and not do_insert:
+            # without inserts, untouched rows are either skipped as unchanged or had no match
+            matched = sql.SQL("(SELECT count(*) FROM newvals JOIN {table} target_table ON ({where_cols}))").format(
+                table=table, where_cols=where_cols
+            )
+        else:
+            matched = sql.SQL("NULL::bigint")
+
+        if not do_update and not do_insert:
+            merge_part = sql.SQL("SELECT 0 AS inserted, 0 AS updated, NULL AS matched")
+        elif merge_returning:
+            # one set-based statement, counts per action from merge_action()
+            merge_part = sql.SQL("""
+                WITH merged AS (
+                    MERGE INTO {table} target_table
+                    USING newvals ON ({where_cols})
+                    {when_matched}
+                    {when_not_matched}
+                    RETURNING merge_action() AS action
+                )
+                SELECT
+                    count(*) FILTER (WHERE action = 'INSERT') AS inserted,
+                    count(*) FILTER (WHERE action = 'UPDATE') AS updated,
+                    {matched} AS matched
+                FROM merged
+            """).format(
+                table=table,
+                where_cols=where_cols,
+                matched=matched,
+                when_matched=sql.SQL("WHEN MATCHED {changed} THEN UPDATE SET {set_cols}").format(
+                    changed=sql.SQL("AND {changed}").format(changed=changed) if changed is not None else sql.SQL(""),
+                    set_cols=set_cols,
+                )
+                if do_update
+                else sql.SQL(""),
+                when_not_matched=sql.SQL(
+                    "WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({newvals_cols})"
+                ).format(insert_cols=insert_cols, newvals_cols=newvals_cols)
+                if do_insert
+                else sql.SQL(""),
+            )
         else:
+            # update and insert only touch rows with different keys, so they can share one statement
             update_part = sql.SQL("""
                 UPDATE {table} target_table
                 SET {set_cols}
                 FROM newvals
-                WHERE {where_cols};
+                WHERE {where_cols}{changed}
+                RETURNING 1
             """).format(
                 table=table,
                 set_cols=set_cols,
                 where_cols=where_cols,
+                changed=sql.SQL(" AND {changed}").format(changed=changed) if changed is not None else sql.SQL(""),
             )
-        if method == ImportMethod.ONLY_UPDATE:
-            insert_part = sql.SQL("")
-        else:
             insert_part = sql.SQL("""
                 INSERT INTO {table} ({insert_cols})
                 SELECT {newvals_cols}
                 FROM newvals
                 LEFT OUTER JOIN {table} target_table ON ({where_cols})
-                WHERE target_table.{pk_field_target_table} IS NULL;
+                WHERE target_table.{pk_field_target_table} IS NULL
+                RETURNING 1
             """).format(
                 table=table,
                 insert_cols=insert_cols,
                 where_cols=where_cols,
-                pk_field_target_table=sql.Identifier(pk_field),
-                newvals_cols=sql.SQL(",").join(
-                    (
-                        sql.SQL("{}.{}").format(sql.Identifier("newvals"), sql.Identifier(col))
-                        for col in combined_field_names
-                    )
-                ),
+                pk_field_target_table=sql.Identifier(model._meta.pk.name),
+                newvals_cols=newvals_cols,
             )
-
-        if method == ImportMethod.REPLACE:
-            log.warning("REPLACE method is not implemented yet")
-
-        page = 0
-
-        while True:
-            data = ",".join(
-                [cursor.mogrify(template, item) for item in total_data[page * page_size : (page + 1) * page_size]]
+            merge_part = sql.SQL("""
+                WITH upd AS ({update_part}), ins AS ({insert_part})
+                SELECT (SELECT count(*) FROM ins) AS inserted, (SELECT count(*) FROM upd) AS updated, {matched} AS matched
+            """).format(
+                matched=matched,
+                update_part=update_part if do_update else sql.SQL("SELECT 1 WHERE false"),
+                insert_part=insert_part if do_insert else sql.SQL("SELECT 1 WHERE false"),
             )
+        self.merge_part = merge_part
+
+        # a freshly filled staging table is append-only, so the ctid order is the input order
+        self.deduplicate = deduplicate != DuplicateMode.NONE
+        self.drop_duplicates = sql.SQL("""
+            WITH dropped AS (
+                DELETE FROM newvals WHERE ctid IN (
+                    SELECT ctid FROM (
+                        SELECT ctid, row_number() OVER (PARTITION BY {key_cols} ORDER BY ctid {order}) AS position
+                        FROM newvals
+                    ) numbered
+                    WHERE position > 1
+                )
+                RETURNING 1
+            )
+            SELECT count(*) AS duplicates FROM dropped;
+        """).format(
+            key_cols=sql.SQL(",").join((sql.Identifier(col) for col in identification_field_names)),
+            order=sql.SQL("DESC" if deduplicate == DuplicateMode.KEEP_LAST else "ASC"),
+        )
 
-            page += 1
-            if not data:
-                break
-
-            sql_data = sql.SQL(data)
-
-            sql_query = sql.SQL("""
-                BEGIN;
-                --SET LOCAL tapp.skip_recalc_flagging = true;
+        # table will be unlocked after commit
+        self.lock_table = sql.SQL("LOCK TABLE {table} IN EXCLUSIVE MODE;").format(table=table)
 
-                CREATE TEMPORARY TABLE newvals({cols_with_definition});
+        # keys of all staged pages, for ImportMethod.REPLACE to delete the absent rows after the last page
+        keys_with_definition = sql.Composed(
+            [
+                sql.SQL("{col} {ftype}").format(col=sql.Identifier(col), ftype=sql.SQL(staging_type))
+                for col, staging_type in zip(combined_field_names, staging_types)
+                if col in identification_field_names
+            ]
+        ).join(", ")
+        key_cols = sql.SQL(",").join((sql.Identifier(col) for col in identification_field_names))
+        self.create_import_keys = sql.SQL("CREATE TEMPORARY TABLE import_keys({keys_with_definition});").format(
+            keys_with_definition=keys_with_definition
+        )
+        self.key_field_names = list(identification_field_names)
+        self.keep_row_keys = sql.SQL("INSERT INTO import_keys ({key_cols}) VALUES ({placeholders});").format(
+            key_cols=key_cols, placeholders=sql.SQL(",").join(sql.Placeholder() * len(identification_field_names))
+        )
+        if method == ImportMethod.REPLACE:
+            self.keep_keys = sql.SQL("INSERT INTO import_keys ({key_cols}) SELECT {key_cols} FROM newvals;").format(
+                key_cols=key_cols
+            )
+        else:
+            self.keep_keys = sql.SQL("")
+        self.index_import_keys = sql.SQL("CREATE INDEX ON import_keys ({key_cols}); ANALYZE import_keys;").format(
+            key_cols=key_cols
+        )
+        self.import_keys_condition = sql.SQL(" AND ").join(
+            (
+                sql.SQL("target_table.{col}={value}").format(
+                    col=sql.Identifier(col),
+                    value=_get_staging_value(col, db_types[col], transfer, "import_keys", geometry_format),
+                )
+                for col in identification_field_names
+            )
+        )
 
-                INSERT INTO newvals({cols}) VALUES {sql_data};
+        # the statement refers to newvals, so it can only be prepared while the table exists
+        self.prepare_statement = sql.SQL("""
+            BEGIN;
+            {create_staging}
+            PREPARE {name} AS {merge_part};
+            DROP TABLE newvals;
+            COMMIT;
+        """).format(create_staging=self.create_staging, name=sql.Identifier(self.name), merge_part=merge_part)
+
+        self._copy_types = NotAvailable
+        self._rendered = {}
+
+    def _compose(self, name: str, merge: sql.Composable) -> sql.Composable:
+        """Compose the SQL fragment *name* of the staging modes, merging with *merge*."""
+        if name == "cols":
+            return self.cols
+        if name in ("per_page_before", "single_merge_before"):
+            return sql.SQL("""
+                {begin}
+
+                {create_staging}
+            """).format(begin=self.begin, create_staging=self.create_staging)
+        if name == "per_page_after":
+            return sql.SQL("""
                 {index_cols};
-
-                -- table will be unlocked after commit
-                LOCK TABLE {table} IN EXCLUSIVE MODE;
-                {update_part}
-                {insert_part}
+                {merge}
+                {keep_keys}
 
                 DROP TABLE newvals;
-                --SET LOCAL tapp.skip_recalc_flagging = false;
                 COMMIT;
-            """).format(
-                table=table,
-                cols_with_definition=cols_with_definition,
-                cols=cols,
-                sql_data=sql_data,
-                index_cols=index_cols,
-                update_part=update_part,
-                insert_part=insert_part,
+            """).format(index_cols=self.index_cols, merge=merge, keep_keys=self.keep_keys)
+        if name == "reuse_create":
+            return sql.SQL("{create_staging}\n{index_cols};").format(
+                create_staging=self.create_staging, index_cols=self.index_cols
             )
+        if name == "reuse_before":
+            return sql.SQL("""
+                {begin}
 
+                TRUNCATE newvals;
+            """).format(begin=self.begin)
+        if name == "reuse_after":
+            return sql.SQL("""
+                {merge}
+                {keep_keys}
+
+                COMMIT;
+            """).format(merge=merge, keep_keys=self.keep_keys)
+        if name == "per_page_before_isolate":
+            return sql.SQL("{begin}\n{create_staging}\n{index_cols};").format(
+                begin=self.begin, create_staging=self.create_staging, index_cols=self.index_cols
+            )
+        if name == "reuse_before_isolate":
+            return self.begin
+        if name == "isolate_before":
+            return sql.SQL("SAVEPOINT upsert_rows;\nTRUNCATE newvals;")
+        if name == "isolate_after":
+            return sql.SQL("""
+                {merge}
+                {keep_keys}
+                RELEASE SAVEPOINT upsert_rows;
+            """).format(merge=merge, keep_keys=self.keep_keys)
+        if name == "per_page_end":
+            return sql.SQL("DROP TABLE newvals;\nCOMMIT;")
+        if name == "reuse_end":
+            return sql.SQL("COMMIT;")
+        if name == "single_merge_merge":
+            return sql.SQL("""
+                {index_cols};
+                {merge}
+            """).format(index_cols=self.index_cols, merge=merge)
+        raise ValueError(f"unknown upsert fragment {name}")
+
+    def _merge(self, prepared: bool, partition: typing.Union[int, None]) -> sql.Composable:
+        """Compose the lock and merge statements of one page.
+
+        Without *partition* the whole table is locked. A partition of a
+        parallel upsert only takes the transaction-level advisory lock of
+        its own partition, so the workers don't wait for each other; the
+        row locks they hold still make a concurrent serial upsert wait for
+        them.
+        """
+        if partition is None:
+            lock = self.lock_table
+        else:
+            # a DO block, because a SELECT would add a result set in front of the merge counts
+            lock = sql.SQL(
+                "DO $$ BEGIN PERFORM pg_advisory_xact_lock(hashtext({table}), {partition}); END $$;"
+            ).format(table=sql.Literal(self.model._meta.db_table), partition=sql.Literal(partition))
+        return sql.SQL("""
+            {drop_duplicates}
+            ANALYZE newvals;
+            {lock}
+            {merge};
+        """).format(
+            drop_duplicates=self.drop_duplicates if self.deduplicate else sql.SQL(""),
+            lock=lock,
+            merge=sql.SQL("EXECUTE {name}").format(name=sql.Identifier(self.name)) if prepared else self.merge_part,
+        )
+
+    def get_sql(self, cursor, name: str, prepared: bool = False, partition: typing.Union[int, None] = None) -> sql.SQL:
+        """Return the SQL fragment *name*, rendered once per connection encoding.
+
+        Rendering the nested ``sql.Composed`` objects costs more client
+        time than the rest of a small upsert, so the rendered text is kept.
+        *partition* is the partition of a parallel upsert, see
+        :func:`_upsert_parallel`.
+        """
+        key = (name, prepared, partition, cursor.connection.info.encoding)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            composed = self._compose(name, self._merge(prepared, partition))
+            rendered = self._rendered[key] = sql.SQL(composed.as_string(cursor.connection))
+        return rendered
+
+    def get_copy_types(self, cursor) -> typing.Union[typing.List[int], None]:
+        """Return the column OIDs for a binary COPY, or ``None`` for a text COPY or the ``VALUES`` transfer."""
+        if self.transfer != TransferMethod.COPY:
+            return None
+        if self._copy_types is NotAvailable:
+            self._copy_types = _get_copy_types(cursor, self.staging_types)
+            log.debug("upsert with %s copy", "binary" if self._copy_types is not None else "text")
+        return self._copy_types
+
+    def prepare(self, cursor):
+        """Prepare the merge statement on the connection of *cursor*.
+
+        The statement is prepared once per connection (prepared statements
+        live as long as the database session). This doesn't work behind a
+        connection pooler in transaction mode, or after ``DISCARD ALL``.
+        """
+        prepared = _prepared_statements.setdefault(cursor.connection, set())
+        if self.name not in prepared:
+            cursor.execute(self.prepare_statement)
+            prepared.add(self.name)
+
+    def __repr__(self) -> str:
+        return f"UpsertPlan({self.model._meta.db_table}, {self.name})"
+
+
+# names of the prepared merge statements per psycopg connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
+
+@cache
+def get_upsert_plan(
+    model: Type[Model],
+    identification_field_names: typing.Tuple[str, ...],
+    update_field_names: typing.Tuple[str, ...],
+    method: str,
+    transfer: str,
+    skip_unchanged: bool = False,
+    merge_returning: bool = False,
+    geometry_format: str = GeometryFormat.WKT,
+    deduplicate: str = DuplicateMode.NONE,
+    merge_method: str = RecordMergeMethod.REPLACE,
+    tuning: TuningProfile = None,
+) -> UpsertPlan:
+    """Return the memoised :class:`UpsertPlan` for these arguments.
+
+    Plans are cached for the lifetime of the process; call
+    ``get_upsert_plan.cache_clear()`` after changing a table at runtime.
+    """
+    return UpsertPlan(
+        model,
+        identification_field_names,
+        update_field_names,
+        method,
+        transfer,
+        skip_unchanged,
+        merge_returning,
+        geometry_format,
+        deduplicate,
+        merge_method,
+        tuning,
+    )
+
+
+def _supports_merge_returning(cursor) -> bool:
+    """Return ``True`` when the server supports ``MERGE ... RETURNING merge_action()`` (Postgres 17+)."""
+    return cursor.connection.info.server_version >= 170000
+
+
+def _fetch_merge_counts(cursor) -> typing.Tuple[int, int, typing.Union[int, None]]:
+    """Return ``(inserted, updated, matched)`` from the merge statement of a multi-statement execute.
+
+    ``matched`` is only counted when it can't be derived from the other
+    counts, otherwise it is ``None``.
+
+    The merge statement is the only statement in the batch that returns
+    rows, so the result sets of the statements before it are skipped.
+    """
+    while cursor.description is None:
+        if not cursor.nextset():
+            raise ValueError("no merge counts returned")
+    inserted, updated, matched = cursor.fetchone()
+    return inserted, updated, matched
+
+
+def _fetch_duplicate_count(cursor) -> int:
+    """Return the number of rows dropped by ``UpsertPlan.drop_duplicates`` and move on to the next result set."""
+    while cursor.description is None:
+        if not cursor.nextset():
+            raise ValueError("no duplicate count returned")
+    (duplicates,) = cursor.fetchone()
+    cursor.nextset()
+    return duplicates
+
+
+def _rollback_open_transaction(cursor):
+    """Roll back the transaction a failed page left open, so the connection stays usable."""
+    if cursor.connection.info.transaction_status != pq.TransactionStatus.IDLE:
+        cursor.execute("ROLLBACK;")
+
+
+def _stage_page(
+    cursor,
+    page: typing.List[typing.List],
+    transfer: str,
+    template: str,
+    cols: sql.Composable,
+    copy_types: typing.Union[typing.List[int], None],
+    before: sql.Composable = None,
+    after: sql.Composable = None,
+    timer: typing.Union[_PhaseTimer, None] = None,
+) -> int:
+    """Send *before*, the rows of *page* and *after* to the server.
+
+    With ``TransferMethod.VALUES`` the rows are mogrified into one
+    ``INSERT INTO newvals`` statement and sent together with *before* and
+    *after* in a single round trip. The COPY transfers stream the rows with
+    :func:`_copy_rows` in between two separate statements.
+
+    The phases are recorded with *timer*: ``setup`` (*before*), ``encode``
+    (mogrify), ``transfer`` (the rows) and ``merge`` (*after*). The single
+    round trip of ``VALUES`` counts as ``merge`` when it includes *after*.
+
+    Returns the size of the rows as sent (the ``VALUES`` text or the COPY
+    data), in bytes or, for text, characters.
+    """
+    timer = timer or _PhaseTimer(UpsertStats())
+    rows = len(page)
+
+    if transfer == TransferMethod.VALUES:
+        start = time.perf_counter()
+        values = ",".join([cursor.mogrify(template, item) for item in page])
+        timer.record("encode", start, rows)
+        sql_query = sql.SQL("{before}\nINSERT INTO newvals({cols}) VALUES {sql_data};\n{after}").format(
+            before=before or sql.SQL(""),
+            cols=cols,
+            sql_data=sql.SQL(values),
+            after=after or sql.SQL(""),
+        )
+        if log.isEnabledFor(logging.DEBUG):
             log.debug(sql_query.as_string(cursor.connection))
-            cursor.execute(sql_query)
+        start = time.perf_counter()
+        cursor.execute(sql_query)
+        timer.record("transfer" if after is None else "merge", start, rows)
+        return len(values)
+
+    if before is not None:
+        start = time.perf_counter()
+        cursor.execute(before)
+        timer.record("setup", start, rows)
+    start = time.perf_counter()
+    if transfer == TransferMethod.COPY_CSV:
+        sent = _copy_frame(cursor, cols, page)
+    else:
+        sent = _copy_rows(cursor, cols, page, copy_types)
+    timer.record("transfer", start, rows)
+    if after is not None:
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(after.as_string(cursor.connection))
+        start = time.perf_counter()
+        cursor.execute(after)
+        timer.record("merge", start, rows)
+    return sent
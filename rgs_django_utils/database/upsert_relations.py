@@ -0,0 +1,186 @@
+import logging
+import typing
+from typing import Type
+
+from django.db import connection
+from django.db.models import ManyToManyField, Model
+from psycopg import sql
+
+from rgs_django_utils.database.db_types import ImportMethod
+from rgs_django_utils.database.import_tuning import TuningProfile, get_tuning_sql
+from rgs_django_utils.database.upsert_multiple_data import (
+    UpsertStats,
+    _copy_rows,
+    _get_copy_types,
+    _get_postgres_field_type,
+    _rollback_open_transaction,
+)
+
+log = logging.getLogger(__name__)
+
+
+def upsert_relations(
+    model: Type[Model],
+    field_name: str,
+    pairs: typing.Iterable[typing.Tuple[typing.Any, typing.Any]],
+    method: str = ImportMethod.OVERWRITE,
+    from_ids: typing.Iterable[typing.Any] = None,
+    tuning: TuningProfile = None,
+) -> UpsertStats:
+    """Synchronise the links of the many-to-many field *field_name* of *model* set-based.
+
+    The ``(from_id, to_id)`` *pairs* are streamed into a staging table
+    with a binary ``COPY`` and merged into the through table with one
+    ``INSERT`` of the missing links and, with ``ImportMethod.REPLACE``,
+    one ``DELETE`` of the links that are no longer in the input — instead
+    of the per-object queries of the ORM's ``.add()`` / ``.set()``.
+
+    Parameters
+    ----------
+    model : type[django.db.models.Model]
+        Model that declares the ``ManyToManyField``.
+    field_name : str
+        Name of the ``ManyToManyField`` on *model*.
+    pairs : iterable of tuple
+        ``(from_id, to_id)`` pairs: the primary key of a *model* row and
+        of the related row. Duplicate pairs are merged once.
+    method : str, optional
+        Import strategy (see :class:`~rgs_django_utils.database.db_types.ImportMethod`).
+        ``ONLY_NEW`` and ``OVERWRITE`` add the missing links,
+        ``REPLACE`` also removes the other links of the *model* rows in
+        the input, like ``.set()`` for every row. Default is
+        ``ImportMethod.OVERWRITE``.
+    from_ids : iterable, optional
+        Only with ``ImportMethod.REPLACE``: the *model* rows whose links
+        are replaced. Rows without pairs lose all their links. Default is
+        the rows in *pairs*.
+    tuning : str or dict, optional
+        Import tuning profile applied with ``SET LOCAL`` in the
+        transaction (see :mod:`~rgs_django_utils.database.import_tuning`).
+        Default is no tuning.
+
+    Returns
+    -------
+    UpsertStats
+        ``inserted`` new links, ``unchanged`` links that already existed,
+        ``duplicates`` repeated input pairs and ``deleted`` links.
+
+    Raises
+    ------
+    ValueError
+        If *field_name* is not a many-to-many field of *model*, or for
+        ``ImportMethod.ONLY_UPDATE``.
+
+    Notes
+    -----
+    Everything runs in one transaction that locks the through table. A
+    custom through model can only be synchronised when its other columns
+    have a database default.
+
+    Examples
+    --------
+    >>> upsert_relations(                                    # doctest: +SKIP
+    ...     Project, "members", [(project.pk, user.pk) for user in users], method=ImportMethod.REPLACE
+    ... )
+    UpsertStats(inserted=12, updated=0, unchanged=3, rejected=0, failed=0, duplicates=0, deleted=4, pages=1)
+    """
+    field = model._meta.get_field(field_name)
+    if not isinstance(field, ManyToManyField):
+        raise ValueError(f"{model._meta.label}.{field_name} is not a many-to-many field")
+    if method == ImportMethod.ONLY_UPDATE:
+        raise ValueError("links have no values to update, ImportMethod.ONLY_UPDATE is not supported")
+    if from_ids is not None and method != ImportMethod.REPLACE:
+        raise ValueError("from_ids only applies to ImportMethod.REPLACE")
+
+    statements = _RelationUpsert(field)
+    tuning_sql = get_tuning_sql(tuning)
+    stats = UpsertStats()
+
+    with connection.cursor() as cursor:
+        copy_types = _get_copy_types(cursor, statements.staging_types)
+        try:
+            cursor.execute(sql.SQL("BEGIN;\n{tuning}").format(tuning=tuning_sql))
+            cursor.execute(statements.create_staging)
+            _copy_rows(cursor, statements.cols, pairs, copy_types)
+            cursor.execute(statements.lock)
+            cursor.execute(statements.insert_links)
+            staged, distinct, inserted = cursor.fetchone()
+            if method == ImportMethod.REPLACE:
+                if from_ids is None:
+                    cursor.execute(statements.delete_links)
+                else:
+                    cursor.execute(statements.delete_links_of, {"from_ids": list(from_ids)})
+                stats.deleted = cursor.fetchone()[0]
+            cursor.execute("COMMIT;")
+        except Exception:
+            _rollback_open_transaction(cursor)
+            raise
+
+    stats.add_page(distinct, inserted, 0)
+    stats.duplicates = staged - distinct
+    log.info("upsert_relations %s.%s: %s", model._meta.label, field_name, stats)
+    return stats
+
+
+class _RelationUpsert:
+    """Composed statements of :func:`upsert_relations` for the many-to-many *field*."""
+
+    def __init__(self, field: ManyToManyField):
+        through = field.remote_field.through
+        from_field = field.m2m_field_name()
+        to_field = field.m2m_reverse_field_name()
+        from_col = sql.Identifier(field.m2m_column_name())
+        to_col = sql.Identifier(field.m2m_reverse_name())
+        table = sql.Identifier(through._meta.db_table)
+
+        self.staging_types = [_get_postgres_field_type(name, through) for name in (from_field, to_field)]
+        self.cols = sql.SQL("{from_col}, {to_col}").format(from_col=from_col, to_col=to_col)
+        self.create_staging = sql.SQL(
+            "CREATE TEMPORARY TABLE newvals ({from_col} {from_type}, {to_col} {to_type}) ON COMMIT DROP;"
+        ).format(
+            from_col=from_col,
+            from_type=sql.SQL(self.staging_types[0]),
+            to_col=to_col,
+            to_type=sql.SQL(self.staging_types[1]),
+        )
+        # table will be unlocked after commit
+        self.lock = sql.SQL("ANALYZE newvals; LOCK TABLE {table} IN EXCLUSIVE MODE;").format(table=table)
+        self.insert_links = sql.SQL("""
+            WITH pairs AS (
+                SELECT DISTINCT {from_col}, {to_col} FROM newvals
+            ), ins AS (
+                INSERT INTO {table} ({from_col}, {to_col})
+                SELECT pairs.{from_col}, pairs.{to_col}
+                FROM pairs
+                WHERE NOT EXISTS (
+                    SELECT FROM {table} link
+                    WHERE link.{from_col} = pairs.{from_col} AND link.{to_col} = pairs.{to_col}
+                )
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM newvals), (SELECT count(*) FROM pairs), (SELECT count(*) FROM ins);
+        """).format(table=table, from_col=from_col, to_col=to_col)
+        delete_links = sql.SQL("""
+            WITH del AS (
+                DELETE FROM {table} link
+                WHERE {scope}
+                AND NOT EXISTS (
+                    SELECT FROM newvals
+                    WHERE newvals.{from_col} = link.{from_col} AND newvals.{to_col} = link.{to_col}
+                )
+                RETURNING 1
+            )
+            SELECT count(*) FROM del;
+        """)
+        self.delete_links = delete_links.format(
+            table=table,
+            from_col=from_col,
+            to_col=to_col,
+            scope=sql.SQL("link.{from_col} IN (SELECT {from_col} FROM newvals)").format(from_col=from_col),
+        )
+        self.delete_links_of = delete_links.format(
+            table=table,
+            from_col=from_col,
+            to_col=to_col,
+            scope=sql.SQL("link.{from_col} = ANY(%(from_ids)s)").format(from_col=from_col),
+        )
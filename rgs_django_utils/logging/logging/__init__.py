@@ -1,5 +1,11 @@
 from .context_filter import LogContextFilter
-from .db_handler import PostgresHandler
+from .db_handler import (
+    OverflowPolicy,
+    PostgresHandler,
+    QueuedPostgresHandler,
+    finish_task_logs,
+    flush_log_handlers,
+)
 from .log_context import (
     SubTimer,
     clear_extra_info,
@@ -9,7 +15,9 @@ from .log_context import (
     get_extra_info,
     get_run,
     get_task_info,
+    get_task_levels,
     log_counter,
+    record_level,
     set_extra_info,
     set_run,
     set_task,
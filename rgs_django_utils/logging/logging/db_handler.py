@@ -1,12 +1,48 @@
+import datetime
 import json
 import logging
+import os
+import queue
+import threading
+import time
+import typing
+import weakref
 
 from django.db import OperationalError, connections, transaction
 
-from .log_context import get_run
+from .log_context import get_run, record_level
 
 log = logging.getLogger(__name__)
 
+LOG_COLUMNS = (
+    "run_id",
+    "task_name",
+    "level",
+    "name",
+    "is_data_log",
+    "code",
+    "dt",
+    "message",
+    "filename",
+    "line_nr",
+    "extra",
+)
+
+# open handlers, flushed by finish_task() and finish_run()
+_handlers = weakref.WeakSet()
+
+
+def flush_log_handlers():
+    """Write the pending records (queued rows, aggregated data logs) of every :class:`PostgresHandler`."""
+    for handler in list(_handlers):
+        handler.flush()
+
+
+def finish_task_logs(run, task_name: str):
+    """Write the aggregated data logs of *task_name* of *run* of every :class:`PostgresHandler`."""
+    for handler in list(_handlers):
+        handler.flush_task(run, task_name)
+
 
 class PostgresHandler(logging.Handler):
     """Logging handler that writes records into a Postgres ``log`` table.
@@ -16,13 +52,31 @@ class PostgresHandler(logging.Handler):
     Must be paired with :class:`~rgs_django_utils.logging.logging.LogContextFilter`
     so every record carries the run/task/extra-info attributes.
 
+    Parameters
+    ----------
+    aggregate_data : bool, optional
+        Collapse data log records with the same run, task, logger, level
+        and ``code`` into one row, written when the task finishes (see
+        Notes). Default is ``False``.
+    samples : int, optional
+        Number of messages and ``extra`` payloads kept per aggregated
+        row. Default is ``3``.
+
     Notes
     -----
     * Records under a logger whose name starts with ``"data."`` are
-      marked ``is_data_log = True`` — :func:`finish_task` uses this to
-      separate program-level from data-level severity.
+      marked ``is_data_log = True``. The highest program and data level
+      per run and task is kept in memory for :func:`finish_task`.
+    * With *aggregate_data* the data log records are only counted while
+      the task runs. :func:`finish_task` (and ``flush()`` / ``close()``)
+      write one row per group: the first record, its message suffixed
+      with ``(<count>x)`` and an ``extra`` of ``{"count", "last_dt",
+      "sample_messages", "sample_extra"}``. A group of one record is
+      written as is.
     * A run is flagged ``success = False`` as soon as any ``ERROR``-level
-      or higher record is written against it.
+      or higher record is written against it: in memory, and in the
+      database with one ``UPDATE`` of that column (see
+      :meth:`mark_run_failed`).
     * Errors during the emit path are printed rather than raised so the
       logging layer cannot crash the caller.
 
@@ -62,55 +116,136 @@ class PostgresHandler(logging.Handler):
         finish_run()
     """
 
-    def __init__(self):
+    def __init__(self, aggregate_data: bool = False, samples: int = 3):
         super().__init__()
         self.run = None
         self.max_level = 0
+        self.aggregate_data = aggregate_data
+        self.samples = samples
+        # (run_id, task_name, name, level, code) -> _DataLogGroup
+        self._groups = {}
 
         self.last_log_message = None
+        _handlers.add(self)
 
     def emit(self, record: logging.LogRecord):
         """Insert *record* into the ``log`` table; flip the run to unsuccessful on ``ERROR``+."""
-        run = getattr(record, "run", None)
+        try:
+            row = self.get_row(record)
+            if not self.aggregate(row, record):
+                self.write_rows([row])
+            self.track_level(record, row)
+        except Exception as e:
+            print("Fout bij het loggen naar de database", e)
+            self.handleError(record)
+
+    def track_level(self, record: logging.LogRecord, row: tuple):
+        """Record the level of the written (or queued) *record* for :func:`~rgs_django_utils.logging.logging.finish_task`."""
+        record_level(getattr(record, "run", None), getattr(record, "task_name", ""), row[2], row[4])
+
+    def aggregate(self, row: tuple, record: logging.LogRecord) -> bool:
+        """Count the data log *row* in its group; return ``False`` when it is not aggregated."""
+        if not self.aggregate_data or not row[4]:
+            return False
+        run_id, task_name, level, name, _, code = row[:6]
+        key = (run_id, task_name, name, level, code)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _DataLogGroup(row)
+        group.add(row, getattr(record, "extra_info", {}), self.samples)
+        return True
+
+    def flush_task(self, run, task_name: str):
+        """Write the aggregated data logs of *task_name* of *run*."""
+        run_id = run.id if run is not None else None
+        with self.lock:
+            keys = [key for key in self._groups if key[:2] == (run_id, task_name[:30])]
+            rows = [self._groups.pop(key).get_row() for key in keys]
+        if rows:
+            self.send_rows(rows)
 
+    def flush(self):
+        """Write all aggregated data logs."""
+        with self.lock:
+            rows = [group.get_row() for group in self._groups.values()]
+            self._groups.clear()
+        if rows:
+            self.send_rows(rows)
+
+    def send_rows(self, rows: typing.List[tuple]):
+        """Write *rows*; the queued handler puts them on its queue instead."""
         try:
-            if run != self.run:
-                self.max_level = 0
-                self.run = run
+            self.write_rows(rows)
+        except Exception as e:
+            print(f"Fout bij het loggen van {len(rows)} regels naar de database", e)
 
-            run_id = self.run.id if self.run else None
-            task_name = getattr(record, "task_name", "")[:30]
-            name = record.name[:30]
-            level = record.levelno
-            is_data_log = name.startswith("data.")
-            code = getattr(record, "code", None)
-            dt = record.created
-            message = self.format(record)
+    def get_row(self, record: logging.LogRecord) -> tuple:
+        """Return the values of *record* for the :data:`LOG_COLUMNS` of the ``log`` table.
+
+        Formats the message and flips the run to unsuccessful on
+        ``ERROR``+, so it runs in the thread that logged the record.
+        """
+        run = getattr(record, "run", None)
+        if run != self.run:
+            self.max_level = 0
+            self.run = run
 
-            self.last_log_message = message
+        run_id = self.run.id if self.run else None
+        task_name = getattr(record, "task_name", "")
+        name = record.name[:30]
+        level = record.levelno
+        is_data_log = name.startswith("data.")
+        task_name = task_name[:30]
+        code = getattr(record, "code", None)
+        dt = datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc)
+        message = self.format(record)
 
-            filename = record.filename[:30]
-            line_nr = record.lineno
+        self.last_log_message = message
 
-            # Voorbeeld voor het omgaan met aangepaste eigenschappen
-            # Je zou dit dynamisch kunnen maken afhankelijk van de gebruikssituatie
-            extra_info = json.dumps(getattr(record, "extra_info", {}))
+        filename = record.filename[:30]
+        line_nr = record.lineno
 
-            if run is not None and level >= logging.ERROR and not run.success:
-                run.success = False
-                run.save()
+        # Voorbeeld voor het omgaan met aangepaste eigenschappen
+        # Je zou dit dynamisch kunnen maken afhankelijk van de gebruikssituatie
+        extra_info = json.dumps(getattr(record, "extra_info", {}))
 
-            with connections["logging"].cursor() as cursor:
+        if run is not None and level >= logging.ERROR and run.success is not False:
+            run.success = False
+            self.mark_run_failed(run)
+
+        return run_id, task_name, level, name, is_data_log, code, dt, message, filename, line_nr, extra_info
+
+    def mark_run_failed(self, run):
+        """Set ``success = false`` on the row of *run*, with one targeted ``UPDATE``.
+
+        Called once per run, on the first ``ERROR``+ record; the other
+        columns of the run are left to ``run.finish()``.
+        """
+        quote_name = connections["logging"].ops.quote_name
+        with connections["logging"].cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {quote_name(run._meta.db_table)} SET success = false "
+                f"WHERE {quote_name(run._meta.pk.column)} = %s AND success IS DISTINCT FROM false",
+                [run.pk],
+            )
+
+    def write_rows(self, rows: typing.List[tuple]):
+        """Insert *rows* (see :meth:`get_row`) into the ``log`` table."""
+        with connections["logging"].cursor() as cursor:
+            if len(rows) == 1:
                 cursor.execute(
-                    "INSERT INTO log (run_id, task_name, level, name, is_data_log, code, dt, message, filename, line_nr, extra) VALUES (%s, %s, %s, %s, %s, %s, to_timestamp(%s), %s, %s, %s, %s)",
-                    (run_id, task_name, level, name, is_data_log, code, dt, message, filename, line_nr, extra_info),
+                    f"INSERT INTO log ({', '.join(LOG_COLUMNS)}) VALUES ({', '.join(['%s'] * len(LOG_COLUMNS))})",
+                    rows[0],
                 )
-        except Exception as e:
-            print("Fout bij het loggen naar de database", e)
-            self.handleError(record)
+                return
+            with cursor.copy(f"COPY log ({', '.join(LOG_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
 
     def close(self):
-        """Finalise the active run and flush the ``logging`` DB connection."""
+        """Write the aggregated data logs, finalise the active run and flush the ``logging`` DB connection."""
+        self.flush()
+
         run = get_run()
 
         if run is not None:
@@ -122,4 +257,249 @@ class PostgresHandler(logging.Handler):
         except OperationalError as e:
             print("Fout bij het afsluiten van de database connectie", e)
 
+        _handlers.discard(self)
         super().close()
+
+
+class _DataLogGroup:
+    """Data log records with the same run, task, logger, level and code, aggregated to one row."""
+
+    def __init__(self, row: tuple):
+        self.row = row
+        self.count = 0
+        self.last_dt = None
+        self.messages = []
+        self.extras = []
+
+    def add(self, row: tuple, extra_info: dict, samples: int):
+        self.count += 1
+        self.last_dt = row[6]
+        if len(self.messages) < samples:
+            self.messages.append(row[7])
+            self.extras.append(extra_info)
+
+    def get_row(self) -> tuple:
+        """Return the summary row: the first record, counted, with samples in ``extra``."""
+        if self.count == 1:
+            return self.row
+        extra = {
+            "count": self.count,
+            "last_dt": self.last_dt.isoformat(),
+            "sample_messages": self.messages,
+            "sample_extra": self.extras,
+        }
+        message = f"{self.row[7]} ({self.count}x)"
+        return self.row[:7] + (message,) + self.row[8:10] + (json.dumps(extra),)
+
+
+class OverflowPolicy:
+    """What :class:`QueuedPostgresHandler` does with a record when its queue is full.
+
+    Attributes
+    ----------
+    BLOCK : str
+        Wait until the writer thread made room; no record is lost, but a
+        slow logging database slows down the caller.
+    DROP : str
+        Drop the record and count it in ``QueuedPostgresHandler.dropped``;
+        logging never slows down the caller.
+    """
+
+    BLOCK = "block"
+    DROP = "drop"
+
+
+# markers in the queue of QueuedPostgresHandler
+_FLUSH = object()
+_STOP = object()
+
+
+class QueuedPostgresHandler(PostgresHandler):
+    """:class:`PostgresHandler` that returns from ``emit`` at once and writes in batches.
+
+    ``emit`` formats the record and puts its row on a queue; a background
+    thread with its own ``logging`` connection drains the queue and writes
+    up to *batch_size* rows with one ``COPY``, at the latest
+    *flush_interval* seconds after the first row of a batch arrived.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        Maximum number of rows per write. Default is ``500``.
+    flush_interval : float, optional
+        Maximum number of seconds a row waits for its batch. Default is
+        ``1.0``.
+    queue_size : int, optional
+        Maximum number of rows waiting to be written. Default is
+        ``10000``.
+    overflow : str, optional
+        What to do when the queue is full (see :class:`OverflowPolicy`).
+        Default is ``OverflowPolicy.BLOCK``.
+
+    Notes
+    -----
+    * :meth:`flush` blocks until every record emitted before the call is
+      written. :meth:`close`, :func:`~rgs_django_utils.logging.logging.finish_run`
+      and ``logging.shutdown()`` at interpreter exit flush the handler.
+    * The thread starts with the first record, and again in a forked
+      child process.
+    * Records logged by the writer thread itself (e.g. the SQL debug
+      records of ``django.db.backends``) are dropped in :meth:`handle`,
+      before the handler lock is taken. With ``OverflowPolicy.BLOCK`` a
+      producer waits for room in a full queue without holding the lock,
+      so other threads can still log meanwhile.
+
+    Examples
+    --------
+    In ``LOGGING["handlers"]``::
+
+        "postgres": {
+            "level": "DEBUG",
+            "class": "rgs_django_utils.logging.logging.QueuedPostgresHandler",
+            "filters": ["context"],
+            "batch_size": 1000,
+            "overflow": "drop",
+        },
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        queue_size: int = 10000,
+        overflow: str = OverflowPolicy.BLOCK,
+        aggregate_data: bool = False,
+        samples: int = 3,
+    ):
+        if overflow not in (OverflowPolicy.BLOCK, OverflowPolicy.DROP):
+            raise ValueError(f"unknown overflow policy {overflow}")
+        super().__init__(aggregate_data, samples)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def handle(self, record: logging.LogRecord):
+        """Filter and queue *record*; waiting for room in a full queue happens outside the handler lock."""
+        if threading.current_thread() is self._thread:
+            return False
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        if rv:
+            with self.lock:
+                row = self._enqueue(record)
+            if row is not None:
+                self._queue.put(row)
+                self.track_level(record, row)
+        return rv
+
+    def emit(self, record: logging.LogRecord):
+        """Put the row of *record* on the queue of the writer thread."""
+        if threading.current_thread() is self._thread:
+            return
+        row = self._enqueue(record)
+        if row is not None:
+            self._queue.put(row)
+            self.track_level(record, row)
+
+    def _enqueue(self, record: logging.LogRecord) -> typing.Union[tuple, None]:
+        """Queue the row of *record* without waiting; return the row if it has to wait for room (``BLOCK``)."""
+        try:
+            row = self.get_row(record)
+            if not self.aggregate(row, record):
+                self._start()
+                self._queue.put_nowait(row)
+            self.track_level(record, row)
+        except queue.Full:
+            if self.overflow == OverflowPolicy.BLOCK:
+                return row
+            self.dropped += 1
+        except Exception as e:
+            print("Fout bij het loggen naar de database", e)
+            self.handleError(record)
+        return None
+
+    def flush(self):
+        """Block until the rows of all records emitted so far (and the aggregated data logs) are written."""
+        super().flush()
+        if self._is_running():
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def send_rows(self, rows: typing.List[tuple]):
+        """Queue *rows*, waiting for room regardless of the overflow policy."""
+        self._start()
+        for row in rows:
+            self._queue.put(row)
+
+    def close(self):
+        """Finalise the active run, write the pending rows and stop the writer thread."""
+        super().close()
+        if self._is_running():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._thread = None
+        if self.dropped:
+            print(f"{self.dropped} logregels niet naar de database geschreven, de wachtrij was vol")
+
+    def _is_running(self) -> bool:
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _start(self):
+        if self._is_running():
+            return
+        with self._start_lock:
+            if not self._is_running():
+                # a forked child inherits the queue but not the thread
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Write the queued rows in batches until :data:`_STOP`; runs in the writer thread."""
+        batch = []
+        taken = 0
+        deadline = None
+        stop = False
+        try:
+            while not stop:
+                try:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = _FLUSH
+                else:
+                    taken += 1
+                if item is _STOP:
+                    stop = True
+                elif item is not _FLUSH:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if len(batch) < self.batch_size:
+                        continue
+                self._write_batch(batch)
+                batch = []
+                deadline = None
+                for _ in range(taken):
+                    self._queue.task_done()
+                taken = 0
+        finally:
+            connections["logging"].close()
+
+    def _write_batch(self, rows: typing.List[tuple]):
+        if not rows:
+            return
+        try:
+            self.write_rows(rows)
+        except Exception as e:
+            # the rows are lost; the connection is reset for the next batch
+            print(f"Fout bij het loggen van {len(rows)} regels naar de database", e)
+            connections["logging"].close()
@@ -1,10 +1,9 @@
 import logging
+import threading
 import time
 import typing
 from contextvars import ContextVar
 
-from django.db.models import Max
-
 from .loggers import task_console_info
 
 # if typing.TYPE_CHECKING:
@@ -19,6 +18,10 @@ ctx_counts = ContextVar("counts", default=None)
 task_performance_logger = logging.getLogger("task.performance")
 sub_task_performance_logger = logging.getLogger("task.performance.sub")
 
+# highest (program, data) level written per (run id, task name), see record_level()
+_task_levels = {}
+_task_levels_lock = threading.Lock()
+
 
 def set_run(name: str):
     """Start (or continue) a ``LogRun`` context in the current async-safe scope.
@@ -170,12 +173,22 @@ def get_run() -> typing.Union["LogRun", None]:  # noqa: F821 — LogRun is provi
 
 
 def finish_run():
-    """Close the active ``LogRun`` by calling ``run.finish()`` and clearing the context."""
+    """Close the active ``LogRun`` by calling ``run.finish()`` and clearing the context.
+
+    The records queued by a :class:`~rgs_django_utils.logging.logging.QueuedPostgresHandler`
+    are written first, so the run's log is complete when it finishes.
+    """
+    from .db_handler import flush_log_handlers  # noqa: C0415, import here to prevent circular imports
+
     run = get_run()
     if run is not None:
         task_console_info(f"Run {run.name} finished")
+        flush_log_handlers()
         run.finish()
         ctx_run.set(None)
+        with _task_levels_lock:
+            for key in [key for key in _task_levels if key[0] == run.id]:
+                del _task_levels[key]
 
 
 def set_task(name: str, log_timing: bool = True):
@@ -240,9 +253,17 @@ def finish_task():
     When a ``LogRun`` is active, the final summary level is lifted to at
     least ``WARNING`` if any child log entry (program or data) reached
     that level, so the overview log surfaces failing tasks even when the
-    task itself returned successfully.
+    task itself returned successfully. The levels come from
+    :func:`get_task_levels`, without a query on the ``log`` table.
+
+    The data logs of the task aggregated by a ``PostgresHandler`` with
+    ``aggregate_data`` are written first.
     """
+    from .db_handler import finish_task_logs  # noqa: C0415, import here to prevent circular imports
+
     task_info = get_task_info()
+    if task_info:
+        finish_task_logs(get_run(), task_info["task_name"])
     if task_info and task_info.get("log_timing"):
         task_console_info(f"Finished task {task_info['task_name']}")
         duration = time.time() - task_info["start_time"]
@@ -256,27 +277,11 @@ def finish_task():
 
         run = get_run()
         if run:
-            prog_level = (
-                run.logs.filter(task_name=task_info["task_name"], is_data_log=False)
-                .aggregate(max_level=Max("level"))
-                .get("max_level", 0)
-            )
-
-            if prog_level is None:
-                prog_level = 0
+            prog_level, data_level = get_task_levels(run, task_info["task_name"])
 
             if prog_level >= logging.WARNING:
                 msg += f" programma {logging.getLevelName(prog_level)}"
 
-            data_level = (
-                run.logs.filter(task_name=task_info["task_name"], is_data_log=True)
-                .aggregate(max_level=Max("level"))
-                .get("max_level", 0)
-            )
-
-            if data_level is None:
-                data_level = 0
-
             if data_level >= logging.WARNING:
                 msg += f" data {logging.getLevelName(data_level)}"
 
@@ -293,9 +298,39 @@ def finish_task():
             task_performance_logger.info("\n".join(lines))
             ctx_counts.set(None)
 
+    if task_info:
+        # read above; the levels of a finished task (also without a run) are not kept for the process lifetime
+        _clear_task_levels(get_run(), task_info["task_name"])
     ctx_task_info.set(None)
 
 
+def record_level(run, task_name: str, level: int, is_data_log: bool):
+    """Remember *level* as written for *task_name* of *run* when it is the highest so far.
+
+    Called by :class:`~rgs_django_utils.logging.logging.PostgresHandler`
+    for every record it writes (or queues or aggregates), from any
+    thread; records it drops are not counted.
+    """
+    key = (run.id if run is not None else None, task_name)
+    with _task_levels_lock:
+        levels = _task_levels.setdefault(key, [0, 0])
+        index = 1 if is_data_log else 0
+        if level > levels[index]:
+            levels[index] = level
+
+
+def _clear_task_levels(run, task_name: str):
+    with _task_levels_lock:
+        _task_levels.pop((run.id if run is not None else None, task_name), None)
+
+
+def get_task_levels(run, task_name: str) -> typing.Tuple[int, int]:
+    """Return the highest ``(program, data)`` level written for *task_name* of *run* (``0`` for none)."""
+    with _task_levels_lock:
+        prog_level, data_level = _task_levels.get((run.id if run is not None else None, task_name), (0, 0))
+    return prog_level, data_level
+
+
 def set_extra_info(info: dict):
     """Merge *info* into the task's ``extra_info`` context dict.
 
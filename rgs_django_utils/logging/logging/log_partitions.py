@@ -0,0 +1,274 @@
+import datetime
+import re
+import typing
+
+from django.db import connections
+from psycopg import sql
+
+LOG_TABLE = "log"
+
+# upper bound of a range partition as shown by pg_get_expr()
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def _month_start(day: datetime.date, months: int = 0) -> datetime.date:
+    """Return the first day of the month *months* months after the month of *day*."""
+    index = day.year * 12 + day.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _timestamp(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc)
+
+
+def get_partition_name(month: datetime.date) -> str:
+    """Return the name of the partition of ``log`` for the month of *month*, e.g. ``log_p202610``."""
+    return f"{LOG_TABLE}_p{month:%Y%m}"
+
+
+def get_log_table_kind(using: str = "logging") -> typing.Union[str, None]:
+    """Return ``"partitioned"``, ``"table"`` or ``None`` (absent) for the ``log`` table."""
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", [LOG_TABLE])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return "partitioned" if row[0] == "p" else "table"
+
+
+def create_log_table(
+    using: str = "logging",
+    attach_existing: bool = False,
+    months_ahead: int = 3,
+    today: datetime.date = None,
+) -> typing.List[str]:
+    """Create ``log`` as a table partitioned by month on ``dt``, with its first partitions.
+
+    The columns are the ones :class:`~rgs_django_utils.logging.logging.PostgresHandler`
+    writes. The primary key is ``(id, dt)``, as a partitioned table needs
+    the partition key in every unique index.
+
+    Parameters
+    ----------
+    using : str, optional
+        Database alias. Default is ``"logging"``.
+    attach_existing : bool, optional
+        When ``log`` exists as a regular table: rename it to
+        ``log_legacy`` and attach it as the partition of everything up to
+        the end of the current month, so no log is lost and the old rows are purged
+        as one partition once they all fall outside the retention. Its
+        columns must match the partitioned table. Default is ``False``.
+    months_ahead : int, optional
+        Months after the current one to create a partition for. Default
+        is ``3``.
+    today : datetime.date, optional
+        Reference day. Default is today (UTC).
+
+    Returns
+    -------
+    list of str
+        The created partitions.
+
+    Raises
+    ------
+    ValueError
+        If ``log`` exists as a regular table and *attach_existing* is not
+        set.
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    kind = get_log_table_kind(using)
+    if kind == "partitioned":
+        return create_log_partitions(months_ahead, using, today)
+    if kind == "table" and not attach_existing:
+        raise ValueError(f"table {LOG_TABLE} exists and is not partitioned, use attach_existing to convert it")
+
+    table = sql.Identifier(LOG_TABLE)
+    legacy = sql.Identifier(f"{LOG_TABLE}_legacy")
+    with connections[using].cursor() as cursor:
+        cursor.execute("BEGIN;")
+        try:
+            if kind == "table":
+                cursor.execute(sql.SQL("ALTER TABLE {table} RENAME TO {legacy};").format(table=table, legacy=legacy))
+            cursor.execute(
+                sql.SQL("""
+                    CREATE TABLE {table} (
+                        id bigint GENERATED BY DEFAULT AS IDENTITY,
+                        run_id integer,
+                        task_name varchar(30),
+                        level integer NOT NULL,
+                        name varchar(30) NOT NULL,
+                        is_data_log boolean NOT NULL DEFAULT false,
+                        code integer,
+                        dt timestamp with time zone NOT NULL,
+                        message text NOT NULL,
+                        filename varchar(30),
+                        line_nr integer,
+                        extra jsonb,
+                        PRIMARY KEY (id, dt)
+                    ) PARTITION BY RANGE (dt);
+                    CREATE INDEX ON {table} (run_id, task_name);
+                """).format(table=table)
+            )
+            if kind == "table":
+                # the primary key of a partition must include the partition key
+                cursor.execute(
+                    "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p';",
+                    [f"{LOG_TABLE}_legacy"],
+                )
+                for (constraint,) in cursor.fetchall():
+                    cursor.execute(
+                        sql.SQL("ALTER TABLE {legacy} DROP CONSTRAINT {constraint};").format(
+                            legacy=legacy, constraint=sql.Identifier(constraint)
+                        )
+                    )
+                cursor.execute(sql.SQL("ALTER TABLE {legacy} ADD PRIMARY KEY (id, dt);").format(legacy=legacy))
+                # new ids continue after the old ones
+                cursor.execute(
+                    sql.SQL(
+                        "SELECT setval(pg_get_serial_sequence({name}, 'id'), coalesce(max(id), 0) + 1, false) "
+                        "FROM {legacy};"
+                    ).format(name=sql.Literal(LOG_TABLE), legacy=legacy)
+                )
+                cursor.execute(
+                    sql.SQL(
+                        "ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({upper});"
+                    ).format(table=table, legacy=legacy, upper=sql.Literal(_timestamp(_month_start(today, 1))))
+                )
+            cursor.execute("COMMIT;")
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            raise
+
+    # with a legacy partition the monthly partitions start next month
+    return create_log_partitions(months_ahead, using, today, first_month=1 if kind == "table" else 0)
+
+
+def create_log_partitions(
+    months_ahead: int = 3,
+    using: str = "logging",
+    today: datetime.date = None,
+    first_month: int = 0,
+) -> typing.List[str]:
+    """Create the missing monthly partitions of ``log`` up to *months_ahead* months after the current one.
+
+    Run it regularly (e.g. daily from a scheduler, with the retention
+    purge): a record whose month has no partition can't be written.
+
+    Parameters
+    ----------
+    months_ahead : int, optional
+        Months after the current one to create a partition for. Default
+        is ``3``.
+    using : str, optional
+        Database alias. Default is ``"logging"``.
+    today : datetime.date, optional
+        Reference day. Default is today (UTC).
+    first_month : int, optional
+        First month to create, relative to the current one. Default is
+        ``0``, the current month.
+
+    Returns
+    -------
+    list of str
+        The created partitions.
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    existing = {name for name, _ in get_log_partitions(using)}
+    created = []
+    with connections[using].cursor() as cursor:
+        for months in range(first_month, months_ahead + 1):
+            month = _month_start(today, months)
+            name = get_partition_name(month)
+            if name in existing:
+                continue
+            cursor.execute(
+                sql.SQL(
+                    "CREATE TABLE {partition} PARTITION OF {table} FOR VALUES FROM ({lower}) TO ({upper});"
+                ).format(
+                    partition=sql.Identifier(name),
+                    table=sql.Identifier(LOG_TABLE),
+                    lower=sql.Literal(_timestamp(month)),
+                    upper=sql.Literal(_timestamp(_month_start(month, 1))),
+                )
+            )
+            created.append(name)
+    return created
+
+
+def get_log_partitions(
+    using: str = "logging",
+) -> typing.List[typing.Tuple[str, typing.Union[datetime.datetime, None]]]:
+    """Return the ``(name, upper bound)`` of the partitions of ``log``, oldest first.
+
+    The upper bound is exclusive; it is ``None`` for a partition without
+    one (``MAXVALUE`` or the default partition).
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname;
+            """,
+            [LOG_TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _UPPER_BOUND.search(bound or "")
+        upper = datetime.datetime.fromisoformat(match.group(1)) if match else None
+        partitions.append((name, upper))
+    partitions.sort(key=lambda partition: (partition[1] is None, partition[1] or 0))
+    return partitions
+
+
+def purge_log_partitions(
+    keep_months: int,
+    using: str = "logging",
+    today: datetime.date = None,
+    dry_run: bool = False,
+) -> typing.List[str]:
+    """Detach and drop the partitions of ``log`` that only hold records older than the retention.
+
+    Whole partitions are removed, which takes a moment instead of the
+    hours (and bloat) of a ``DELETE``. The partitions are detached with
+    ``DETACH PARTITION ... CONCURRENTLY``, so the handlers keep writing
+    meanwhile; the call can't run inside a transaction.
+
+    Parameters
+    ----------
+    keep_months : int
+        Full months kept before the current one: with ``3`` on
+        2026-10-16 the partitions that end on or before 2026-07-01 are
+        dropped.
+    using : str, optional
+        Database alias. Default is ``"logging"``.
+    today : datetime.date, optional
+        Reference day. Default is today (UTC).
+    dry_run : bool, optional
+        Only return the partitions that would be dropped. Default is
+        ``False``.
+
+    Returns
+    -------
+    list of str
+        The dropped partitions.
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    cutoff = _timestamp(_month_start(today, -keep_months))
+    expired = [name for name, upper in get_log_partitions(using) if upper is not None and upper <= cutoff]
+    if dry_run:
+        return expired
+
+    with connections[using].cursor() as cursor:
+        for name in expired:
+            cursor.execute(
+                sql.SQL("ALTER TABLE {table} DETACH PARTITION {partition} CONCURRENTLY;").format(
+                    table=sql.Identifier(LOG_TABLE), partition=sql.Identifier(name)
+                )
+            )
+            cursor.execute(sql.SQL("DROP TABLE {partition};").format(partition=sql.Identifier(name)))
+    return expired
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+
+if __name__ == "__main__":
+    from rgs_django_utils.setup_django import setup_django
+
+    setup_django()
+
+
+class Command(BaseCommand):
+    """Maintain the monthly partitions of the ``log`` table.
+
+    Thin wrapper around
+    :mod:`~rgs_django_utils.logging.logging.log_partitions`, meant to run
+    daily from a scheduler: it creates the partitions of the coming months
+    and, with ``--keep_months``, drops the partitions older than the
+    retention.
+
+    With ``--create_table``: first creates ``log`` as a partitioned table;
+    add ``--attach_existing`` to convert an existing (unpartitioned) table.
+    """
+
+    help = "Create the partitions of the log table ahead of time and drop the expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--create_table",
+            action="store_true",
+            help="Create the log table as a partitioned table.",
+        )
+        parser.add_argument(
+            "--attach_existing",
+            action="store_true",
+            help="With --create_table: keep an existing log table as partition for the past months.",
+        )
+        parser.add_argument(
+            "--months_ahead",
+            type=int,
+            default=3,
+            help="Number of months after the current one to create a partition for. Default is 3.",
+        )
+        parser.add_argument(
+            "--keep_months",
+            type=int,
+            help="Drop the partitions older than this number of full months. Without it nothing is dropped.",
+        )
+        parser.add_argument(
+            "--dry_run",
+            action="store_true",
+            help="Only show the partitions that would be dropped.",
+        )
+        parser.add_argument(
+            "--database",
+            default="logging",
+            help="Database alias of the log table. Default is 'logging'.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Start log_partitions")
+
+        from rgs_django_utils.logging.logging.log_partitions import (
+            create_log_partitions,
+            create_log_table,
+            get_log_table_kind,
+            purge_log_partitions,
+        )
+
+        using = options.get("database") or "logging"
+        months_ahead = options.get("months_ahead", 3)
+
+        if options.get("create_table"):
+            try:
+                created = create_log_table(using, options.get("attach_existing", False), months_ahead)
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+        elif get_log_table_kind(using) != "partitioned":
+            raise CommandError("table log is not partitioned, run with --create_table first")
+        else:
+            created = create_log_partitions(months_ahead, using)
+        for name in created:
+            self.stdout.write(f"Partitie {name} aangemaakt")
+
+        if options.get("keep_months") is not None:
+            dry_run = options.get("dry_run", False)
+            for name in purge_log_partitions(options["keep_months"], using, dry_run=dry_run):
+                self.stdout.write(f"Partitie {name} {'zou worden verwijderd' if dry_run else 'verwijderd'}")
+
+        self.stdout.write(self.style.SUCCESS("Successfully ran log_partitions"))
+
+
+if __name__ == "__main__":
+    Command().handle()
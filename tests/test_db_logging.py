@@ -0,0 +1,412 @@
+"""Tests voor de logging naar de ``log``-tabel (``PostgresHandler`` en varianten).
+
+Het ``LogRun``-model hoort bij de app die dit package gebruikt; de tests
+gebruiken een eenvoudige vervanger met ``id``, ``success`` en ``finish()``.
+De ``log``-tabel wordt per test aangemaakt.
+"""
+
+import datetime
+import io
+import json
+import logging
+import threading
+import types
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rgs_django_utils.logging import levels
+from rgs_django_utils.logging.logging import (
+    OverflowPolicy,
+    PostgresHandler,
+    QueuedPostgresHandler,
+    finish_run,
+    finish_task,
+    finish_task_logs,
+    get_task_levels,
+    set_task,
+)
+from rgs_django_utils.logging.logging.log_context import _clear_task_levels, ctx_run
+from rgs_django_utils.logging.logging.log_partitions import (
+    create_log_partitions,
+    create_log_table,
+    get_log_partitions,
+    get_log_table_kind,
+    purge_log_partitions,
+)
+
+LOG_TABLE = """
+    CREATE TABLE log (
+        id bigserial PRIMARY KEY,
+        run_id integer,
+        task_name varchar(30),
+        level integer NOT NULL,
+        name varchar(30) NOT NULL,
+        is_data_log boolean NOT NULL,
+        code integer,
+        dt timestamp with time zone NOT NULL,
+        message text NOT NULL,
+        filename varchar(30) NOT NULL,
+        line_nr integer NOT NULL,
+        extra jsonb
+    );
+"""
+
+
+class FakeRun:
+    _meta = types.SimpleNamespace(db_table="log_run", pk=types.SimpleNamespace(column="id"))
+
+    def __init__(self, id):
+        self.id = self.pk = id
+        self.name = f"run {id}"
+        self.success = None
+        self.saved = 0
+        self.finished = False
+
+    def save(self):
+        self.saved += 1
+
+    def finish(self):
+        self.finished = True
+
+
+def _record(message, level=logging.INFO, name="test", **attributes):
+    record = logging.LogRecord(name, level, __file__, 1, message, None, None)
+    for key, value in attributes.items():
+        setattr(record, key, value)
+    return record
+
+
+class LogTableTestCase(TransactionTestCase):
+    databases = {"default", "logging"}
+
+    def setUp(self):
+        with connections["logging"].cursor() as cursor:
+            cursor.execute(LOG_TABLE)
+
+    def tearDown(self):
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("DROP TABLE log;")
+
+    def _logs(self, *columns):
+        with connections["logging"].cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM log ORDER BY id;")
+            return cursor.fetchall()
+
+
+class TestPostgresHandler(LogTableTestCase):
+    def test_emit_writes_record(self):
+        handler = PostgresHandler()
+        handler.emit(_record("hello", run=FakeRun(3), task_name="load", extra_info={"key": "value"}, code=12))
+
+        self.assertEqual(
+            self._logs("run_id", "task_name", "level", "message", "code", "extra", "is_data_log"),
+            [(3, "load", logging.INFO, "hello", 12, '{"key": "value"}', False)],
+        )
+
+
+class TestRunFailure(LogTableTestCase):
+    def setUp(self):
+        super().setUp()
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("CREATE TABLE log_run (id integer PRIMARY KEY, success boolean);")
+            cursor.execute("INSERT INTO log_run VALUES (1, NULL);")
+
+    def tearDown(self):
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("DROP TABLE log_run;")
+        super().tearDown()
+
+    def test_run_is_marked_failed_once(self):
+        run = FakeRun(1)
+        handler = PostgresHandler()
+
+        with CaptureQueriesContext(connections["logging"]) as queries:
+            for _ in range(3):
+                handler.emit(_record("broken", level=logging.ERROR, run=run))
+
+        updates = [query for query in queries.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual((run.success, run.saved), (False, 0))
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("SELECT success FROM log_run WHERE id = 1;")
+            self.assertIs(cursor.fetchone()[0], False)
+
+
+class TestAggregatedDataLogs(LogTableTestCase):
+    def _emit(self, handler, code=12, name="data.import", level=levels.DATA_WARNING, task_name="load", index=0):
+        handler.emit(
+            _record(
+                f"bad row {index}", level=level, name=name, task_name=task_name, code=code, extra_info={"row": index}
+            )
+        )
+
+    def test_groups_are_written_at_task_end(self):
+        handler = PostgresHandler(aggregate_data=True, samples=2)
+        for i in range(5):
+            self._emit(handler, index=i)
+        self._emit(handler, code=13)
+        self._emit(handler, task_name="other")
+        self._emit(handler, name="import", level=logging.INFO)
+
+        # only the program log is written right away
+        self.assertEqual(self._logs("message"), [("bad row 0",)])
+
+        finish_task_logs(None, "load")
+
+        rows = self._logs("message", "code", "extra")
+        self.assertEqual([row[:2] for row in rows], [("bad row 0", 12), ("bad row 0 (5x)", 12), ("bad row 0", 13)])
+        extra = json.loads(rows[1][2])
+        self.assertEqual(extra["count"], 5)
+        self.assertEqual(extra["sample_messages"], ["bad row 0", "bad row 1"])
+        self.assertEqual(extra["sample_extra"], [{"row": 0}, {"row": 1}])
+
+        # the group of the other task is written by close()
+        handler.close()
+        self.assertEqual(len(self._logs("id")), 4)
+
+    def test_queued_handler(self):
+        handler = QueuedPostgresHandler(aggregate_data=True)
+        try:
+            for i in range(3):
+                self._emit(handler, index=i)
+            handler.flush()
+        finally:
+            handler.close()
+
+        self.assertEqual(self._logs("message"), [("bad row 0 (3x)",)])
+
+
+class TestQueuedPostgresHandler(LogTableTestCase):
+    def test_batches_are_written_on_flush(self):
+        handler = QueuedPostgresHandler(batch_size=100, flush_interval=60)
+        try:
+            for i in range(250):
+                handler.emit(_record(f"message {i}", name="data.import"))
+            handler.flush()
+
+            rows = self._logs("message", "is_data_log")
+            self.assertEqual(len(rows), 250)
+            self.assertEqual(rows[-1], ("message 249", True))
+        finally:
+            handler.close()
+        self.assertIsNone(handler._thread)
+
+    def test_close_writes_pending_records(self):
+        handler = QueuedPostgresHandler(flush_interval=60)
+        handler.emit(_record("last words"))
+        handler.close()
+
+        self.assertEqual(self._logs("message"), [("last words",)])
+
+    def test_drop_policy(self):
+        written = threading.Event()
+        release = threading.Event()
+
+        class SlowHandler(QueuedPostgresHandler):
+            def write_rows(self, rows):
+                written.set()
+                release.wait()
+                super().write_rows(rows)
+
+        handler = SlowHandler(batch_size=1, queue_size=2, overflow=OverflowPolicy.DROP)
+        try:
+            handler.emit(_record("first"))
+            written.wait()
+            # the writer is busy with the first row, the queue holds two more
+            for i in range(5):
+                handler.emit(_record(f"message {i}"))
+            release.set()
+            handler.flush()
+        finally:
+            handler.close()
+
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(len(self._logs("message")), 3)
+
+    def test_dropped_records_are_not_counted_in_task_levels(self):
+        written = threading.Event()
+        release = threading.Event()
+
+        class SlowHandler(QueuedPostgresHandler):
+            def write_rows(self, rows):
+                written.set()
+                release.wait()
+                super().write_rows(rows)
+
+        handler = SlowHandler(batch_size=1, queue_size=1, overflow=OverflowPolicy.DROP)
+        try:
+            handler.emit(_record("first", task_name="dropping"))
+            written.wait()
+            handler.emit(_record("queued", task_name="dropping"))
+            handler.emit(_record("dropped", level=logging.ERROR, task_name="dropping"))
+            self.assertEqual(get_task_levels(None, "dropping"), (logging.INFO, 0))
+            release.set()
+        finally:
+            release.set()
+            handler.close()
+            _clear_task_levels(None, "dropping")
+
+        self.assertEqual(handler.dropped, 1)
+
+    @override_settings(DEBUG=True)
+    def test_block_policy_with_sql_debug_logging(self):
+        # the writer thread logs its own SQL while producers wait for room in the queue
+        handler = QueuedPostgresHandler(batch_size=1, queue_size=1)
+        logger = logging.getLogger("test.queued")
+        sql_logger = logging.getLogger("django.db.backends")
+        for log in (logger, sql_logger):
+            log.addHandler(handler)
+            self.addCleanup(log.removeHandler, handler)
+        self.addCleanup(sql_logger.setLevel, sql_logger.level)
+        sql_logger.setLevel(logging.DEBUG)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+
+        def produce():
+            for i in range(20):
+                logger.info("message %s", i)
+
+        producers = [threading.Thread(target=produce, daemon=True) for _ in range(2)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join(10)
+        # a deadlocked handler can't be closed, leave it to the daemon threads
+        self.assertFalse(any(producer.is_alive() for producer in producers))
+        logger.removeHandler(handler)
+        sql_logger.removeHandler(handler)
+        handler.close()
+
+        self.assertEqual(len(self._logs("message")), 40)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            QueuedPostgresHandler(overflow="wait")
+
+
+class TestTaskLevels(SimpleTestCase):
+    """Het hoogste niveau per run en taak wordt in het geheugen bijgehouden, zonder queries."""
+
+    def setUp(self):
+        self.run = FakeRun(7)
+        # an already failed run, so ERROR records don't update it
+        self.run.success = False
+        ctx_run.set(self.run)
+        self.addCleanup(ctx_run.set, None)
+        self.handler = PostgresHandler()
+
+    def _log(self, level, name="test", task_name="load"):
+        # what emit does, without writing the row
+        record = _record("message", level=level, name=name, run=self.run, task_name=task_name)
+        self.handler.track_level(record, self.handler.get_row(record))
+
+    def test_levels_per_task(self):
+        self._log(levels.WARNING)
+        self._log(levels.INFO)
+        self._log(levels.DATA_ERROR, name="data.import")
+        self._log(levels.ERROR, task_name="other")
+
+        self.assertEqual(get_task_levels(self.run, "load"), (levels.WARNING, levels.DATA_ERROR))
+        self.assertEqual(get_task_levels(self.run, "other"), (levels.ERROR, 0))
+        self.assertEqual(get_task_levels(FakeRun(8), "load"), (0, 0))
+
+        finish_run()
+        self.assertEqual(get_task_levels(self.run, "load"), (0, 0))
+
+    def test_finish_task_level(self):
+        set_task("load")
+        self._log(levels.DATA_ERROR, name="data.import")
+
+        # a SimpleTestCase fails on any query
+        with self.assertLogs("task.performance", level="INFO") as logs:
+            finish_task()
+
+        self.assertEqual(logs.records[0].levelno, levels.DATA_ERROR - 10)
+        self.assertIn("data", logs.records[0].getMessage())
+        # the levels of a finished task are dropped
+        self.assertEqual(get_task_levels(self.run, "load"), (0, 0))
+
+    def test_finish_task_without_run(self):
+        ctx_run.set(None)
+        set_task("no run", log_timing=False)
+        record = _record("message", level=levels.WARNING, task_name="no run")
+        self.handler.track_level(record, self.handler.get_row(record))
+        self.assertEqual(get_task_levels(None, "no run"), (levels.WARNING, 0))
+
+        finish_task()
+
+        self.assertEqual(get_task_levels(None, "no run"), (0, 0))
+
+
+class TestLogPartitions(TransactionTestCase):
+    databases = {"default", "logging"}
+    today = datetime.date(2026, 10, 16)
+
+    def tearDown(self):
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS log;")
+
+    def _partitions(self):
+        return [name for name, _ in get_log_partitions()]
+
+    def test_create_and_purge(self):
+        created = create_log_table(months_ahead=2, today=self.today)
+        self.assertEqual(created, ["log_p202610", "log_p202611", "log_p202612"])
+        self.assertEqual(get_log_table_kind(), "partitioned")
+
+        # a month later only the new month is added
+        self.assertEqual(create_log_partitions(2, today=datetime.date(2026, 11, 1)), ["log_p202701"])
+        self.assertEqual(create_log_table(months_ahead=2, today=datetime.date(2026, 11, 1)), [])
+
+        self.assertEqual(purge_log_partitions(1, today=datetime.date(2026, 12, 5), dry_run=True), ["log_p202610"])
+        self.assertEqual(len(self._partitions()), 4)
+        self.assertEqual(purge_log_partitions(1, today=datetime.date(2026, 12, 5)), ["log_p202610"])
+        self.assertEqual(self._partitions(), ["log_p202611", "log_p202612", "log_p202701"])
+
+    def test_handlers_write_to_partitions(self):
+        create_log_table()
+        PostgresHandler().emit(_record("single"))
+        handler = QueuedPostgresHandler(flush_interval=60)
+        try:
+            for i in range(5):
+                handler.emit(_record(f"batch {i}"))
+        finally:
+            handler.close()
+
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text, count(*) FROM log GROUP BY 1;")
+            self.assertEqual(cursor.fetchall(), [(self._partitions()[0], 6)])
+
+    def test_attach_existing_table(self):
+        with connections["logging"].cursor() as cursor:
+            cursor.execute(LOG_TABLE)
+        handler = PostgresHandler()
+        handler.emit(_record("old"))
+
+        with self.assertRaises(ValueError):
+            create_log_table()
+        created = create_log_table(attach_existing=True, months_ahead=1)
+        # the legacy table holds the current month, the monthly partitions start next month
+        self.assertEqual(self._partitions(), ["log_legacy", *created])
+        self.assertEqual(len(created), 1)
+
+        handler.emit(_record("new"))
+        with connections["logging"].cursor() as cursor:
+            cursor.execute("SELECT id, message, tableoid::regclass::text FROM log ORDER BY id;")
+            self.assertEqual(cursor.fetchall(), [(1, "old", "log_legacy"), (2, "new", "log_legacy")])
+
+        # the legacy partition goes once the current month is out of the retention
+        purge_log_partitions(0, today=datetime.date.today() + datetime.timedelta(days=62))
+        self.assertEqual(self._partitions(), [])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("log_partitions", "--create_table", "--months_ahead", "1", stdout=out)
+        self.assertEqual(len(self._partitions()), 2)
+        self.assertIn("Successfully ran log_partitions", out.getvalue())
+
+        call_command("log_partitions", "--months_ahead", "1", "--keep_months", "0", "--dry_run", stdout=out)
+        self.assertEqual(len(self._partitions()), 2)
@@ -0,0 +1,85 @@
+"""Tests voor de import tuning profielen (``SET LOCAL`` per transactie)."""
+
+import uuid
+
+from django.db import DataError, connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from rgs_django_utils.database.db_types import ImportMethod, StagingMode
+from rgs_django_utils.database.import_tuning import get_tuning_profile, import_tuning
+from rgs_django_utils.database.upsert_multiple_data import upsert_multiple_data
+from tests.testapp.models import ParentModel
+
+PROFILES = {"bulk": {"work_mem": "96MB", "synchronous_commit": False}}
+
+
+def _work_mem():
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW work_mem;")
+        return cursor.fetchone()[0]
+
+
+class TestGetTuningProfile(SimpleTestCase):
+    @override_settings(IMPORT_TUNING_PROFILES=PROFILES)
+    def test_named_profile(self):
+        self.assertEqual(get_tuning_profile("bulk"), (("work_mem", "96MB"), ("synchronous_commit", "off")))
+
+    def test_dict_and_none(self):
+        self.assertEqual(
+            get_tuning_profile({"tapp.skip_recalc_flagging": True}), (("tapp.skip_recalc_flagging", "on"),)
+        )
+        self.assertEqual(get_tuning_profile(None), ())
+        # the result is accepted again, so it can be passed on
+        self.assertEqual(get_tuning_profile((("work_mem", "1GB"),)), (("work_mem", "1GB"),))
+
+    @override_settings(IMPORT_TUNING_PROFILES=PROFILES)
+    def test_unknown_profile(self):
+        with self.assertRaisesMessage(ValueError, "'fast'"):
+            get_tuning_profile("fast")
+
+    def test_invalid_setting_name(self):
+        with self.assertRaises(ValueError):
+            get_tuning_profile({"work_mem; DROP TABLE x": "1MB"})
+
+
+@override_settings(IMPORT_TUNING_PROFILES=PROFILES)
+class TestImportTuning(TransactionTestCase):
+    def test_settings_only_last_for_the_block(self):
+        before = _work_mem()
+        with import_tuning("bulk"):
+            self.assertEqual(_work_mem(), "96MB")
+        self.assertEqual(_work_mem(), before)
+
+    def test_upsert_with_profile(self):
+        rows = [(uuid.uuid4(), f"ids {i}", i) for i in range(10)]
+        before = _work_mem()
+
+        for staging in (StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE):
+            ParentModel.objects.all().delete()
+            stats = upsert_multiple_data(
+                ParentModel,
+                rows,
+                ["uuid", "ids", "int_field"],
+                ["ids", "int_field"],
+                ["uuid"],
+                method=ImportMethod.REPLACE,
+                page_size=4,
+                staging=staging,
+                tuning="bulk",
+            )
+            self.assertEqual(stats.inserted, 10)
+
+        # SET LOCAL ends with the transactions of the upsert
+        self.assertEqual(_work_mem(), before)
+
+    def test_profile_is_applied_in_the_upsert(self):
+        with self.assertRaises(DataError):
+            upsert_multiple_data(
+                ParentModel,
+                [(uuid.uuid4(), "ids", 1)],
+                ["uuid", "ids", "int_field"],
+                ["ids"],
+                ["uuid"],
+                tuning={"work_mem": "lots"},
+            )
+        self.assertEqual(ParentModel.objects.count(), 0)
@@ -0,0 +1,146 @@
+"""Tests voor de async upsert-functies op een psycopg ``AsyncConnection``."""
+
+import uuid
+
+import psycopg
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.test import TransactionTestCase
+
+from rgs_django_utils.database.db_types import DuplicateMode, ImportMethod, RowErrorMode, StagingMode, TransferMethod
+from rgs_django_utils.database.upsert_async import (
+    aupsert_from_existing_data,
+    aupsert_multiple_data,
+    get_async_connection,
+)
+from tests.testapp.models import ParentModel
+
+FIELDS = ["uuid", "ids", "int_field"]
+
+
+def _make_rows(count, offset=0):
+    return [(uuid.UUID(int=i + 1), f"row {i}", i + offset) for i in range(count)]
+
+
+async def _arows(rows):
+    for row in rows:
+        yield row
+
+
+class TestAupsertMultipleData(TransactionTestCase):
+    async def _upsert(self, data, **kwargs):
+        return await aupsert_multiple_data(ParentModel, data, FIELDS, FIELDS, ["uuid"], **kwargs)
+
+    async def _table(self):
+        return [row async for row in ParentModel.objects.order_by("uuid").values_list(*FIELDS)]
+
+    async def test_insert_and_update(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                with self.subTest(staging=staging, transfer=transfer):
+                    await ParentModel.objects.all().adelete()
+                    await self._upsert(_make_rows(5), page_size=2, staging=staging, transfer=transfer)
+                    stats = await self._upsert(
+                        _arows(_make_rows(7, offset=100)), page_size=3, staging=staging, transfer=transfer
+                    )
+
+                    self.assertEqual(await self._table(), _make_rows(7, offset=100))
+                    self.assertEqual((stats.inserted, stats.updated), (2, 5))
+
+    async def test_replace_on_own_connection(self):
+        await self._upsert(_make_rows(6))
+
+        async with await get_async_connection() as aconnection:
+            stats = await self._upsert(
+                _make_rows(3), method=ImportMethod.REPLACE, delete_chunk_size=2, aconnection=aconnection, prepare=True
+            )
+            # the connection stays usable after the upsert
+            self.assertEqual(await (await aconnection.execute("SELECT 1")).fetchone(), (1,))
+
+        self.assertEqual(await self._table(), _make_rows(3))
+        self.assertEqual(stats.deleted, 3)
+
+    async def test_failing_page_leaves_connection_usable(self):
+        rows = _make_rows(4)
+        rows[3] = (rows[3][0], rows[3][1], "not a number")
+
+        async with await get_async_connection() as aconnection:
+            with self.assertRaises(psycopg.Error):
+                await self._upsert(rows, page_size=2, aconnection=aconnection)
+            self.assertEqual(aconnection.info.transaction_status, psycopg.pq.TransactionStatus.IDLE)
+
+        self.assertEqual(await ParentModel.objects.acount(), 2)
+
+    async def test_deduplicate(self):
+        rows = _make_rows(3)
+
+        stats = await self._upsert(rows + [rows[0][:2] + (100,)], deduplicate=DuplicateMode.KEEP_LAST)
+
+        self.assertEqual(await self._table(), [rows[0][:2] + (100,)] + rows[1:])
+        self.assertEqual((stats.inserted, stats.duplicates), (3, 1))
+
+    async def test_empty_input(self):
+        self.assertEqual((await self._upsert(_arows([]))).total, 0)
+
+    async def test_replace_without_records_in_scope(self):
+        await self._upsert(_make_rows(3))
+
+        stats = await self._upsert(_arows([]), method=ImportMethod.REPLACE, replace_scope={"int_field": 1})
+
+        self.assertEqual(await self._table(), [_make_rows(3)[0], _make_rows(3)[2]])
+        self.assertEqual(stats.deleted, 1)
+
+    async def test_unsupported_options(self):
+        for option in {"workers": 2}, {"page_bytes": 1000}, {"page_seconds": 1.0}, {"on_error": RowErrorMode.ISOLATE}:
+            with self.subTest(option=option), self.assertRaisesMessage(ValueError, next(iter(option))):
+                await self._upsert(_make_rows(1), **option)
+
+    async def test_requires_autocommit(self):
+        async with await psycopg.AsyncConnection.connect(**connection.get_connection_params()) as aconnection:
+            with self.assertRaises(ValueError):
+                await self._upsert(_make_rows(1), aconnection=aconnection)
+
+
+class TestAupsertFromExistingData(TransactionTestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE import_source (uuid uuid, ids text, int_field integer)")
+            cursor.executemany("INSERT INTO import_source VALUES (%s, %s, %s)", _make_rows(3, offset=100)[1:])
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE import_source")
+
+    async def test_upsert(self):
+        await aupsert_multiple_data(ParentModel, _make_rows(2), FIELDS, FIELDS, ["uuid"])
+
+        updated, inserted = await aupsert_from_existing_data(
+            model=ParentModel,
+            source_table_name="import_source",
+            cols=[{"target": field} for field in FIELDS],
+            update_field_names=FIELDS,
+            identification_field_names=["uuid"],
+        )
+
+        self.assertEqual((updated, inserted), (1, 1))
+        table = await sync_to_async(list)(ParentModel.objects.order_by("uuid").values_list(*FIELDS))
+        self.assertEqual(table, [_make_rows(1)[0]] + _make_rows(3, offset=100)[1:])
+
+    async def test_replace_with_empty_source(self):
+        await aupsert_multiple_data(ParentModel, _make_rows(5), FIELDS, FIELDS, ["uuid"])
+        await sync_to_async(self._empty_source)()
+
+        await aupsert_from_existing_data(
+            model=ParentModel,
+            source_table_name="import_source",
+            cols=[{"target": field} for field in FIELDS],
+            update_field_names=FIELDS,
+            identification_field_names=["uuid"],
+            method=ImportMethod.REPLACE,
+        )
+
+        self.assertEqual(await ParentModel.objects.acount(), 5)
+
+    def _empty_source(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM import_source")
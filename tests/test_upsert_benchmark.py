@@ -0,0 +1,67 @@
+"""Rooktest van ``benchmarks/upsert_benchmark.py`` op een paar rijen, zodat de benchmark niet veroudert."""
+
+import json
+import os
+import tempfile
+
+from django.apps import apps
+from django.test import SimpleTestCase, TransactionTestCase
+
+from benchmarks.upsert_benchmark import case_key, compare, has_postgis, main
+
+
+class TestUpsertBenchmark(TransactionTestCase):
+    def test_runs_and_compares(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "upsert.json")
+            args = ["--kinds", "narrow", "json", "array", "--rows", "20", "--page-sizes", "8", "--in-process"]
+
+            self.assertEqual(main(args + ["--output", output]), 0)
+
+            with open(output) as f:
+                results = json.load(f)["results"]
+            self.assertEqual(len(results), 3 * 4 * 2)
+            replace = next(r for r in results if r["method"] == "replace")
+            self.assertEqual(replace["stats"]["inserted"] + replace["stats"]["updated"], 20)
+            self.assertEqual(replace["stats"]["deleted"], 5)
+
+            # a baseline that is far faster than any run counts as a regression
+            for result in results:
+                result["rows_per_s"] *= 1000
+            with open(output, "w") as f:
+                json.dump({"results": results}, f)
+            self.assertEqual(
+                main(["--kinds", "narrow", "--rows", "20", "--page-sizes", "8", "--in-process", "--compare", output]),
+                1,
+            )
+
+        self.assertFalse(any(model._meta.db_table.startswith("bench_") for model in apps.get_models()))
+
+    def test_geometry_formats(self):
+        if not has_postgis():
+            self.skipTest("PostGIS is not installed")
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "upsert.json")
+            args = ["--kinds", "polygon", "--rows", "20", "--page-sizes", "8", "--methods", "replace"]
+
+            self.assertEqual(main(args + ["--in-process", "--output", output]), 0)
+
+            with open(output) as f:
+                results = json.load(f)["results"]
+            self.assertEqual(
+                [(r["transfer"], r["geometry_format"]) for r in results],
+                [("values", "wkt"), ("values", "wkb"), ("copy", "wkt"), ("copy", "wkb")],
+            )
+            for result in results:
+                self.assertEqual(result["stats"], results[0]["stats"])
+            self.assertEqual(results[0]["stats"]["deleted"], 5)
+
+
+class TestCaseKey(SimpleTestCase):
+    def test_results_without_geometry_format_are_wkt(self):
+        case = {"kind": "narrow", "rows": 20, "method": "overwrite", "page_size": 8, "transfer": "copy"}
+        self.assertEqual(case_key(case), case_key({**case, "geometry_format": "wkt"}))
+
+        previous = {"results": [{**case, "rows_per_s": 1000.0}]}
+        self.assertEqual(len(compare(previous, [{**case, "geometry_format": "wkt", "rows_per_s": 10.0}], 0.2)), 1)
+        self.assertEqual(compare(previous, [{**case, "geometry_format": "wkb", "rows_per_s": 10.0}], 0.2), [])
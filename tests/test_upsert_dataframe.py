@@ -0,0 +1,101 @@
+"""Tests voor ``upsert_dataframe``."""
+
+import uuid
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+from django.test import SimpleTestCase, TransactionTestCase
+
+from rgs_django_utils.database.db_types import ImportMethod, RowErrorMode
+from rgs_django_utils.database.upsert_dataframe import _encode_geometry, _pg_array_literal, upsert_dataframe
+from tests.testapp.models import ParentModel
+
+FIELDS = ["uuid", "ids", "int_field"]
+
+
+def _make_frame(count, offset=0):
+    return pd.DataFrame(
+        {
+            "uuid": [uuid.UUID(int=i + 1) for i in range(count)],
+            "ids": [f"row {i}" for i in range(count)],
+            "int_field": [i + offset for i in range(count)],
+        }
+    )
+
+
+class TestUpsertDataframe(TransactionTestCase):
+    def _table(self):
+        return list(ParentModel.objects.order_by("uuid").values_list(*FIELDS))
+
+    def test_insert_and_update(self):
+        stats = upsert_dataframe(ParentModel, _make_frame(5), FIELDS, page_size=2)
+        self.assertEqual((stats.inserted, stats.updated, stats.pages), (5, 0, 3))
+
+        stats = upsert_dataframe(ParentModel, _make_frame(7, offset=100), FIELDS, page_size=3)
+        self.assertEqual((stats.inserted, stats.updated), (2, 5))
+        self.assertEqual(self._table(), list(_make_frame(7, offset=100).itertuples(index=False, name=None)))
+
+    def test_isolate_bad_rows(self):
+        frame = _make_frame(6)
+        frame.loc[4, "ids"] = None
+
+        stats = upsert_dataframe(ParentModel, frame, FIELDS, page_size=4, on_error=RowErrorMode.ISOLATE)
+
+        self.assertEqual((stats.inserted, stats.failed), (5, 1))
+        self.assertEqual(stats.rejects[0].row["uuid"], str(frame["uuid"][4]))
+
+    def test_text_values_survive_csv(self):
+        frame = _make_frame(4)
+        frame["ids"] = ['quote " and, comma', "new\nline", "", "back\\slash"]
+
+        upsert_dataframe(ParentModel, frame, FIELDS)
+
+        self.assertEqual([row[1] for row in self._table()], frame["ids"].tolist())
+
+    def test_iterable_of_frames(self):
+        frame = _make_frame(6)
+        chunks = (frame.iloc[start : start + 4] for start in range(0, 6, 4))
+
+        stats = upsert_dataframe(ParentModel, chunks, FIELDS, method=ImportMethod.ONLY_NEW, page_size=3)
+
+        self.assertEqual(stats.inserted, 6)
+        self.assertEqual(stats.pages, 3)
+
+    def test_missing_column(self):
+        with self.assertRaises(ValueError):
+            upsert_dataframe(ParentModel, _make_frame(2).drop(columns="int_field"), FIELDS)
+
+    def test_empty_frame(self):
+        self.assertEqual(upsert_dataframe(ParentModel, _make_frame(0), FIELDS).total, 0)
+
+    def test_empty_frame_with_replace_scope(self):
+        upsert_dataframe(ParentModel, _make_frame(3), FIELDS)
+
+        stats = upsert_dataframe(
+            ParentModel, _make_frame(0), FIELDS, method=ImportMethod.REPLACE, replace_scope={"int_field": 1}
+        )
+
+        self.assertEqual(sorted(ParentModel.objects.values_list("int_field", flat=True)), [0, 2])
+        self.assertEqual(stats.deleted, 1)
+
+
+class TestDataframeEncoding(SimpleTestCase):
+    def test_encode_geometry_reprojects_geoseries(self):
+        gs = gpd.GeoSeries([shapely.Point(5.0, 52.0), None], crs=4326)
+
+        encoded = _encode_geometry(gs, 28992)
+
+        self.assertTrue(encoded[0].startswith("\\x"))
+        point = shapely.from_wkb(bytes.fromhex(encoded[0][2:]))
+        self.assertAlmostEqual(point.x, 128_410, delta=10)
+        self.assertTrue(pd.isna(encoded[1]))
+
+    def test_encode_geometry_from_wkt(self):
+        encoded = _encode_geometry(pd.Series(["POINT (1 2)", None]), 28992)
+
+        self.assertEqual(shapely.from_wkb(bytes.fromhex(encoded[0][2:])), shapely.Point(1, 2))
+        self.assertTrue(pd.isna(encoded[1]))
+
+    def test_pg_array_literal(self):
+        self.assertEqual(_pg_array_literal([1, None, 'a "b"']), '{"1",NULL,"a \\"b\\""}')
@@ -0,0 +1,692 @@
+"""Tests voor ``upsert_multiple_data``.
+
+De upsert beheert zelf zijn transacties (``BEGIN`` / ``COMMIT`` per pagina),
+daarom draaien deze tests als ``TransactionTestCase`` in plaats van binnen
+de transactie van een gewone ``TestCase``.
+"""
+
+import uuid
+
+import shapely
+from django.db import DataError, connection
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from rgs_django_utils.database.db_types import (
+    DuplicateMode,
+    GeometryFormat,
+    ImportMethod,
+    RecordMergeMethod,
+    RowErrorMode,
+    StagingMode,
+    TransferMethod,
+    UnresolvedLookup,
+)
+from rgs_django_utils.database.upsert_multiple_data import (
+    AdaptivePageSize,
+    UnresolvedLookupError,
+    UpsertStats,
+    _encode_wkb,
+    _get_staging_type,
+    _get_staging_value,
+    get_upsert_plan,
+    upsert_from_existing_data,
+    upsert_multiple_data,
+)
+from rgs_django_utils.logging.logging.log_context import TaskContext, get_count_info
+from tests.testapp.models import ChildModel, MiddleModel, ParentModel
+
+FIELDS = ["uuid", "ids", "int_field"]
+
+
+def _make_rows(count, offset=0):
+    return [(uuid.UUID(int=i + 1), f"row {i}", i + offset) for i in range(count)]
+
+
+class TestUpsertMultipleData(TransactionTestCase):
+    def _upsert(self, data, **kwargs):
+        kwargs.setdefault("method", ImportMethod.OVERWRITE)
+        return upsert_multiple_data(
+            model=ParentModel,
+            data=data,
+            data_fields=FIELDS,
+            update_field_names=FIELDS,
+            identification_field_names=["uuid"],
+            **kwargs,
+        )
+
+    def _table(self):
+        return list(ParentModel.objects.order_by("uuid").values_list(*FIELDS))
+
+    def test_insert_and_update(self):
+        self._upsert(_make_rows(5), page_size=2)
+        self.assertEqual(self._table(), _make_rows(5))
+
+        self._upsert(_make_rows(7, offset=100), page_size=3)
+        self.assertEqual(self._table(), _make_rows(7, offset=100))
+
+    def test_only_new_keeps_existing_rows(self):
+        self._upsert(_make_rows(3))
+        self._upsert(_make_rows(5, offset=100), method=ImportMethod.ONLY_NEW)
+
+        self.assertEqual(self._table(), _make_rows(3) + _make_rows(5, offset=100)[3:])
+
+    def test_only_update_ignores_new_rows(self):
+        self._upsert(_make_rows(3))
+        self._upsert(_make_rows(5, offset=100), method=ImportMethod.ONLY_UPDATE)
+
+        self.assertEqual(self._table(), _make_rows(3, offset=100))
+
+    def test_dict_rows(self):
+        rows = [dict(zip(FIELDS, row)) for row in _make_rows(3)]
+        self._upsert(rows)
+
+        self.assertEqual(self._table(), _make_rows(3))
+
+    def test_data_fields_order_differs_from_update_fields(self):
+        rows = [(ids, value, row_uuid) for row_uuid, ids, value in _make_rows(3)]
+        upsert_multiple_data(
+            model=ParentModel,
+            data=rows,
+            data_fields=["ids", "int_field", "uuid"],
+            update_field_names=["int_field", "ids"],
+            identification_field_names=["uuid"],
+        )
+
+        self.assertEqual(self._table(), _make_rows(3))
+
+    def test_empty_input(self):
+        self.assertEqual(self._upsert([]).as_dict(), UpsertStats().as_dict())
+        self._upsert(iter([]))
+
+        self.assertEqual(self._table(), [])
+
+    def test_stats(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                with self.subTest(staging=staging, transfer=transfer):
+                    ParentModel.objects.all().delete()
+                    stats = self._upsert(_make_rows(5), page_size=2, staging=staging, transfer=transfer)
+                    self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.rejected), (5, 0, 0, 0))
+                    self.assertEqual(stats.pages, 1 if staging == StagingMode.SINGLE_MERGE else 3)
+
+                    stats = self._upsert(_make_rows(7, offset=100), page_size=2, staging=staging, transfer=transfer)
+                    self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.rejected), (2, 5, 0, 0))
+
+    def test_stats_only_new_and_only_update(self):
+        self._upsert(_make_rows(3))
+
+        stats = self._upsert(_make_rows(5, offset=100), method=ImportMethod.ONLY_NEW, page_size=2)
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.rejected), (2, 0, 3, 0))
+
+        stats = self._upsert(_make_rows(7, offset=100), method=ImportMethod.ONLY_UPDATE, page_size=2)
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.rejected), (0, 5, 0, 2))
+        self.assertEqual(stats.total, 7)
+
+    def test_generator_is_consumed_page_by_page(self):
+        pulled = []
+
+        def rows():
+            for row in _make_rows(10):
+                pulled.append(row)
+                yield row
+
+        for transfer in (TransferMethod.VALUES, TransferMethod.COPY):
+            with self.subTest(transfer=transfer):
+                pulled.clear()
+                ParentModel.objects.all().delete()
+                with self.assertRaises(ZeroDivisionError):
+                    self._upsert(
+                        (row if row[2] != 5 else 1 / 0 for row in rows()),
+                        page_size=2,
+                        transfer=transfer,
+                    )
+                # pages before the failing row are written, nothing after it is read
+                self.assertEqual(len(pulled), 6)
+                self.assertEqual(self._table(), _make_rows(4))
+
+        self._upsert(rows(), page_size=3)
+        self.assertEqual(self._table(), _make_rows(10))
+
+    def test_copy_transfers_give_same_result_as_values(self):
+        for transfer in (TransferMethod.COPY, TransferMethod.COPY_TEXT):
+            with self.subTest(transfer=transfer):
+                ParentModel.objects.all().delete()
+                self._upsert(_make_rows(5), page_size=2, transfer=transfer)
+                self._upsert(_make_rows(7, offset=100), page_size=2, transfer=transfer)
+
+                self.assertEqual(self._table(), _make_rows(7, offset=100))
+
+    def test_copy_text_accepts_string_values(self):
+        rows = [(str(row_uuid), ids, str(value)) for row_uuid, ids, value in _make_rows(3)]
+        self._upsert(rows, transfer=TransferMethod.COPY_TEXT)
+
+        self.assertEqual(self._table(), _make_rows(3))
+
+    def test_failing_copy_page_is_rolled_back(self):
+        rows = _make_rows(3)
+        rows[2] = (rows[2][0], None, 2)  # ids is NOT NULL
+
+        with self.assertRaises(Exception):
+            self._upsert(rows, page_size=2, transfer=TransferMethod.COPY)
+
+        # first page committed, second page rolled back, connection usable
+        self.assertEqual(self._table(), _make_rows(2))
+
+    def test_staging_modes_give_same_result(self):
+        for staging in (StagingMode.REUSE, StagingMode.SINGLE_MERGE):
+            for transfer in (TransferMethod.VALUES, TransferMethod.COPY):
+                with self.subTest(staging=staging, transfer=transfer):
+                    ParentModel.objects.all().delete()
+                    self._upsert(_make_rows(5), page_size=2, staging=staging, transfer=transfer)
+                    self._upsert(_make_rows(7, offset=100), page_size=2, staging=staging, transfer=transfer)
+
+                    self.assertEqual(self._table(), _make_rows(7, offset=100))
+
+    def test_failing_page_per_staging_mode(self):
+        rows = _make_rows(5)
+        rows[3] = (rows[3][0], None, 3)  # ids is NOT NULL
+
+        expected = {
+            StagingMode.PER_PAGE: _make_rows(2),
+            StagingMode.REUSE: _make_rows(2),
+            # one transaction for the whole import: nothing is written
+            StagingMode.SINGLE_MERGE: [],
+        }
+        for staging, expected_rows in expected.items():
+            with self.subTest(staging=staging):
+                ParentModel.objects.all().delete()
+                with self.assertRaises(Exception):
+                    self._upsert(rows, page_size=2, staging=staging)
+
+                self.assertEqual(self._table(), expected_rows)
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT to_regclass('pg_temp.newvals')")
+                    self.assertIsNone(cursor.fetchone()[0])
+
+    def test_skip_unchanged(self):
+        rows = _make_rows(6)
+        rows[1] = (rows[1][0], "changed", 1)
+
+        expected = {
+            ImportMethod.OVERWRITE: (2, 1, 3, 0),
+            ImportMethod.ONLY_UPDATE: (0, 1, 3, 2),
+        }
+        for method, counts in expected.items():
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                with self.subTest(method=method, transfer=transfer):
+                    ParentModel.objects.all().delete()
+                    self._upsert(_make_rows(4))
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT txid_current()")
+                        last_txid = cursor.fetchone()[0]
+
+                    stats = self._upsert(rows, method=method, transfer=transfer, skip_unchanged=True)
+
+                    self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.rejected), counts)
+                    # only the changed row got a new row version
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT ids FROM testapp_parentmodel WHERE xmin::text::bigint > %s AND int_field < 4",
+                            [last_txid],
+                        )
+                        self.assertEqual(cursor.fetchall(), [("changed",)])
+
+    def test_plan_is_cached(self):
+        self._upsert(_make_rows(2))
+        hits = get_upsert_plan.cache_info().hits
+
+        self._upsert(_make_rows(3))
+
+        self.assertEqual(get_upsert_plan.cache_info().hits, hits + 1)
+
+    def test_prepared_merge(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            with self.subTest(staging=staging):
+                ParentModel.objects.all().delete()
+                self._upsert(_make_rows(5), page_size=2, staging=staging, prepare=True)
+                stats = self._upsert(_make_rows(7, offset=100), page_size=2, staging=staging, prepare=True)
+
+                self.assertEqual(self._table(), _make_rows(7, offset=100))
+                self.assertEqual((stats.inserted, stats.updated), (2, 5))
+
+    def test_replace_deletes_absent_rows(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                with self.subTest(staging=staging, transfer=transfer):
+                    ParentModel.objects.all().delete()
+                    self._upsert(_make_rows(7))
+
+                    stats = self._upsert(
+                        _make_rows(4, offset=100)[1:],
+                        method=ImportMethod.REPLACE,
+                        page_size=2,
+                        staging=staging,
+                        transfer=transfer,
+                        delete_chunk_size=2,
+                    )
+
+                    self.assertEqual(self._table(), _make_rows(4, offset=100)[1:])
+                    self.assertEqual((stats.inserted, stats.updated, stats.deleted), (0, 3, 4))
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT to_regclass('pg_temp.import_keys'), to_regclass('pg_temp.delete_keys')")
+                        self.assertEqual(cursor.fetchone(), (None, None))
+
+    def test_replace_deletes_in_chunks(self):
+        self._upsert(_make_rows(1000), page_size=500)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self._upsert(_make_rows(10), method=ImportMethod.REPLACE, page_size=500, delete_chunk_size=7)
+
+        chunks = [query for query in queries.captured_queries if "FROM delete_keys WHERE nr" in query["sql"]]
+        self.assertEqual((len(chunks), stats.deleted), (142, 990))
+        self.assertEqual(self._table(), _make_rows(10))
+
+    def test_replace_scope(self):
+        self._upsert(_make_rows(6))
+
+        stats = self._upsert(_make_rows(2), method=ImportMethod.REPLACE, replace_scope={"int_field": 5})
+
+        # only the absent row within the scope is deleted
+        self.assertEqual(self._table(), _make_rows(5))
+        self.assertEqual(stats.deleted, 1)
+
+    def test_replace_without_records(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            with self.subTest(staging=staging):
+                ParentModel.objects.all().delete()
+                self._upsert(_make_rows(3))
+
+                # without a scope an empty import leaves the table alone
+                with self.assertLogs("rgs_django_utils.database.upsert_multiple_data", level="WARNING"):
+                    stats = self._upsert([], method=ImportMethod.REPLACE, staging=staging)
+                self.assertEqual((stats.deleted, ParentModel.objects.count()), (0, 3))
+
+                stats = self._upsert([], method=ImportMethod.REPLACE, staging=staging, replace_scope={"int_field": 1})
+                self.assertEqual(self._table(), [_make_rows(3)[0], _make_rows(3)[2]])
+                self.assertEqual(stats.deleted, 1)
+
+    def test_parallel_workers(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            with self.subTest(staging=staging):
+                ParentModel.objects.all().delete()
+                self._upsert(_make_rows(20), page_size=3, staging=staging, workers=3)
+                stats = self._upsert(
+                    (row for row in _make_rows(30, offset=100)), page_size=3, staging=staging, workers=3
+                )
+
+                self.assertEqual(self._table(), _make_rows(30, offset=100))
+                self.assertEqual((stats.inserted, stats.updated, stats.total), (10, 20, 30))
+
+    def test_parallel_failing_partition(self):
+        rows = _make_rows(20)
+        rows[7] = (rows[7][0], rows[7][1], "not a number")
+
+        with self.assertRaises(Exception):
+            self._upsert(rows, page_size=2, workers=3)
+
+        # the other partitions are upserted and every worker released its connection
+        self.assertGreater(ParentModel.objects.count(), 0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_parallel_rejects_replace(self):
+        with self.assertRaises(ValueError):
+            self._upsert(_make_rows(2), method=ImportMethod.REPLACE, workers=2)
+
+    def test_stats_add(self):
+        total = UpsertStats(inserted=1, updated=2, pages=1) + UpsertStats(unchanged=3, deleted=4, pages=2)
+
+        self.assertEqual(total.as_dict(), UpsertStats(1, 2, 3, 0, 4, 3).as_dict())
+
+    def test_adaptive_page_size(self):
+        for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+            with self.subTest(transfer=transfer):
+                ParentModel.objects.all().delete()
+                # rows are some tens of bytes, so a 100 byte budget shrinks the pages of 20 rows
+                stats = self._upsert(_make_rows(50), page_size=20, page_bytes=100, transfer=transfer)
+
+                self.assertEqual(ParentModel.objects.count(), 50)
+                self.assertEqual(sum(stats.page_sizes), 50)
+                self.assertEqual(stats.page_sizes[0], 20)
+                self.assertLess(max(stats.page_sizes[1:]), 20)
+
+    def test_adaptive_page_size_rejects_workers(self):
+        with self.assertRaises(ValueError):
+            self._upsert(_make_rows(2), page_seconds=1.0, workers=2)
+
+    def _bad_rows(self):
+        rows = _make_rows(20)
+        rows[3] = (rows[3][0], rows[3][1], "not a number")
+        rows[17] = (rows[17][0], None, 17)
+        return rows
+
+    def test_isolate_bad_rows(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE:
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                with self.subTest(staging=staging, transfer=transfer):
+                    ParentModel.objects.all().delete()
+                    stats = self._upsert(
+                        self._bad_rows(),
+                        page_size=8,
+                        staging=staging,
+                        transfer=transfer,
+                        on_error=RowErrorMode.ISOLATE,
+                    )
+
+                    rows = _make_rows(20)
+                    self.assertEqual(self._table(), rows[:3] + rows[4:17] + rows[18:])
+                    self.assertEqual((stats.inserted, stats.failed, stats.total), (18, 2, 20))
+                    self.assertEqual((stats.pages, stats.page_sizes), (3, [8, 8, 4]))
+                    self.assertEqual([reject.row["uuid"] for reject in stats.rejects], [rows[3][0], rows[17][0]])
+                    self.assertEqual(stats.rejects[1].sqlstate, "23502")  # not_null_violation
+                    self.assertIn("ids", stats.rejects[1].error)
+
+    def test_isolate_bad_rows_in_parallel(self):
+        stats = self._upsert(self._bad_rows(), page_size=4, workers=2, on_error=RowErrorMode.ISOLATE)
+
+        self.assertEqual((ParentModel.objects.count(), stats.failed), (18, 2))
+
+    def test_isolate_keeps_rows_of_rejects_with_replace(self):
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE:
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                with self.subTest(staging=staging, transfer=transfer):
+                    ParentModel.objects.all().delete()
+                    self._upsert(_make_rows(21))
+
+                    stats = self._upsert(
+                        self._bad_rows(),
+                        method=ImportMethod.REPLACE,
+                        page_size=8,
+                        staging=staging,
+                        transfer=transfer,
+                        on_error=RowErrorMode.ISOLATE,
+                    )
+
+                    # the rejected rows keep their old values, only the row absent from the input is deleted
+                    self.assertEqual(self._table(), _make_rows(20))
+                    self.assertEqual((stats.failed, stats.deleted), (2, 1))
+
+    def test_bad_row_raises_by_default(self):
+        with self.assertRaises(DataError):
+            self._upsert(self._bad_rows(), page_size=8)
+        self.assertEqual(ParentModel.objects.count(), 0)
+
+    def test_deduplicate(self):
+        rows = _make_rows(4)
+        # key 2 three times, key 4 twice
+        data = rows[:2] + [rows[1][:2] + (101,)] + rows[2:] + [rows[1][:2] + (102,), rows[3][:2] + (103,)]
+        for staging in StagingMode.PER_PAGE, StagingMode.REUSE, StagingMode.SINGLE_MERGE:
+            for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+                for deduplicate, kept in (DuplicateMode.KEEP_FIRST, (1, 3)), (DuplicateMode.KEEP_LAST, (102, 103)):
+                    with self.subTest(staging=staging, transfer=transfer, deduplicate=deduplicate):
+                        ParentModel.objects.all().delete()
+                        stats = self._upsert(data, staging=staging, transfer=transfer, deduplicate=deduplicate)
+
+                        self.assertEqual([row[2] for row in self._table()], [0, kept[0], 2, kept[1]])
+                        self.assertEqual((stats.inserted, stats.duplicates, stats.total), (4, 3, 7))
+
+    def test_deduplicate_over_pages_with_single_merge(self):
+        rows = _make_rows(3)
+        data = rows + [rows[0][:2] + (100,)]
+
+        stats = self._upsert(data, page_size=2, staging=StagingMode.SINGLE_MERGE, deduplicate=DuplicateMode.KEEP_FIRST)
+
+        self.assertEqual(self._table(), rows)
+        self.assertEqual(stats.duplicates, 1)
+
+    def test_merge_new_leading_keeps_values_for_none(self):
+        rows = _make_rows(3)
+        for transfer in TransferMethod.VALUES, TransferMethod.COPY:
+            with self.subTest(transfer=transfer):
+                ParentModel.objects.all().delete()
+                self._upsert(rows)
+
+                stats = self._upsert(
+                    [(rows[0][0], None, 100), (rows[1][0], "new", None), (rows[2][0], None, None)],
+                    transfer=transfer,
+                    merge_method=RecordMergeMethod.MERGE_NEW_LEADING,
+                    skip_unchanged=True,
+                )
+
+                self.assertEqual(self._table(), [(rows[0][0], "row 0", 100), (rows[1][0], "new", 1), rows[2]])
+                self.assertEqual((stats.updated, stats.unchanged), (2, 1))
+
+    def test_merge_existing_leading_fills_only_missing_values(self):
+        rows = _make_rows(2)
+        self._upsert(rows)
+
+        stats = self._upsert(
+            _make_rows(3, offset=100), merge_method=RecordMergeMethod.MERGE_EXISTING_LEADING, skip_unchanged=True
+        )
+
+        self.assertEqual(self._table(), rows + _make_rows(3, offset=100)[2:])
+        self.assertEqual((stats.inserted, stats.unchanged), (1, 2))
+
+    def test_isolate_rejects_single_merge(self):
+        with self.assertRaises(ValueError):
+            self._upsert(_make_rows(2), staging=StagingMode.SINGLE_MERGE, on_error=RowErrorMode.ISOLATE)
+
+    def test_phase_timings(self):
+        expected = {
+            TransferMethod.VALUES: {"read", "encode", "merge", "delete"},
+            TransferMethod.COPY: {"read", "setup", "transfer", "merge", "delete"},
+        }
+        for transfer, phases in expected.items():
+            with self.subTest(transfer=transfer):
+                calls = []
+                stats = self._upsert(
+                    _make_rows(10),
+                    page_size=4,
+                    transfer=transfer,
+                    method=ImportMethod.REPLACE,
+                    on_timing=lambda *args: calls.append(args),
+                )
+
+                self.assertEqual(set(stats.timings), phases)
+                self.assertEqual((stats.timings["read"]["calls"], stats.timings["read"]["rows"]), (3, 10))
+                self.assertEqual(stats.timings["merge"]["rows"], 10)
+                self.assertEqual(len(calls), sum(timing["calls"] for timing in stats.timings.values()))
+                self.assertTrue(all(seconds >= 0 for _, seconds, _ in calls))
+
+    def test_timings_in_task_summary(self):
+        name = f"upsert {ParentModel._meta.db_table}"
+        with TaskContext("import"):
+            self._upsert(_make_rows(5))
+            self._upsert(_make_rows(5, offset=10))
+            counts = get_count_info()
+
+        self.assertEqual((counts[f"{name} inserted"], counts[f"{name} updated"]), (5, 5))
+        self.assertIn(f"{name} merge ms", counts)
+
+
+class TestAdaptivePageSize(SimpleTestCase):
+    def test_shrinks_to_byte_budget(self):
+        sizer = AdaptivePageSize(1000, target_bytes=1000)
+        sizer.record(rows=1000, sent_bytes=10_000, seconds=1.0)
+        self.assertEqual(sizer.size, 100)
+
+    def test_growth_is_capped(self):
+        sizer = AdaptivePageSize(100, target_seconds=1.0, max_growth=2.0)
+        sizer.record(rows=100, sent_bytes=0, seconds=0.01)
+        self.assertEqual(sizer.size, 200)
+
+    def test_tightest_target_wins(self):
+        sizer = AdaptivePageSize(100, target_bytes=1000, target_seconds=1.0)
+        sizer.record(rows=100, sent_bytes=1000, seconds=2.0)
+        self.assertEqual(sizer.size, 50)
+
+    def test_bounds(self):
+        sizer = AdaptivePageSize(10, target_bytes=1, min_size=5)
+        sizer.record(rows=10, sent_bytes=1000, seconds=1.0)
+        self.assertEqual(sizer.size, 5)
+
+    def test_needs_target(self):
+        with self.assertRaises(ValueError):
+            AdaptivePageSize(10)
+
+
+class TestWkbGeometry(SimpleTestCase):
+    def test_encode_wkb(self):
+        point = shapely.Point(1.123456789, 2)
+        ewkb = shapely.to_wkb(shapely.set_srid(point, 28992), include_srid=True)
+
+        encoded = _encode_wkb([point, ewkb, ewkb.hex(), None], 28992)
+
+        for value in encoded[:3]:
+            # plain WKB at full precision
+            self.assertEqual(value, shapely.to_wkb(point))
+        self.assertIsNone(encoded[3])
+
+    def test_encode_wkb_rejects_other_srid(self):
+        ewkb = shapely.to_wkb(shapely.set_srid(shapely.Point(1, 2), 4326), include_srid=True)
+
+        with self.assertRaises(ValueError):
+            _encode_wkb([ewkb], 28992)
+
+    def test_wkb_staging(self):
+        db_type = "geometry(MULTIPOLYGON,28992)"
+
+        self.assertEqual(_get_staging_type(db_type, TransferMethod.COPY, GeometryFormat.WKB), "bytea")
+        self.assertEqual(
+            _get_staging_value("geom", db_type, TransferMethod.VALUES, geometry_format=GeometryFormat.WKB).as_string(),
+            'ST_GeomFromWKB("newvals"."geom", 28992)',
+        )
+
+
+class TestUpsertFromExistingData(TransactionTestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE import_source (uuid uuid, ids text, int_field integer)")
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE import_source")
+
+    def test_replace(self):
+        upsert_multiple_data(ParentModel, _make_rows(5), FIELDS, FIELDS, ["uuid"])
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO import_source VALUES (%s, %s, %s)", _make_rows(3, offset=100)[1:])
+
+        updated, inserted = upsert_from_existing_data(
+            model=ParentModel,
+            source_table_name="import_source",
+            cols=[{"target": field} for field in FIELDS],
+            update_field_names=FIELDS,
+            identification_field_names=["uuid"],
+            method=ImportMethod.REPLACE,
+            delete_chunk_size=2,
+        )
+
+        self.assertEqual((updated, inserted), (2, 0))
+        self.assertEqual(
+            list(ParentModel.objects.order_by("uuid").values_list(*FIELDS)), _make_rows(3, offset=100)[1:]
+        )
+
+    def test_replace_with_empty_source(self):
+        upsert_multiple_data(ParentModel, _make_rows(5), FIELDS, FIELDS, ["uuid"])
+
+        def replace(**kwargs):
+            return upsert_from_existing_data(
+                model=ParentModel,
+                source_table_name="import_source",
+                cols=[{"target": field} for field in FIELDS],
+                update_field_names=FIELDS,
+                identification_field_names=["uuid"],
+                method=ImportMethod.REPLACE,
+                **kwargs,
+            )
+
+        # without a scope an empty source leaves the table alone
+        with self.assertLogs("rgs_django_utils.database.upsert_multiple_data", level="WARNING"):
+            replace()
+        self.assertEqual(ParentModel.objects.count(), 5)
+
+        replace(replace_scope={"int_field": 1})
+        self.assertEqual(ParentModel.objects.count(), 4)
+
+    def test_merge_new_leading(self):
+        rows = _make_rows(2)
+        upsert_multiple_data(ParentModel, rows, FIELDS, FIELDS, ["uuid"])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO import_source VALUES (%s, %s, %s)", [(rows[0][0], None, 100), (rows[1][0], "new", None)]
+            )
+
+        updated, inserted = upsert_from_existing_data(
+            model=ParentModel,
+            source_table_name="import_source",
+            cols=[{"target": field} for field in FIELDS],
+            update_field_names=FIELDS,
+            identification_field_names=["uuid"],
+            merge_method=RecordMergeMethod.MERGE_NEW_LEADING,
+        )
+
+        self.assertEqual((updated, inserted), (2, 0))
+        self.assertEqual(
+            list(ParentModel.objects.order_by("uuid").values_list(*FIELDS)),
+            [(rows[0][0], "row 0", 100), (rows[1][0], "new", 1)],
+        )
+
+
+class TestLookupColumns(TransactionTestCase):
+    def setUp(self):
+        parent = ParentModel.objects.create(ids="parent")
+        self.middles = {ids: MiddleModel.objects.create(ids=ids, parent_model=parent) for ids in ("a", "b")}
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE import_source (uuid uuid, ids text, middle_code text)")
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE import_source")
+
+    def _upsert(self, codes, **lookup):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO import_source VALUES (%s, %s, %s)",
+                [(uuid.UUID(int=i + 1), f"child {i}", code) for i, code in enumerate(codes)],
+            )
+        return upsert_from_existing_data(
+            model=ChildModel,
+            source_table_name="import_source",
+            cols=[
+                {"target": "uuid"},
+                {"target": "ids"},
+                {"target": "middle_model_id", "source": "middle_code", "lookup": "ids", **lookup},
+                {"target": "int_field", "value": 0},
+            ],
+            update_field_names=["ids", "middle_model_id"],
+            identification_field_names=["uuid"],
+        )
+
+    def _middles(self):
+        return list(ChildModel.objects.order_by("uuid").values_list("middle_model_id", flat=True))
+
+    def test_resolves_natural_keys(self):
+        self.assertEqual(self._upsert(["a", "b", "a", None]), (0, 4))
+
+        a, b = self.middles["a"].pk, self.middles["b"].pk
+        self.assertEqual(self._middles(), [a, b, a, None])
+
+    def test_unresolved_keys_raise_before_writing(self):
+        with self.assertRaises(UnresolvedLookupError) as raised:
+            self._upsert(["a", "x", "y", "x"])
+
+        self.assertEqual(raised.exception.unresolved, ["x", "y"])
+        self.assertEqual(ChildModel.objects.count(), 0)
+
+    def test_unresolved_keys_set_null(self):
+        self._upsert(["x", "b"], unresolved=UnresolvedLookup.SET_NULL)
+
+        self.assertEqual(self._middles(), [None, self.middles["b"].pk])
+
+    def test_ambiguous_keys_raise(self):
+        MiddleModel.objects.create(ids="a", parent_model=ParentModel.objects.get())
+
+        with self.assertRaises(UnresolvedLookupError) as raised:
+            self._upsert(["a", "b"], unresolved=UnresolvedLookup.SET_NULL)
+
+        self.assertEqual((raised.exception.unresolved, raised.exception.ambiguous), ([], ["a"]))
@@ -0,0 +1,62 @@
+"""Tests voor ``upsert_relations``."""
+
+from django.test import TransactionTestCase
+
+from rgs_django_utils.database.db_types import ImportMethod
+from rgs_django_utils.database.upsert_relations import upsert_relations
+from tests.testapp.models import ManyToManyModel, MiddleModel, ParentModel
+
+
+class TestUpsertRelations(TransactionTestCase):
+    def setUp(self):
+        parent = ParentModel.objects.create(ids="parent")
+        self.middles = [MiddleModel.objects.create(ids=f"middle {i}", parent_model=parent) for i in range(4)]
+        self.owners = [ManyToManyModel.objects.create(ids=f"owner {i}") for i in range(2)]
+
+    def _pairs(self, links):
+        return [(self.owners[owner].pk, self.middles[middle].pk) for owner, middle in links]
+
+    def _links(self):
+        owners = {owner.pk: i for i, owner in enumerate(self.owners)}
+        middles = {middle.pk: i for i, middle in enumerate(self.middles)}
+        through = ManyToManyModel.middle_model_m2m.through.objects.values_list("manytomanymodel_id", "middlemodel_id")
+        return sorted((owners[owner], middles[middle]) for owner, middle in through)
+
+    def test_add_links(self):
+        self.owners[0].middle_model_m2m.add(self.middles[0])
+
+        stats = upsert_relations(ManyToManyModel, "middle_model_m2m", self._pairs([(0, 0), (0, 1), (1, 2), (0, 1)]))
+
+        self.assertEqual(self._links(), [(0, 0), (0, 1), (1, 2)])
+        self.assertEqual((stats.inserted, stats.unchanged, stats.duplicates, stats.deleted), (2, 1, 1, 0))
+
+    def test_replace_links_of_the_input_rows(self):
+        upsert_relations(ManyToManyModel, "middle_model_m2m", self._pairs([(0, 0), (0, 1), (1, 2)]))
+
+        stats = upsert_relations(
+            ManyToManyModel, "middle_model_m2m", self._pairs([(0, 1), (0, 3)]), method=ImportMethod.REPLACE
+        )
+
+        # owner 1 is not in the input and keeps its link
+        self.assertEqual(self._links(), [(0, 1), (0, 3), (1, 2)])
+        self.assertEqual((stats.inserted, stats.unchanged, stats.deleted), (1, 1, 1))
+
+    def test_replace_with_from_ids_clears_rows_without_pairs(self):
+        upsert_relations(ManyToManyModel, "middle_model_m2m", self._pairs([(0, 0), (1, 2)]))
+
+        stats = upsert_relations(
+            ManyToManyModel,
+            "middle_model_m2m",
+            [],
+            method=ImportMethod.REPLACE,
+            from_ids=[owner.pk for owner in self.owners],
+        )
+
+        self.assertEqual(self._links(), [])
+        self.assertEqual(stats.deleted, 2)
+
+    def test_rejects_other_fields_and_methods(self):
+        with self.assertRaises(ValueError):
+            upsert_relations(ManyToManyModel, "ids", [])
+        with self.assertRaises(ValueError):
+            upsert_relations(ManyToManyModel, "middle_model_m2m", [], method=ImportMethod.ONLY_UPDATE)
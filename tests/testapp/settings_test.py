@@ -85,6 +85,8 @@ DATABASES = {
         "PORT": "5431",
     }
 }
+# the PostgresHandler writes to its own alias; in the tests it is the default database
+DATABASES["logging"] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators